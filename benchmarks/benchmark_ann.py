@@ -0,0 +1,116 @@
+"""
+Recall@k, QPS and latency of the approximate index types against the exact flat index.
+
+Usage: python -m benchmarks.benchmark_ann [--vectors 100000] [--dimension 256] [--k 10]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.models.index_factory import build_faiss_index
+
+
+def make_dataset(num_vectors, num_queries, dimension, num_clusters=256):
+    """Clustered vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((num_clusters, dimension), dtype="float32")
+    labels = rng.integers(0, num_clusters, num_vectors + num_queries)
+    vectors = centers[labels] + 0.5 * rng.standard_normal(
+        (num_vectors + num_queries, dimension), dtype="float32"
+    )
+    return vectors[:num_vectors], vectors[num_vectors:]
+
+
+def recall_at_k(found_ids, true_ids):
+    return np.mean(
+        [
+            len(set(found) & set(true)) / len(true)
+            for found, true in zip(found_ids, true_ids)
+        ]
+    )
+
+
+def benchmark(name, retrieval_config, vectors, queries, true_ids, k):
+    start_time = time.perf_counter()
+    faiss_index = build_faiss_index(
+        vectors.shape[1], [(np.arange(len(vectors)), vectors)], retrieval_config
+    )
+    build_time = time.perf_counter() - start_time
+
+    # Batched search gives the throughput, one query at a time gives the latency
+    start_time = time.perf_counter()
+    _, found_ids = faiss_index.search(queries, k)
+    qps = len(queries) / (time.perf_counter() - start_time)
+
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        faiss_index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+    recall = recall_at_k(found_ids, true_ids) if true_ids is not None else 1.0
+    print(
+        f"| {name} | {build_time:.2f} | {recall:.3f} | {qps:,.0f} | {np.percentile(latencies, 50):.3f} | {np.percentile(latencies, 99):.3f} |"
+    )
+    return found_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=1024)
+    args = parser.parse_args()
+
+    vectors, queries = make_dataset(args.vectors, args.queries, args.dimension)
+    configurations = [("flat", {"index_type": "flat"})]
+    for nprobe in (4, 16, 64):
+        configurations.append(
+            (
+                f"ivf_flat nprobe={nprobe}",
+                {
+                    "index_type": "ivf_flat",
+                    "ivf_flat": {"nlist": args.nlist, "nprobe": nprobe},
+                },
+            )
+        )
+        configurations.append(
+            (
+                f"ivf_pq nprobe={nprobe}",
+                {
+                    "index_type": "ivf_pq",
+                    "ivf_pq": {
+                        "nlist": args.nlist,
+                        "nprobe": nprobe,
+                        "m": args.dimension // 8,
+                        "nbits": 8,
+                    },
+                },
+            )
+        )
+    for ef_search in (16, 64, 256):
+        configurations.append(
+            (
+                f"hnsw efSearch={ef_search}",
+                {"index_type": "hnsw", "hnsw": {"m": 32, "ef_search": ef_search}},
+            )
+        )
+
+    print(f"{args.vectors} vectors of dimension {args.dimension}, recall@{args.k}")
+    print("| Index | Build (s) | Recall | QPS (batch) | p50 (ms) | p99 (ms) |")
+    print("| :--- | ---: | ---: | ---: | ---: | ---: |")
+    true_ids = None
+    for name, retrieval_config in configurations:
+        found_ids = benchmark(
+            name, retrieval_config, vectors, queries, true_ids, args.k
+        )
+        if true_ids is None:  # The flat index gives the exact neighbours
+            true_ids = found_ids
+
+
+if __name__ == "__main__":
+    main()
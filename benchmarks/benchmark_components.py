@@ -0,0 +1,246 @@
+"""
+Micro-benchmarks of the ingestion and query components against the OpenAI stand-in.
+
+Usage: python -m benchmarks.benchmark_components [--sizes 1000 10000 100000] [--latency 0.05]
+Writes the results to benchmarks/results/components-<commit>.json (see --output), to be
+compared between commits with: python -m benchmarks.compare old.json new.json
+"""
+
+import argparse
+import platform
+
+# Only runs git with fixed arguments (see get_commit)
+import subprocess  # nosec B404
+import tempfile
+import json
+import time
+import os
+
+import faiss
+import numpy as np
+
+from benchmarks.openai_stand_in import OpenAIStandIn
+from src.models.index_factory import search_filtered
+from src.pipelines.query_pipeline import QueryPipeline
+from src.utils.chunking import chunk_sections
+from src.utils.utils import (
+    load_models_config,
+    split_markdown_by_headers_with_hierarchy,
+    split_markdown_with_metadata,
+)
+
+WORDS = (
+    "index vector query section model token latency header document answer cache "
+    "embedding search prompt context batch merge score cluster memory"
+).split()
+
+
+def make_markdown(num_sections, words_per_section=50):
+    """Markdown with `num_sections` headers of levels 1 to 3, each followed by text."""
+    rng = np.random.default_rng(0)
+    words = np.array(WORDS)[
+        rng.integers(0, len(WORDS), (num_sections, words_per_section))
+    ]
+    return "\n".join(
+        f"{'#' * (1 + i % 3)} Header {i}\n{' '.join(row)}\n"
+        for i, row in enumerate(words)
+    )
+
+
+def measure(function, runs=1, items=None):
+    """Runs `function` `runs` times and returns latency statistics in seconds."""
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    result = {
+        "runs": runs,
+        "mean": float(np.mean(durations)),
+        "min": float(np.min(durations)),
+        "p50": float(np.percentile(durations, 50)),
+        "p99": float(np.percentile(durations, 99)),
+    }
+    if items:
+        result["items_per_second"] = items / result["mean"]
+    return result
+
+
+def get_commit():
+    # Fixed command, looked up in PATH like any developer tool
+    try:
+        return subprocess.run(  # nosec B603 B607
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def benchmark_size(num_sections, args, models_config, directory_path):
+    """Benchmarks every component on a corpus of `num_sections` sections."""
+    results = {}
+    query_pipeline = QueryPipeline("sk-stand-in", models_config)
+    query_pipeline.set_model(args.embedding_model)
+    embedder = query_pipeline.embedder
+    manager = query_pipeline.model_inference_manager
+    manager.set_model(args.inference_model)
+
+    markdown = make_markdown(num_sections)
+    markdown_path = os.path.join(directory_path, "corpus.md")
+    with open(markdown_path, "w", encoding="utf-8") as f:
+        f.write(markdown)
+
+    results["split_markdown_by_headers_with_hierarchy"] = measure(
+        lambda: split_markdown_by_headers_with_hierarchy(markdown),
+        args.runs,
+        num_sections,
+    )
+    sections = split_markdown_with_metadata(markdown)
+    results["chunk_sections"] = measure(
+        lambda: chunk_sections(sections, embedder.chunking_config),
+        args.runs,
+        num_sections,
+    )
+    results["read_and_process_markdown"] = measure(
+        lambda: embedder.read_and_process_markdown(markdown_path),
+        args.runs,
+        num_sections,
+    )
+    texts = split_markdown_by_headers_with_hierarchy(markdown)
+    embedder.texts = texts
+    # Embeds through the stand-in once, the vectors are reused by the next stages
+    results["generate_embeddings"] = measure(
+        embedder.generate_embeddings, 1, num_sections
+    )
+    results["create_faiss_index"] = measure(
+        embedder.create_faiss_index, args.runs, num_sections
+    )
+
+    databases_path = os.path.join(directory_path, "databases")
+    os.makedirs(databases_path)
+    ids = np.arange(num_sections)
+    for chunk in np.array_split(ids, args.databases):
+        query_pipeline.save_database(
+            databases_path,
+            chunk.tolist(),
+            [texts[i] for i in chunk],
+            [None] * len(chunk),
+            embedder.embeddings[chunk],
+        )
+    results["load_and_merge_databases (cold)"] = measure(
+        lambda: QueryPipeline("", models_config).load_and_merge_databases(
+            databases_path, use_cache=False
+        ),
+        args.runs,
+        num_sections,
+    )
+    QueryPipeline("", models_config).load_and_merge_databases(databases_path)
+    results["load_and_merge_databases (cached)"] = measure(
+        lambda: QueryPipeline("", models_config).load_and_merge_databases(
+            databases_path
+        ),
+        args.runs,
+        num_sections,
+    )
+
+    # Distinct queries, so that none of them is answered by the query cache
+    queries = iter(f"question {i} about {WORDS[i % len(WORDS)]}" for i in range(10**9))
+    results["search_similar_sections"] = measure(
+        lambda: embedder.search_similar_sections(next(queries), args.k), args.queries
+    )
+    query_embedding = embedder.embed_query("question about the index")
+    results["search_embedding"] = measure(
+        lambda: embedder.search_embedding(query_embedding, args.k), args.queries
+    )
+    # Searches restricted to a share of the sections, as with metadata filters
+    query_embeddings = np.array([query_embedding], dtype="float32")
+    for share in (0.5, 0.1, 0.01, 0.001):
+        selected_ids = np.arange(0, num_sections, round(1 / share))
+        results[f"search_filtered ({share:.1%})"] = measure(
+            lambda: search_filtered(
+                embedder.faiss_index, query_embeddings, args.k, selected_ids
+            ),
+            args.queries,
+        )
+    documents = embedder.search_embedding(query_embedding, args.k)
+    results["prepare_prompt_for_llm"] = measure(
+        lambda: manager.prepare_prompt_for_llm(
+            "Software engineer", "question about the index", documents
+        ),
+        args.queries,
+    )
+    return [
+        {"benchmark": name, "sections": num_sections, **result}
+        for name, result in results.items()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--databases", type=int, default=10)
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--inference-model", default="gpt-3.5-turbo-0125")
+    parser.add_argument("--config", default="config/models_config.yml")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    commit = get_commit()
+    output_path = args.output or os.path.join(
+        "benchmarks", "results", f"components-{commit}.json"
+    )
+    models_config = load_models_config(args.config)
+    # The stand-in has no rate limits: measure the components, not the throttling
+    for group in models_config["models"]:
+        for variant in group["variants"]:
+            variant.pop("requests_per_minute", None)
+            variant.pop("tokens_per_minute", None)
+
+    results = []
+    with OpenAIStandIn(args.latency, args.dimension) as stand_in:
+        models_config["client"] = {
+            **(models_config.get("client") or {}),
+            "base_url": stand_in.base_url,
+        }
+        print("| Benchmark | Sections | Runs | Mean (ms) | p50 (ms) | p99 (ms) |")
+        print("| :--- | ---: | ---: | ---: | ---: | ---: |")
+        for num_sections in args.sizes:
+            with tempfile.TemporaryDirectory() as directory_path:
+                for result in benchmark_size(
+                    num_sections, args, models_config, directory_path
+                ):
+                    print(
+                        f"| {result['benchmark']} | {num_sections} | {result['runs']} | {result['mean'] * 1000:.3f} | {result['p50'] * 1000:.3f} | {result['p99'] * 1000:.3f} |"
+                    )
+                    results.append(result)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(
+            {
+                "metadata": {
+                    "commit": commit,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "faiss": faiss.__version__,
+                    "numpy": np.__version__,
+                    "arguments": vars(args),
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
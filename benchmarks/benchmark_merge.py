@@ -0,0 +1,77 @@
+"""
+Startup time of QueryPipeline.load_and_merge_databases vs. the number of databases.
+
+Usage: python -m benchmarks.benchmark_merge [--vectors-per-file 50] [--dimension 1536]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from src.pipelines.query_pipeline import QueryPipeline
+
+
+def create_databases(directory_path, num_files, vectors_per_file, dimension):
+    rng = np.random.default_rng(0)
+    for i in range(num_files):
+        faiss_index = faiss.IndexFlatL2(dimension)
+        faiss_index.add(rng.random((vectors_per_file, dimension), dtype="float32"))
+        faiss.write_index(faiss_index, os.path.join(directory_path, f"db_{i}.bin"))
+        with open(os.path.join(directory_path, f"db_{i}.json"), "w") as f:
+            json.dump([f"text {i}-{j}" for j in range(vectors_per_file)], f)
+
+
+def per_vector_merge(directory_path):
+    """The former merge: one reconstruct() call per vector, then np.vstack."""
+    all_embeddings = []
+    for filename in os.listdir(directory_path):
+        if filename.endswith(".bin"):
+            faiss_index = faiss.read_index(os.path.join(directory_path, filename))
+            embeddings = np.zeros((faiss_index.ntotal, faiss_index.d), dtype="float32")
+            for i in range(faiss_index.ntotal):
+                embeddings[i, :] = faiss_index.reconstruct(i)
+            all_embeddings.append(embeddings)
+    combined_embeddings = np.vstack(all_embeddings)
+    combined_index = faiss.IndexFlatL2(combined_embeddings.shape[1])
+    combined_index.add(combined_embeddings)
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--vectors-per-file", type=int, default=50)
+    parser.add_argument("--dimension", type=int, default=1536)
+    args = parser.parse_args()
+
+    print(
+        "| Files | Vectors | Per-vector merge (s) | Bulk merge (s) | Warm cache (s) |"
+    )
+    print("| ---: | ---: | ---: | ---: | ---: |")
+    for num_files in args.files:
+        with tempfile.TemporaryDirectory() as directory_path:
+            create_databases(
+                directory_path, num_files, args.vectors_per_file, args.dimension
+            )
+            per_vector = timed(per_vector_merge, directory_path)
+            # Cold start: merges the databases and writes the cache
+            bulk = timed(QueryPipeline("", {}).load_and_merge_databases, directory_path)
+            # Warm start: a new pipeline only loads the cached merged index
+            warm = timed(QueryPipeline("", {}).load_and_merge_databases, directory_path)
+        print(
+            f"| {num_files} | {num_files * args.vectors_per_file} | {per_vector:.3f} | {bulk:.3f} | {warm:.3f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Memory, search latency and recall@k of the vector storage options against float32.
+
+Usage: python -m benchmarks.benchmark_storage [--sections 100000] [--dimension 1536]
+Compares every --precisions (float32, float16, int8) at every --dimensions (shortened
+vectors, like the `dimensions` parameter of the embeddings API), and writes the results
+to benchmarks/results/storage-<commit>.json (see --output).
+"""
+
+import argparse
+import platform
+import json
+import os
+
+import faiss
+import numpy as np
+
+from benchmarks.benchmark_components import get_commit, measure
+from src.models.index_factory import build_faiss_index
+
+
+def make_embeddings(num_vectors, dimension, num_clusters=256, seed=0):
+    """
+    Clustered unit vectors whose first dimensions vary the most, like the embeddings of
+    the text-embedding-3 models, which stay meaningful when shortened.
+    """
+    rng = np.random.default_rng(seed)
+    scales = 1 / np.sqrt(1 + np.arange(dimension) / 64)
+    centroids = rng.standard_normal((num_clusters, dimension)) * scales
+    vectors = centroids[rng.integers(0, num_clusters, num_vectors)]
+    vectors += 0.5 * rng.standard_normal((num_vectors, dimension)) * scales
+    return normalize(vectors.astype("float32"))
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def shorten(vectors, dimensions):
+    """Keeps the first `dimensions` of the vectors, normalized again like the API does."""
+    return normalize(np.ascontiguousarray(vectors[:, :dimensions]))
+
+
+def get_recall(labels, true_labels):
+    """Share of the true top-k neighbours found, averaged over the queries."""
+    return float(
+        np.mean(
+            [
+                len(set(found) & set(expected)) / len(expected)
+                for found, expected in zip(labels, true_labels)
+            ]
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sections", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1536, 512, 256])
+    parser.add_argument(
+        "--precisions", nargs="+", default=["float32", "float16", "int8"]
+    )
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    commit = get_commit()
+    output_path = args.output or os.path.join(
+        "benchmarks", "results", f"storage-{commit}.json"
+    )
+    vectors = make_embeddings(args.sections + args.queries, args.dimension)
+    vectors, queries = vectors[: args.sections], vectors[args.sections :]
+    ids = np.arange(args.sections)
+    # Exact neighbours of the full float32 vectors
+    _, true_labels = faiss.knn(queries, vectors, args.k)
+
+    results = []
+    print(
+        "| Precision | Dimensions | Bytes/vector | Index (MB) | Search p50 (ms) | Recall@k |"
+    )
+    print("| :--- | ---: | ---: | ---: | ---: | ---: |")
+    for dimensions in args.dimensions:
+        shortened_vectors = shorten(vectors, dimensions)
+        shortened_queries = shorten(queries, dimensions)
+        for precision in args.precisions:
+            faiss_index = build_faiss_index(
+                dimensions,
+                [(ids, shortened_vectors)],
+                {"index_type": args.index_type, "precision": precision},
+            )
+            index_bytes = len(faiss.serialize_index(faiss_index))
+            # One query at a time, as the app searches
+            latencies = [
+                measure(lambda: faiss_index.search(query[None, :], args.k))["p50"]
+                for query in shortened_queries
+            ]
+            _, labels = faiss_index.search(shortened_queries, args.k)
+            result = {
+                "precision": precision,
+                "dimensions": dimensions,
+                "index_type": args.index_type,
+                "sections": args.sections,
+                "bytes_per_vector": index_bytes / args.sections,
+                "index_megabytes": index_bytes / 2**20,
+                "search_p50": float(np.percentile(latencies, 50)),
+                "search_p99": float(np.percentile(latencies, 99)),
+                "recall_at_k": get_recall(labels, true_labels),
+                "k": args.k,
+            }
+            print(
+                f"| {precision} | {dimensions} | {result['bytes_per_vector']:.0f} | {result['index_megabytes']:.1f} | {result['search_p50'] * 1000:.3f} | {result['recall_at_k']:.3f} |"
+            )
+            results.append(result)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(
+            {
+                "metadata": {
+                    "commit": commit,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "faiss": faiss.__version__,
+                    "numpy": np.__version__,
+                    "arguments": vars(args),
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Compares two benchmark result files, e.g. of two commits.
+
+Usage: python -m benchmarks.compare old.json new.json [--threshold 1.2]
+Exits with status 1 when the median of a benchmark got slower than `threshold` times.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path) as f:
+        return {
+            (result["benchmark"], result["sections"]): result
+            for result in json.load(f)["results"]
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("old_path")
+    parser.add_argument("new_path")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    old_results = load_results(args.old_path)
+    new_results = load_results(args.new_path)
+    regressions = 0
+    print("| Benchmark | Sections | Old p50 (ms) | New p50 (ms) | Ratio |")
+    print("| :--- | ---: | ---: | ---: | ---: |")
+    for key, new_result in new_results.items():
+        if key not in old_results:
+            continue
+        old_p50, new_p50 = old_results[key]["p50"], new_result["p50"]
+        ratio = new_p50 / old_p50 if old_p50 else float("inf")
+        flag = ""
+        if ratio > args.threshold:
+            regressions += 1
+            flag = " ⚠️"
+        print(
+            f"| {key[0]} | {key[1]} | {old_p50 * 1000:.3f} | {new_p50 * 1000:.3f} | {ratio:.2f}{flag} |"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints.
+
+Usage: python -m benchmarks.openai_stand_in [--port 8765] [--latency 0.05] [--dimension 256]
+Then point the app at it: OPENAI_BASE_URL=http://127.0.0.1:8765 make stream
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import threading
+import json
+import time
+
+import numpy as np
+
+from src.utils.utils import estimate_token_count
+
+
+def make_vector(text, dimension):
+    """Unit vector derived from the text only, so every run gets the same vectors."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension)
+    return np.round(vector / np.linalg.norm(vector), 6).tolist()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive like the real API
+    disable_nagle_algorithm = True  # Headers and body are written separately
+    latency = 0.0
+    dimension = 256
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        if self.path.endswith("/embeddings"):
+            self.send_json(self.make_embeddings(payload))
+        elif self.path.endswith("/chat/completions"):
+            if payload.get("stream"):
+                self.send_stream(self.make_completion(payload))
+            else:
+                self.send_json(self.make_completion(payload))
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def make_embeddings(self, payload):
+        texts = payload["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        # Shortened vectors, like the text-embedding-3 models
+        dimension = payload.get("dimensions") or self.dimension
+        return {
+            "data": [
+                {"index": i, "embedding": make_vector(text, dimension)}
+                for i, text in enumerate(texts)
+            ],
+            "usage": {"total_tokens": sum(estimate_token_count(t) for t in texts)},
+        }
+
+    def make_completion(self, payload):
+        prompt = payload["messages"][-1]["content"]
+        content = f"Stand-in answer to a prompt of {len(prompt)} characters."
+        return {
+            "choices": [{"message": {"content": content}}],
+            "usage": {
+                "prompt_tokens": estimate_token_count(prompt),
+                "completion_tokens": estimate_token_count(content),
+            },
+        }
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_body(body, "application/json", status)
+
+    def send_stream(self, completion):
+        # One server-sent event per word, then the usage and the end marker
+        words = completion["choices"][0]["message"]["content"].split(" ")
+        chunks = [{"choices": [{"delta": {"content": f"{word} "}}]} for word in words]
+        chunks.append({"choices": [], "usage": completion["usage"]})
+        body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks)
+        self.send_body((body + "data: [DONE]\n\n").encode(), "text/event-stream")
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class OpenAIStandIn:
+    """
+    Serves the stand-in endpoints from a background thread.
+
+    Every request waits `latency` seconds before being answered, to mimic the network
+    and the API. Embeddings have `dimension` components.
+    """
+
+    def __init__(self, latency=0.0, dimension=256, host="127.0.0.1", port=0):
+        handler = type(
+            "ConfiguredStandInHandler",
+            (StandInHandler,),
+            {"latency": latency, "dimension": dimension},
+        )
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--dimension", type=int, default=256)
+    args = parser.parse_args()
+
+    stand_in = OpenAIStandIn(args.latency, args.dimension, port=args.port)
+    print(f"Serving the OpenAI stand-in on {stand_in.base_url}")
+    try:
+        stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        stand_in.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import numpy as np
+import threading
+import sqlite3
+import json
+import time
+
+from collections import OrderedDict
+
+
+class SemanticAnswerCache:
+    """
+    Cache of LLM answers, found again for identical or paraphrased questions.
+
+    An answer is reused when it was given by the same model, at the same temperature,
+    with the same retrieved sections as context, to a question whose embedding has a
+    cosine similarity of at least `similarity_threshold` with the new one. Answers
+    citing a section are invalidated when the section is removed or updated.
+
+    The cache is an LRU bounded by `max_size` entries. When `cache_path` is given,
+    entries are also stored in a SQLite file and loaded again on restart.
+    """
+
+    def __init__(self, max_size=1024, similarity_threshold=0.95, cache_path=None):
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()  # entry ID -> (key, embedding, answer)
+        self.keys = {}  # (model, temperature, section IDs) -> entry IDs
+        self.next_entry_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        if cache_path:
+            self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, "
+                "model TEXT, temperature REAL, section_ids TEXT, embedding BLOB, "
+                "answer TEXT, used_at REAL)"
+            )
+            self.connection.commit()
+            self.load()
+
+    @classmethod
+    def from_config(cls, models_config):
+        """
+        Creates the cache from the `answer_cache` section of the models config, or
+        returns None when the cache is disabled.
+        """
+        cache_config = dict((models_config or {}).get("answer_cache") or {})
+        if not cache_config.pop("enabled", False):
+            return None
+        return cls(**cache_config)
+
+    @staticmethod
+    def make_key(model, temperature, section_ids):
+        return model, round(float(temperature), 3), tuple(sorted(map(int, section_ids)))
+
+    @staticmethod
+    def normalize(embedding):
+        embedding = np.asarray(embedding, dtype="float32")
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def load(self):
+        rows = self.connection.execute(
+            "SELECT id, model, temperature, section_ids, embedding, answer FROM answers "
+            "ORDER BY used_at DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for entry_id, model, temperature, section_ids, embedding, answer in reversed(
+            rows
+        ):
+            key = self.make_key(model, temperature, json.loads(section_ids))
+            self.remember(
+                entry_id,
+                key,
+                np.frombuffer(embedding, dtype="float32"),
+                json.loads(answer),
+            )
+            self.next_entry_id = max(self.next_entry_id, entry_id + 1)
+        # Rows beyond the size of the cache were evicted
+        self.connection.execute(
+            "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers "
+            "ORDER BY used_at DESC LIMIT ?)",
+            (self.max_size,),
+        )
+        self.connection.commit()
+
+    def get(self, model, temperature, query_embedding, section_ids):
+        """Returns the answer (a dict) stored for a similar question, or None."""
+        key = self.make_key(model, temperature, section_ids)
+        with self.lock:
+            entry_ids = self.keys.get(key)
+            if entry_ids:
+                similarities = np.array(
+                    [self.entries[entry_id][1] for entry_id in entry_ids]
+                ) @ self.normalize(query_embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    entry_id = entry_ids[best]
+                    self.entries.move_to_end(entry_id)
+                    if self.connection is not None:
+                        self.connection.execute(
+                            "UPDATE answers SET used_at = ? WHERE id = ?",
+                            (time.time(), entry_id),
+                        )
+                        self.connection.commit()
+                    self.hits += 1
+                    return self.entries[entry_id][2]
+            self.misses += 1
+            return None
+
+    def set(self, model, temperature, query_embedding, section_ids, answer):
+        key = self.make_key(model, temperature, section_ids)
+        embedding = self.normalize(query_embedding)
+        with self.lock:
+            entry_id = self.next_entry_id
+            self.next_entry_id += 1
+            evicted_ids = self.remember(entry_id, key, embedding, answer)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        entry_id,
+                        key[0],
+                        key[1],
+                        json.dumps(key[2]),
+                        embedding.tobytes(),
+                        json.dumps(answer),
+                        time.time(),
+                    ),
+                )
+                self.delete_rows(evicted_ids)
+                self.connection.commit()
+
+    def invalidate(self, section_ids):
+        """Drops the answers whose context contains one of `section_ids`."""
+        section_ids = set(section_ids)
+        with self.lock:
+            invalidated_ids = [
+                entry_id
+                for entry_id, (key, _, _) in self.entries.items()
+                if section_ids.intersection(key[2])
+            ]
+            for entry_id in invalidated_ids:
+                self.forget(entry_id)
+            if self.connection is not None and invalidated_ids:
+                self.delete_rows(invalidated_ids)
+                self.connection.commit()
+        return len(invalidated_ids)
+
+    def remember(self, entry_id, key, embedding, answer):
+        """Adds an entry, returning the IDs of the entries evicted to make room."""
+        self.entries[entry_id] = (key, embedding, answer)
+        self.keys.setdefault(key, []).append(entry_id)
+        evicted_ids = []
+        while len(self.entries) > self.max_size:
+            evicted_ids.append(self.forget(next(iter(self.entries))))
+        return evicted_ids
+
+    def forget(self, entry_id):
+        key = self.entries.pop(entry_id)[0]
+        self.keys[key].remove(entry_id)
+        if not self.keys[key]:
+            del self.keys[key]
+        return entry_id
+
+    def delete_rows(self, entry_ids):
+        self.connection.executemany(
+            "DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids]
+        )
+
+    def stats(self):
+        """Hit/miss counters of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
@@ -0,0 +1,95 @@
+import re
+
+from ..utils.utils import estimate_token_count
+
+# Tokens added around every document by the prompt ('Document i:\n"""\n...\n"""')
+DOCUMENT_OVERHEAD_TOKENS = 6
+# Ends of sentences and lines, where a document can be cut
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def get_shingles(text, size=3):
+    """Sets of `size` consecutive words, compared to detect near-duplicates."""
+    words = normalize(text).split(" ")
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def get_similarity(shingles, other_shingles):
+    """Jaccard similarity of two sets of shingles."""
+    return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+
+def truncate_at_sentence(text, max_tokens):
+    """Longest prefix of `text` ending at a sentence boundary within `max_tokens`."""
+    truncated_text = ""
+    for match in SENTENCE_BOUNDARY_PATTERN.finditer(text):
+        prefix = text[: match.start()]
+        if estimate_token_count(prefix) > max_tokens:
+            break
+        truncated_text = prefix
+    if estimate_token_count(text) <= max_tokens:
+        truncated_text = text
+    return truncated_text.strip()
+
+
+def pack_context(documents, budget=None, near_duplicate_threshold=0.9):
+    """
+    Selects the documents given to the LLM, in relevance order, within `budget` tokens.
+
+    Exact and near-duplicates (Jaccard similarity of their word shingles of at least
+    `near_duplicate_threshold`) of a document already selected are dropped. The first
+    document that does not fit is cut at a sentence boundary, and the packing stops.
+    Returns the selected documents and the number of tokens included and dropped.
+    """
+    context = {
+        "documents": [],
+        "included_tokens": 0,
+        "dropped_tokens": 0,
+        "duplicates": 0,
+        "truncated": False,
+    }
+    selected_shingles = []
+    seen_texts = set()
+    for document in documents:
+        tokens = estimate_token_count(document) + DOCUMENT_OVERHEAD_TOKENS
+        normalized_document = normalize(document)
+        shingles = get_shingles(document)
+        if normalized_document in seen_texts or any(
+            get_similarity(shingles, other_shingles) >= near_duplicate_threshold
+            for other_shingles in selected_shingles
+        ):
+            context["duplicates"] += 1
+            context["dropped_tokens"] += tokens
+            continue
+
+        if context["truncated"]:
+            # Nothing else fits once the budget is reached
+            context["dropped_tokens"] += tokens
+            continue
+        if budget is not None and context["included_tokens"] + tokens > budget:
+            context["truncated"] = True
+            truncated_document = truncate_at_sentence(
+                document,
+                budget - context["included_tokens"] - DOCUMENT_OVERHEAD_TOKENS,
+            )
+            if truncated_document:
+                truncated_tokens = (
+                    estimate_token_count(truncated_document) + DOCUMENT_OVERHEAD_TOKENS
+                )
+                context["documents"].append(truncated_document)
+                context["included_tokens"] += truncated_tokens
+                tokens -= truncated_tokens
+            context["dropped_tokens"] += tokens
+            continue
+
+        context["documents"].append(document)
+        context["included_tokens"] += tokens
+        selected_shingles.append(shingles)
+        seen_texts.add(normalized_document)
+    return context
@@ -0,0 +1,180 @@
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+from ..utils.utils import estimate_token_count
+
+# Columns of a section record, besides its ID
+RECORD_FIELDS = (
+    "document_id",
+    "source",
+    "headers",
+    "start_byte",
+    "end_byte",
+    "content_hash",
+    "token_count",
+    "ingested_at",
+    "text",
+)
+# Maximum number of IDs bound in a single SQLite query
+MAX_QUERY_IDS = 500
+# Filters of DocumentStore.find_ids()
+FILTER_FIELDS = (
+    "source",
+    "document_id",
+    "header_prefix",
+    "ingested_after",
+    "ingested_before",
+)
+
+
+def make_section_records(ids, sections, document_id=None, source=None):
+    """
+    Builds the records of the `sections` of a document, as returned by
+    split_markdown_with_metadata(), stored under their section `ids`.
+    """
+    ingested_at = time.time()
+    return [
+        {
+            "id": id_,
+            "document_id": document_id,
+            "source": source,
+            "headers": section.get("headers"),
+            "start_byte": section.get("start_byte"),
+            "end_byte": section.get("end_byte"),
+            "content_hash": hashlib.sha256(section["text"].encode("utf-8")).hexdigest(),
+            "token_count": estimate_token_count(section["text"]),
+            "ingested_at": ingested_at,
+            "text": section["text"],
+        }
+        for id_, section in zip(ids, sections)
+    ]
+
+
+class DocumentStore:
+    """
+    SQLite store of the sections of the knowledge base, keyed by their section (vector)
+    ID, with their provenance: document and source file, header hierarchy, byte
+    offsets in the source, hash of the text, estimated token count and ingestion time.
+
+    Only the rows asked for are read, so a search fetches its top-k sections and the
+    rest of the knowledge base stays on disk.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(store_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sections (id INTEGER PRIMARY KEY, "
+            "document_id TEXT, source TEXT, headers TEXT, start_byte INTEGER, "
+            "end_byte INTEGER, content_hash TEXT, token_count INTEGER, "
+            "ingested_at REAL, text TEXT)"
+        )
+        for column in ("document_id", "source", "ingested_at"):
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS sections_{column} ON sections ({column})"
+            )
+        self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM sections"
+            ).fetchone()
+        return count
+
+    def add(self, records):
+        rows = [
+            (record["id"],)
+            + tuple(record[field] for field in RECORD_FIELDS[:2])
+            + (json.dumps(record["headers"]),)
+            + tuple(record[field] for field in RECORD_FIELDS[3:])
+            for record in records
+        ]
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO sections VALUES "
+                f"({', '.join('?' * (len(RECORD_FIELDS) + 1))})",
+                rows,
+            )
+            self.connection.commit()
+
+    def get(self, ids):
+        """Returns the records of `ids`, in the same order (None for unknown IDs)."""
+        ids = [int(id_) for id_ in ids]
+        records = {}
+        with self.lock:
+            for start in range(0, len(ids), MAX_QUERY_IDS):
+                chunk = ids[start : start + MAX_QUERY_IDS]
+                columns = ", ".join(RECORD_FIELDS)
+                placeholders = ", ".join("?" * len(chunk))
+                # Only the fixed column names and "?" placeholders are formatted into
+                # the query, the IDs are bound as parameters
+                query = f"SELECT id, {columns} FROM sections WHERE id IN ({placeholders})"  # nosec B608
+                rows = self.connection.execute(query, chunk).fetchall()
+                for row in rows:
+                    record = dict(zip(("id",) + RECORD_FIELDS, row))
+                    record["headers"] = json.loads(record["headers"])
+                    records[record["id"]] = record
+        return [records.get(id_) for id_ in ids]
+
+    def find_ids(self, filters):
+        """
+        Returns the IDs of the sections matching every filter: `source` and
+        `document_id` (one value or a list), `header_prefix` (the first headers of the
+        section, e.g. ["# Guide", "## Setup"] for that subtree), and `ingested_after`
+        and `ingested_before` (timestamps).
+        """
+        unknown_filters = set(filters) - set(FILTER_FIELDS)
+        if unknown_filters:
+            raise ValueError(f"Unknown filters {sorted(unknown_filters)}.")
+        conditions, parameters = [], []
+        for field in ("source", "document_id"):
+            values = filters.get(field)
+            if values is not None:
+                values = [values] if isinstance(values, str) else list(values)
+                conditions.append(f"{field} IN ({', '.join('?' * len(values))})")
+                parameters.extend(values)
+        if filters.get("header_prefix"):
+            # Headers are stored as JSON lists: match the list or its first items
+            headers = json.dumps(list(filters["header_prefix"]))
+            prefix = f"{headers[:-1]}, "
+            conditions.append("(headers = ? OR substr(headers, 1, ?) = ?)")
+            parameters.extend([headers, len(prefix), prefix])
+        if filters.get("ingested_after") is not None:
+            conditions.append("ingested_at >= ?")
+            parameters.append(filters["ingested_after"])
+        if filters.get("ingested_before") is not None:
+            conditions.append("ingested_at < ?")
+            parameters.append(filters["ingested_before"])
+
+        query = "SELECT id FROM sections"
+        if conditions:
+            # The conditions are fixed SQL with "?" placeholders, the filter values
+            # are bound as parameters
+            query += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return [id_ for (id_,) in self.connection.execute(query, parameters)]
+
+    def get_sources(self):
+        """Distinct sources of the sections, for filtering (see find_ids)."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT source FROM sections WHERE source IS NOT NULL "
+                "ORDER BY source"
+            ).fetchall()
+        return [source for (source,) in rows]
+
+    def remove(self, ids):
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM sections WHERE id = ?", [(int(id_),) for id_ in ids]
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,98 @@
+import numpy as np
+import threading
+import hashlib
+import sqlite3
+import time
+
+from collections import OrderedDict
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by the model and the preprocessed text.
+
+    The in-process tier is an LRU bounded by `max_size` entries. When `cache_path` is
+    given, entries are also stored in a SQLite file so they survive restarts. Entries
+    older than `ttl` seconds are ignored in both tiers (`ttl=None` keeps them forever).
+    """
+
+    def __init__(self, max_size=1024, ttl=24 * 3600, cache_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.connection = None
+        if cache_path:
+            self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, created_at REAL, embedding BLOB)"
+            )
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    def is_expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, model, text):
+        """Returns the cached embedding of `text`, or None."""
+        key = self.make_key(model, text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if not self.is_expired(entry[0]):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT created_at, embedding FROM query_embeddings WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and not self.is_expired(row[0]):
+                    embedding = np.frombuffer(row[1], dtype="float32")
+                    self.remember(key, row[0], embedding)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def set(self, model, text, embedding):
+        key = self.make_key(model, text)
+        embedding = np.asarray(embedding, dtype="float32")
+        created_at = time.time()
+        with self.lock:
+            self.remember(key, created_at, embedding)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                    (key, created_at, embedding.tobytes()),
+                )
+                self.connection.commit()
+
+    def remember(self, key, created_at, embedding):
+        self.entries[key] = (created_at, embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
@@ -0,0 +1,120 @@
+import numpy as np
+import threading
+import hashlib
+import struct
+import os
+
+# Size of a key (sha256 digest) in the hash index file
+KEY_SIZE = 32
+# Size of the header of a vectors file (dimension as a uint32)
+HEADER_SIZE = 4
+
+
+class EmbeddingStore:
+    """
+    Persistent, content-addressed store of section embeddings.
+
+    Each model has two append-only files in `store_directory`:
+    - `<model>.keys`: the sha256 digests of (model, preprocessed text), 32 bytes each;
+    - `<model>.vectors`: the dimension as a uint32, then one float32 row per key.
+    The hash index (digest -> row) is rebuilt in memory from the keys file on load.
+    """
+
+    def __init__(self, store_directory):
+        self.store_directory = store_directory
+        self.lock = threading.Lock()
+        self.models = {}  # model -> (hash index, dimension)
+        os.makedirs(store_directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).digest()
+
+    def get_paths(self, model):
+        base_path = os.path.join(self.store_directory, model.replace("/", "_"))
+        return f"{base_path}.keys", f"{base_path}.vectors"
+
+    def load_model(self, model):
+        if model in self.models:
+            return self.models[model]
+
+        keys_path, vectors_path = self.get_paths(model)
+        hash_index, dimension = {}, None
+        if os.path.exists(keys_path) and os.path.exists(vectors_path):
+            with open(vectors_path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            if len(header) == HEADER_SIZE:
+                (dimension,) = struct.unpack("<I", header)
+                num_vectors = (os.path.getsize(vectors_path) - HEADER_SIZE) // (
+                    4 * dimension
+                )
+                with open(keys_path, "rb") as f:
+                    keys = f.read()
+                num_keys = min(len(keys) // KEY_SIZE, num_vectors)
+                # Drop the tail of a write interrupted halfway, keeping both aligned
+                if num_keys * KEY_SIZE != len(keys) or num_keys != num_vectors:
+                    os.truncate(keys_path, num_keys * KEY_SIZE)
+                    os.truncate(vectors_path, HEADER_SIZE + num_keys * 4 * dimension)
+                hash_index = {
+                    keys[i * KEY_SIZE : (i + 1) * KEY_SIZE]: i for i in range(num_keys)
+                }
+        self.models[model] = (hash_index, dimension)
+        return self.models[model]
+
+    def lookup(self, model, texts):
+        """
+        Looks up the embeddings of preprocessed `texts`.
+
+        Returns a float32 matrix with one row per text (None if nothing was found) and
+        the positions of the texts that are not in the store.
+        """
+        with self.lock:
+            hash_index, dimension = self.load_model(model)
+            rows = [hash_index.get(self.make_key(model, text)) for text in texts]
+
+        found_positions = [p for p, row in enumerate(rows) if row is not None]
+        missing_positions = [p for p, row in enumerate(rows) if row is None]
+        if not found_positions:
+            return None, missing_positions
+
+        vectors = np.memmap(
+            self.get_paths(model)[1],
+            dtype="float32",
+            mode="r",
+            offset=HEADER_SIZE,
+        ).reshape(-1, dimension)
+        embeddings = np.empty((len(texts), dimension), dtype="float32")
+        embeddings[found_positions] = vectors[[rows[p] for p in found_positions]]
+        return embeddings, missing_positions
+
+    def add(self, model, texts, embeddings):
+        """Stores the embeddings of preprocessed `texts`."""
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        keys_path, vectors_path = self.get_paths(model)
+        with self.lock:
+            hash_index, dimension = self.load_model(model)
+            if dimension is None:
+                dimension = embeddings.shape[1]
+                with open(vectors_path, "wb") as f:
+                    f.write(struct.pack("<I", dimension))
+                open(keys_path, "wb").close()
+                self.models[model] = (hash_index, dimension)
+            elif dimension != embeddings.shape[1]:
+                raise ValueError(
+                    f"Embeddings of dimension {embeddings.shape[1]} cannot be stored with those of dimension {dimension}."
+                )
+
+            new_keys, new_rows = {}, []
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model, text)
+                if key not in hash_index and key not in new_keys:
+                    new_keys[key] = len(hash_index) + len(new_rows)
+                    new_rows.append(embedding)
+            if not new_keys:
+                return
+
+            with open(vectors_path, "ab") as f:
+                f.write(np.array(new_rows, dtype="float32").tobytes())
+            with open(keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            hash_index.update(new_keys)
@@ -0,0 +1,213 @@
+import numpy as np
+import faiss
+
+# Index built when no retrieval configuration is given
+DEFAULT_RETRIEVAL_CONFIG = {"index_type": "flat"}
+# FAISS wants 39 to 256 training vectors per centroid (IVF lists or PQ codes)
+TRAINING_VECTORS_PER_CENTROID = 39
+MAX_TRAINING_VECTORS_PER_CENTROID = 256
+# Vectors used to train a scalar quantizer (value ranges of every dimension)
+MAX_QUANTIZER_TRAINING_VECTORS = 65536
+# Scalar quantizers storing the vectors of each precision (float32 is stored as is)
+PRECISION_QUANTIZERS = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+# Index types whose vectors can be memory-mapped and still be added to (copy on write)
+MMAP_INDEX_TYPES = {"flat", "hnsw"}
+# Filtered searches matching at most this share of the index compare the query with
+# the vectors of the matching sections only, instead of scanning with an ID selector
+MAX_EXACT_FILTER_FRACTION = 0.02
+
+
+def get_index_parameters(retrieval_config):
+    """Returns the index type and the parameters of that type."""
+    retrieval_config = retrieval_config or DEFAULT_RETRIEVAL_CONFIG
+    index_type = retrieval_config.get("index_type", "flat")
+    return index_type, retrieval_config.get(index_type) or {}
+
+
+def get_precision(retrieval_config):
+    """Storage precision of the vectors: float32, float16 or int8."""
+    precision = (retrieval_config or {}).get("precision") or "float32"
+    if precision != "float32" and precision not in PRECISION_QUANTIZERS:
+        raise ValueError(f"Unknown vector precision '{precision}'.")
+    return precision
+
+
+def get_training_size(retrieval_config):
+    """Minimum number of vectors needed to train the configured index."""
+    index_type, parameters = get_index_parameters(retrieval_config)
+    if index_type == "ivf_flat":
+        return TRAINING_VECTORS_PER_CENTROID * parameters.get("nlist", 1024)
+    if index_type == "ivf_pq":
+        return TRAINING_VECTORS_PER_CENTROID * max(
+            parameters.get("nlist", 1024), 2 ** parameters.get("nbits", 8)
+        )
+    return 0
+
+
+def create_empty_index(dimension, retrieval_config, num_vectors):
+    """
+    Creates the (untrained) index described by `retrieval_config`.
+
+    Falls back to an exact flat index while there are too few vectors to train it.
+    """
+    index_type, parameters = get_index_parameters(retrieval_config)
+    if num_vectors < get_training_size(retrieval_config):
+        print(
+            f"{num_vectors} vectors are not enough to train a '{index_type}' index. Using a flat index."
+        )
+        index_type = "flat"
+    # Reduced precisions store scalar-quantized vectors (PQ codes are compressed already)
+    quantizer_type = PRECISION_QUANTIZERS.get(get_precision(retrieval_config))
+
+    if index_type == "flat":
+        if quantizer_type is not None:
+            return faiss.IndexScalarQuantizer(
+                dimension, quantizer_type, faiss.METRIC_L2
+            )
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "ivf_flat":
+        quantizer = faiss.IndexFlatL2(dimension)
+        if quantizer_type is not None:
+            return faiss.IndexIVFScalarQuantizer(
+                quantizer,
+                dimension,
+                parameters.get("nlist", 1024),
+                quantizer_type,
+                faiss.METRIC_L2,
+            )
+        return faiss.IndexIVFFlat(quantizer, dimension, parameters.get("nlist", 1024))
+    if index_type == "ivf_pq":
+        quantizer = faiss.IndexFlatL2(dimension)
+        return faiss.IndexIVFPQ(
+            quantizer,
+            dimension,
+            parameters.get("nlist", 1024),
+            parameters.get("m", 64),
+            parameters.get("nbits", 8),
+        )
+    if index_type == "hnsw":
+        if quantizer_type is not None:
+            index = faiss.IndexHNSWSQ(
+                dimension, quantizer_type, parameters.get("m", 32)
+            )
+        else:
+            index = faiss.IndexHNSWFlat(dimension, parameters.get("m", 32))
+        index.hnsw.efConstruction = parameters.get("ef_construction", 200)
+        return index
+    raise ValueError(f"Unknown index type '{index_type}'.")
+
+
+def get_inner_index(faiss_index):
+    return faiss.downcast_index(
+        faiss_index.index if isinstance(faiss_index, faiss.IndexIDMap) else faiss_index
+    )
+
+
+def configure_search(faiss_index, retrieval_config):
+    """Applies the search-time parameters (nprobe, efSearch) of the configuration."""
+    _, parameters = get_index_parameters(retrieval_config)
+    index = get_inner_index(faiss_index)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = parameters.get("nprobe", 16)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = parameters.get("ef_search", 64)
+    return faiss_index
+
+
+def read_faiss_index(index_path, retrieval_config=None):
+    """
+    Reads an index, memory-mapping its vectors when its type allows it: loading is then
+    near-instant, and processes reading the same file share its pages. Inverted lists
+    (IVF indexes) are read into memory, since mapped ones cannot be added to.
+    """
+    index_type, _ = get_index_parameters(retrieval_config)
+    if index_type in MMAP_INDEX_TYPES:
+        faiss_index = faiss.read_index(
+            index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+    else:
+        faiss_index = faiss.read_index(index_path)
+    return configure_search(faiss_index, retrieval_config)
+
+
+def build_faiss_index(dimension, chunks, retrieval_config=None):
+    """
+    Builds an ID-mapped index of the configured type from (ids, vectors) chunks.
+
+    The index is trained on the vectors first when its type needs training.
+    """
+    num_vectors = sum(len(ids) for ids, _ in chunks)
+    index = create_empty_index(dimension, retrieval_config, num_vectors)
+    if not index.is_trained:
+        # Train on an evenly spaced sample instead of copying every vector
+        max_training_vectors = (
+            get_training_size(retrieval_config)
+            // TRAINING_VECTORS_PER_CENTROID
+            * MAX_TRAINING_VECTORS_PER_CENTROID
+            or MAX_QUANTIZER_TRAINING_VECTORS
+        )
+        step = max(1, -(-num_vectors // max_training_vectors))
+        index.train(np.vstack([vectors[::step] for _, vectors in chunks]))
+    faiss_index = faiss.IndexIDMap2(index)
+    for ids, vectors in chunks:
+        faiss_index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    return configure_search(faiss_index, retrieval_config)
+
+
+def make_search_parameters(faiss_index, selector):
+    """Search parameters restricted to `selector`, keeping those of the index."""
+    index = get_inner_index(faiss_index)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_filtered(faiss_index, queries, k, ids):
+    """
+    Searches the vectors of `ids` only, returning k results per query (all of `ids`
+    when there are fewer) like faiss_index.search().
+
+    Narrow filters compare the queries with the vectors of `ids` directly, which gets
+    faster as the filter narrows. Wider ones search the index with an ID selector,
+    falling back to the direct comparison when an approximate index (IVF, HNSW) finds
+    fewer than k of the selected vectors. IVF indexes visit all their lists instead,
+    computing the distances of the selected vectors only.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    selector = faiss.IDSelectorBatch(ids)
+    if len(ids) > MAX_EXACT_FILTER_FRACTION * faiss_index.ntotal:
+        distances, labels = faiss_index.search(
+            queries, k, params=make_search_parameters(faiss_index, selector)
+        )
+        if (labels >= 0).sum(axis=1).min() >= min(k, len(ids)):
+            return distances, labels
+    index = get_inner_index(faiss_index)
+    if isinstance(index, faiss.IndexIVF):
+        # The vectors of an IVF index cannot be looked up by ID: visit every list
+        return faiss_index.search(
+            queries,
+            k,
+            params=faiss.SearchParametersIVF(sel=selector, nprobe=index.nlist),
+        )
+    distances, positions = faiss.knn(
+        queries,
+        faiss_index.reconstruct_batch(ids),
+        min(k, len(ids)),
+        metric=faiss_index.metric_type,
+    )
+    # Padded to k results like a search of the index
+    labels = np.full((len(queries), k), -1, dtype="int64")
+    labels[:, : positions.shape[1]] = ids[positions]
+    largest = np.finfo("float32").max
+    padded_distances = np.full(
+        (len(queries), k),
+        -largest if faiss_index.metric_type == faiss.METRIC_INNER_PRODUCT else largest,
+        dtype="float32",
+    )
+    padded_distances[:, : distances.shape[1]] = distances
+    return padded_distances, labels
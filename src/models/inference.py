@@ -1,13 +1,76 @@
-import requests
+import json
+
+from .context_packer import pack_context
+from .openai_client import OpenAIClient, OpenAIError
+from ..utils.metrics import Metrics
+from ..utils.utils import estimate_token_count
+
+
+class ChatCompletionStream:
+    """
+    Iterates over the content of a streamed chat completion as it arrives.
+
+    `content` and `usage` are complete once the iteration is over. When the server
+    does not report the usage, it is estimated from the prompt and the content.
+    `on_finish` is then called with the stream.
+    """
+
+    def __init__(self, response, prompt_text, on_finish=None):
+        self.response = response
+        self.prompt_text = prompt_text
+        self.on_finish = on_finish
+        self.content = ""
+        self.usage = None
+
+    def __iter__(self):
+        try:
+            # Server-sent events: one "data: <json>" line per chunk, always UTF-8 (the
+            # content type has no charset, which requests would decode as ISO-8859-1)
+            for line in self.response.iter_lines():
+                line = line.decode("utf-8")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    self.usage = chunk["usage"]
+                for choice in chunk.get("choices", []):
+                    token = (choice.get("delta") or {}).get("content")
+                    if token:
+                        self.content += token
+                        yield token
+        finally:
+            self.response.close()
+            if self.usage is None:
+                self.usage = {
+                    "prompt_tokens": estimate_token_count(self.prompt_text),
+                    "completion_tokens": estimate_token_count(self.content),
+                }
+            if self.on_finish is not None:
+                self.on_finish(self)
 
 
 class ModelInferenceManager:
-    def __init__(self, api_key, models_config):
+    def __init__(self, api_key, models_config, client=None, metrics=None):
         self.api_key = api_key
         self.models_config = models_config
+        self.client = client or OpenAIClient.from_config(
+            api_key, models_config, metrics=metrics
+        )
+        # Spans of the expertise, prompt build and completion stages
+        self.metrics = metrics or Metrics()
         self.model = None
         self.input_token_price = None
         self.output_token_price = None
+        self.context_window = None
+        # Token budget and deduplication of the documents given to the LLM
+        context_config = models_config.get("context") or {}
+        self.max_context_tokens = context_config.get("max_context_tokens")
+        self.near_duplicate_threshold = context_config.get(
+            "near_duplicate_threshold", 0.9
+        )
 
     def set_model(self, model_name):
         for group in self.models_config["models"]:
@@ -16,37 +79,91 @@ class ModelInferenceManager:
                     self.model = model_name
                     self.input_token_price = variant["input_price_per_token"]
                     self.output_token_price = variant["output_price_per_token"]
+                    self.context_window = variant.get("context_window")
                     return
         raise ValueError(f"Model {model_name} not found in configuration.")
 
-    def query_openai(self, prompt_text, max_completion_tokens=100, temperature=0.7):
+    def make_chat_payload(self, prompt_text, max_completion_tokens, temperature):
         if not self.model:
             raise ValueError(
                 "Model not set. Please use set_model() to set a model before querying."
             )
-        url = "https://api.openai.com/v1/chat/completions"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        payload = {
+        return {
             "model": self.model,
             "messages": [{"role": "user", "content": prompt_text}],
             "max_tokens": max_completion_tokens,
             "temperature": temperature,
         }
 
+    def parse_chat_response(self, response, span=None):
+        data = response.json()
+        content = data["choices"][0]["message"]["content"]
+        usage = data["usage"]
+        if span is not None:
+            self.record_usage(span, usage, len(response.content))
+        return content, usage
+
+    def record_usage(self, span, usage, num_bytes):
+        span.record(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            bytes=num_bytes,
+            cost=self.calculate_cost(usage),
+        )
+
+    def query_openai(
+        self,
+        prompt_text,
+        max_completion_tokens=100,
+        temperature=0.7,
+        stage="completion",
+    ):
+        payload = self.make_chat_payload(
+            prompt_text, max_completion_tokens, temperature
+        )
+        with self.metrics.span(stage, model=self.model) as span:
+            response = self.client.post("/chat/completions", payload)
+            return self.parse_chat_response(response, span)
+
+    async def aquery(
+        self,
+        prompt_text,
+        max_completion_tokens=100,
+        temperature=0.7,
+        stage="completion",
+    ):
+        """Async version of query_openai()."""
+        payload = self.make_chat_payload(
+            prompt_text, max_completion_tokens, temperature
+        )
+        with self.metrics.span(stage, model=self.model) as span:
+            response = await self.client.apost("/chat/completions", payload)
+            return self.parse_chat_response(response, span)
+
+    def stream_openai(self, prompt_text, max_completion_tokens=100, temperature=0.7):
+        """
+        Queries the model with a streamed response, see ChatCompletionStream.
+        """
+        payload = self.make_chat_payload(
+            prompt_text, max_completion_tokens, temperature
+        )
+        payload["stream"] = True
+        # Ask for the usage in the last chunk of the stream
+        payload["stream_options"] = {"include_usage": True}
+        # The span lasts until the last token is received
+        span = self.metrics.start_span("completion", model=self.model)
+
+        def finish_span(stream):
+            self.record_usage(span, stream.usage, len(stream.content.encode()))
+            span.finish()
+
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
-            if response.status_code == 200:
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                usage = data["usage"]
-                return content, usage
-            else:
-                return (
-                    f"HTTP Error {response.status_code}: {response.json().get('error', {}).get('message', 'An unspecified error occurred')}",
-                    None,
-                )
-        except requests.RequestException as e:
-            return f"Connection error: {e}", None
+            response = self.client.post("/chat/completions", payload, stream=True)
+        except OpenAIError:
+            span.record(errors=1)
+            span.finish()
+            raise
+        return ChatCompletionStream(response, prompt_text, on_finish=finish_span)
 
     def calculate_cost(self, usage):
         if usage:
@@ -60,19 +177,97 @@ class ModelInferenceManager:
     def determine_expertise_area(
         self, user_question, max_completion_tokens, temperature
     ):
-        prompt_text = f"""Based on the question provided, identify the relevant expertise area(s). Return your answer in the format: 
-        'expertise1, expertise2, ...'. Provide only the expertise areas as a comma-separated list, no additional explanations are needed.
-        Here is the user Question:
-        {user_question}
-        """
         response, usage = self.query_openai(
-            prompt_text, max_completion_tokens, temperature
+            self.make_expertise_prompt(user_question),
+            max_completion_tokens,
+            temperature,
+            stage="expertise",
+        )
+        return response.strip(), (
+            usage if response else "Error determining expertise area."
+        )
+
+    async def adetermine_expertise_area(
+        self, user_question, max_completion_tokens, temperature
+    ):
+        """Async version of determine_expertise_area()."""
+        response, usage = await self.aquery(
+            self.make_expertise_prompt(user_question),
+            max_completion_tokens,
+            temperature,
+            stage="expertise",
         )
         return response.strip(), (
             usage if response else "Error determining expertise area."
         )
 
-    def prepare_prompt_for_llm(self, expertise_area, user_question, context_documents):
+    def make_expertise_prompt(self, user_question):
+        return f"""Based on the question provided, identify the relevant expertise area(s). Return your answer in the format: 
+        'expertise1, expertise2, ...'. Provide only the expertise areas as a comma-separated list, no additional explanations are needed.
+        Here is the user Question:
+        {user_question}
+        """
+
+    def prepare_prompt_for_llm(
+        self,
+        expertise_area,
+        user_question,
+        context_documents,
+        max_completion_tokens=None,
+    ):
+        prompt, _ = self.pack_prompt(
+            expertise_area, user_question, context_documents, max_completion_tokens
+        )
+        return prompt
+
+    def pack_prompt(
+        self,
+        expertise_area,
+        user_question,
+        context_documents,
+        max_completion_tokens=None,
+    ):
+        """
+        Builds the prompt with as many documents as the token budget allows.
+
+        Returns the prompt and the packed context (see pack_context), which reports
+        the tokens of the documents included and dropped.
+        """
+        with self.metrics.span("prompt_build") as span:
+            context = pack_context(
+                context_documents,
+                self.get_context_budget(
+                    self.build_prompt(expertise_area, user_question, []),
+                    max_completion_tokens,
+                ),
+                self.near_duplicate_threshold,
+            )
+            prompt = self.build_prompt(
+                expertise_area, user_question, context["documents"]
+            )
+            span.record(
+                items=len(context["documents"]),
+                tokens=estimate_token_count(prompt),
+                dropped_tokens=context["dropped_tokens"],
+                bytes=len(prompt),
+            )
+        return prompt, context
+
+    def get_context_budget(self, prompt_without_documents, max_completion_tokens):
+        """
+        Tokens left for the documents: the configured budget, within what the context
+        window of the model leaves after the rest of the prompt and the completion.
+        """
+        budgets = [self.max_context_tokens] if self.max_context_tokens else []
+        if self.context_window:
+            budgets.append(
+                self.context_window
+                - estimate_token_count(prompt_without_documents)
+                - (max_completion_tokens or 0)
+            )
+        return max(0, min(budgets)) if budgets else None
+
+    def build_prompt(self, expertise_area, user_question, context_documents):
         prompt = (
             f"You are an expert in '{expertise_area}'. A user has asked for help with the following question: "
             f"'{user_question}'. Please provide insights using only the information from the provided documents. "
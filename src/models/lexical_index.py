@@ -0,0 +1,163 @@
+import numpy as np
+import threading
+import heapq
+import math
+import re
+
+from collections import Counter
+
+# Words of the documents and queries, compared case-insensitively
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    Inverted index of the sections, ranking keyword searches with BM25.
+
+    build() packs the postings of the whole knowledge base into numpy arrays sorted by
+    term. Sections added afterwards go to small per-term dicts, and removed sections
+    are masked out, so the index follows the changes of the knowledge base without
+    being rebuilt. A search only visits the postings of the query terms.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.build([], [])
+
+    def __len__(self):
+        return self.num_sections
+
+    def build(self, ids, texts):
+        """Replaces the content of the index with the sections `texts` under `ids`."""
+        vocabulary, term_ids, lengths = {}, [], []
+        for text in texts:
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            term_ids.extend([vocabulary.setdefault(t, len(vocabulary)) for t in tokens])
+        lengths = np.array(lengths, dtype="int64")
+        num_texts = max(len(lengths), 1)
+        # One key per (term, section) pair: sorting them groups the postings by term
+        keys, frequencies = np.unique(
+            np.array(term_ids, dtype="int64") * num_texts
+            + np.repeat(np.arange(len(lengths)), lengths),
+            return_counts=True,
+        )
+        with self.lock:
+            self.vocabulary = vocabulary
+            self.offsets = np.searchsorted(
+                keys // num_texts, np.arange(len(vocabulary) + 1)
+            )
+            self.posting_positions = keys % num_texts
+            self.posting_frequencies = frequencies.astype("float32")
+            self.base_ids = np.array(ids, dtype="int64")
+            self.base_positions = {id_: p for p, id_ in enumerate(ids)}
+            self.base_lengths = lengths.astype("float32")
+            self.base_alive = np.ones(len(lengths), dtype=bool)
+            # Sections added after build()
+            self.postings = {}  # term -> {section ID: term frequency}
+            self.lengths = {}  # section ID -> number of tokens
+            self.num_sections = len(lengths)
+            self.total_length = int(lengths.sum())
+
+    def add(self, ids, texts):
+        """Adds sections under new `ids`."""
+        with self.lock:
+            for id_, text in zip(ids, texts):
+                tokens = tokenize(text)
+                for term, frequency in Counter(tokens).items():
+                    self.postings.setdefault(term, {})[id_] = frequency
+                self.lengths[id_] = len(tokens)
+                self.num_sections += 1
+                self.total_length += len(tokens)
+
+    def remove(self, ids, texts):
+        """Removes the sections `ids`, whose `texts` give the postings to update."""
+        with self.lock:
+            for id_, text in zip(ids, texts):
+                position = self.base_positions.get(id_)
+                if position is not None and self.base_alive[position]:
+                    self.base_alive[position] = False
+                    length = int(self.base_lengths[position])
+                elif id_ in self.lengths:
+                    for term in set(tokenize(text)):
+                        section_frequencies = self.postings.get(term)
+                        if section_frequencies is not None:
+                            section_frequencies.pop(id_, None)
+                            if not section_frequencies:
+                                del self.postings[term]
+                    length = self.lengths.pop(id_)
+                else:
+                    continue
+                self.num_sections -= 1
+                self.total_length -= length
+
+    def search(self, query_text, num_results):
+        """Returns the (section ID, BM25 score) of the best matches of the query."""
+        with self.lock:
+            if not self.num_sections:
+                return []
+            average_length = self.total_length / self.num_sections or 1.0
+            base_scores = np.zeros(len(self.base_ids), dtype="float32")
+            scores = {}
+            for term in set(tokenize(query_text)):
+                term_id = self.vocabulary.get(term)
+                positions = frequencies = None
+                if term_id is not None:
+                    start, end = self.offsets[term_id], self.offsets[term_id + 1]
+                    positions = self.posting_positions[start:end]
+                    alive = self.base_alive[positions]
+                    positions = positions[alive]
+                    frequencies = self.posting_frequencies[start:end][alive]
+                section_frequencies = self.postings.get(term) or {}
+                document_frequency = len(section_frequencies) + (
+                    len(positions) if positions is not None else 0
+                )
+                if not document_frequency:
+                    continue
+                idf = math.log(
+                    1
+                    + (self.num_sections - document_frequency + 0.5)
+                    / (document_frequency + 0.5)
+                )
+                if positions is not None and len(positions):
+                    length_norm = self.k1 * (
+                        1
+                        - self.b
+                        + self.b * self.base_lengths[positions] / average_length
+                    )
+                    base_scores[positions] += (
+                        idf * frequencies * (self.k1 + 1) / (frequencies + length_norm)
+                    )
+                for id_, frequency in section_frequencies.items():
+                    length_norm = self.k1 * (
+                        1 - self.b + self.b * self.lengths[id_] / average_length
+                    )
+                    scores[id_] = scores.get(id_, 0.0) + idf * frequency * (
+                        self.k1 + 1
+                    ) / (frequency + length_norm)
+
+            matched_positions = np.flatnonzero(base_scores)
+            if len(matched_positions) > num_results:
+                best = np.argpartition(-base_scores[matched_positions], num_results)
+                matched_positions = matched_positions[best[:num_results]]
+            for position in matched_positions:
+                scores[int(self.base_ids[position])] = float(base_scores[position])
+            return heapq.nlargest(num_results, scores.items(), key=lambda x: x[1])
+
+
+def fuse_rankings(rankings, num_results, k=60):
+    """
+    Reciprocal rank fusion: merges ranked lists of IDs into (ID, score) pairs, scoring
+    every ID by the sum of 1 / (k + rank) over the lists it appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1 / (k + rank)
+    return heapq.nlargest(num_results, scores.items(), key=lambda x: x[1])
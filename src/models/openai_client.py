@@ -0,0 +1,178 @@
+import requests
+import asyncio
+import time
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+
+from .rate_limiter import (
+    RETRYABLE_STATUS_CODES,
+    RateLimiter,
+    estimate_request_tokens,
+    get_backoff_delay,
+    get_retry_after,
+)
+from ..utils.metrics import Metrics
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+class OpenAIError(Exception):
+    """A request to the OpenAI API failed, after being retried when worth it."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @classmethod
+    def from_response(cls, response):
+        try:
+            message = (response.json() or {}).get("error", {}).get("message")
+        except ValueError:
+            message = None
+        return cls(
+            f"HTTP Error {response.status_code}: {message or 'An unspecified error occurred'}",
+            response.status_code,
+        )
+
+
+class OpenAIClient:
+    """
+    HTTP client shared by every call to the OpenAI API.
+
+    Connections are kept alive in a pool of `pool_size` connections per host, so calls
+    after the first one skip the TCP and TLS handshakes. The base URL can point to any
+    server implementing the same endpoints (`OPENAI_BASE_URL` environment variable, or
+    `base_url`). The async methods run the pooled requests on a thread pool of the
+    same size, so that several calls can be awaited concurrently.
+
+    Requests first wait for the per-model budgets of the `rate_limiter`. Connection
+    errors, rate limits and server errors are retried up to `max_retries` times, after
+    the `Retry-After` delay or a jittered exponential backoff. A request that still
+    fails raises an OpenAIError.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url=None,
+        pool_size=10,
+        connect_timeout=10,
+        read_timeout=60,
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_max=30,
+        rate_limiter=None,
+        metrics=None,
+    ):
+        self.base_url = (
+            base_url or os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL
+        ).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Waits for the rate limits and the retries are recorded as "throttle" spans
+        self.metrics = metrics or Metrics()
+
+    @classmethod
+    def from_config(cls, api_key, models_config, metrics=None):
+        """
+        Creates a client from the optional `client` section of the models config, with
+        the rate limits of its model variants.
+        """
+        client_config = (models_config or {}).get("client") or {}
+        return cls(
+            api_key,
+            rate_limiter=RateLimiter.from_config(models_config),
+            metrics=metrics,
+            **client_config,
+        )
+
+    def post(self, path, payload, **kwargs):
+        """
+        POSTs `payload` as JSON to an API endpoint, e.g. `/embeddings`, and returns the
+        successful response.
+        """
+        model = payload.get("model")
+        with self.throttle(model, "rate_limit", self.reserve(payload)) as delay:
+            time.sleep(delay)
+        for attempt in range(self.max_retries + 1):
+            response, error = self.send(path, payload, **kwargs)
+            if error is None:
+                return response
+            with self.throttle(
+                model, "retry", self.get_retry_delay(attempt, response, error)
+            ) as delay:
+                time.sleep(delay)
+
+    async def apost(self, path, payload, **kwargs):
+        """Async version of post(), waiting without holding a thread."""
+        model = payload.get("model")
+        loop = asyncio.get_running_loop()
+        with self.throttle(model, "rate_limit", self.reserve(payload)) as delay:
+            await asyncio.sleep(delay)
+        for attempt in range(self.max_retries + 1):
+            response, error = await loop.run_in_executor(
+                self.executor, lambda: self.send(path, payload, **kwargs)
+            )
+            if error is None:
+                return response
+            with self.throttle(
+                model, "retry", self.get_retry_delay(attempt, response, error)
+            ) as delay:
+                await asyncio.sleep(delay)
+
+    def reserve(self, payload):
+        return self.rate_limiter.reserve(
+            payload.get("model"), estimate_request_tokens(payload)
+        )
+
+    def send(self, path, payload, **kwargs):
+        """Sends a request once, returning the response and the error to retry."""
+        try:
+            response = self.session.post(
+                f"{self.base_url}{path}", json=payload, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException as e:
+            return None, OpenAIError(f"Connection error: {e}")
+        if response.status_code == 200:
+            return response, None
+        error = OpenAIError.from_response(response)
+        response.close()
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            raise error
+        return response, error
+
+    def get_retry_delay(self, attempt, response, error):
+        """Seconds to wait before a retry, raising `error` when out of retries."""
+        if attempt >= self.max_retries:
+            raise error
+        retry_after = get_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return get_backoff_delay(attempt, self.backoff_base, self.backoff_max)
+
+    @contextmanager
+    def throttle(self, model, reason, delay):
+        """Records a wait of `delay` seconds, done by the body of the `with` block."""
+        if delay <= 0:
+            yield 0
+            return
+        with self.metrics.span("throttle", model=model, reason=reason) as span:
+            span.record(wait_seconds=delay)
+            yield delay
+
+    def close(self):
+        self.session.close()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,111 @@
+import threading
+import random
+import time
+
+from ..utils.utils import estimate_token_count
+
+# Status codes worth retrying: timeouts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Allows `limit` units (requests or tokens) per minute, in bursts of up to `limit`.
+
+    Reservations never fail: a reservation larger than what is left puts the bucket
+    in debt, and returns how long the caller must wait before sending its request.
+    """
+
+    def __init__(self, limit):
+        self.capacity = limit
+        self.refill_per_second = limit / 60
+        self.available = limit
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(
+                self.capacity,
+                self.available + (now - self.updated_at) * self.refill_per_second,
+            )
+            self.updated_at = now
+            self.available -= amount
+            if self.available >= 0:
+                return 0.0
+            return -self.available / self.refill_per_second
+
+
+class RateLimiter:
+    """
+    Per-model request (RPM) and token (TPM) budgets, read from the
+    `requests_per_minute` and `tokens_per_minute` of the model variants.
+    Models without limits are not throttled.
+    """
+
+    def __init__(self, limits=None):
+        self.buckets = {
+            model: (
+                TokenBucket(rpm) if rpm else None,
+                TokenBucket(tpm) if tpm else None,
+            )
+            for model, (rpm, tpm) in (limits or {}).items()
+        }
+
+    @classmethod
+    def from_config(cls, models_config):
+        limits = {}
+        for group in (models_config or {}).get("models", []):
+            for variant in group["variants"]:
+                limits[variant["model"]] = (
+                    variant.get("requests_per_minute"),
+                    variant.get("tokens_per_minute"),
+                )
+        return cls(limits)
+
+    def reserve(self, model, tokens):
+        """Reserves one request and `tokens` tokens, returning the seconds to wait."""
+        request_bucket, token_bucket = self.buckets.get(model, (None, None))
+        delay = 0.0
+        if request_bucket is not None:
+            delay = max(delay, request_bucket.reserve(1))
+        if token_bucket is not None:
+            delay = max(delay, token_bucket.reserve(tokens))
+        return delay
+
+
+def estimate_request_tokens(payload):
+    """
+    Tokens counted against the TPM limit: the input, plus the completion budget of chat
+    requests (the API reserves `max_tokens` up front).
+    """
+    if "input" in payload:
+        texts = payload["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        return sum(estimate_token_count(text) for text in texts)
+    tokens = sum(
+        estimate_token_count(message.get("content") or "")
+        for message in payload.get("messages", [])
+    )
+    return tokens + (payload.get("max_tokens") or 0)
+
+
+def get_retry_after(response):
+    """Seconds to wait according to the response headers, or None."""
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # Retry-After can also be an HTTP date, fall back to the backoff then
+        pass
+    return None
+
+
+def get_backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter, to spread the retries of many clients."""
+    # Jitter of the retry delays, not a security use of the random numbers
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))  # nosec B311
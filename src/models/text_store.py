@@ -0,0 +1,110 @@
+import numpy as np
+import mmap
+import json
+import os
+
+from collections.abc import Sequence
+
+
+def write_texts(blob_path, offsets_path, texts):
+    """
+    Writes `texts` as one UTF-8 blob, and the offsets of every text in the blob
+    (len(texts) + 1 int64 values), swapping in complete files only.
+    """
+    offsets = [0]
+    with open(f"{blob_path}.tmp", "wb") as f:
+        for text in texts:
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    with open(f"{offsets_path}.tmp", "wb") as f:
+        np.save(f, np.array(offsets, dtype="int64"))
+    os.replace(f"{blob_path}.tmp", blob_path)
+    os.replace(f"{offsets_path}.tmp", offsets_path)
+
+
+class MappedTexts(Sequence):
+    """
+    List of texts read from a blob written by write_texts, memory-mapped so that only
+    the texts accessed are decoded. Processes mapping the same files share their pages.
+
+    Texts appended afterwards are kept in memory.
+    """
+
+    def __init__(self, blob_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self.blob = b""
+        if os.path.getsize(blob_path):
+            with open(blob_path, "rb") as f:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.num_mapped = len(self.offsets) - 1
+        self.appended = []
+
+    def __len__(self):
+        return self.num_mapped + len(self.appended)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if position >= self.num_mapped:
+            return self.appended[position - self.num_mapped]
+        if position < 0:
+            raise IndexError("text position out of range")
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.blob[start:end].decode("utf-8")
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def append(self, text):
+        self.appended.append(text)
+
+
+def write_document_ids(names_path, numbers_path, document_ids):
+    """
+    Writes the document ID (or None) of every section, as the distinct document IDs
+    (JSON) and the number of the document of every section (int32, -1 for None),
+    swapping in complete files only.
+    """
+    names = {}
+    numbers = np.array(
+        [
+            -1 if document_id is None else names.setdefault(document_id, len(names))
+            for document_id in document_ids
+        ],
+        dtype="int32",
+    )
+    with open(f"{names_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(list(names), f)
+    with open(f"{numbers_path}.tmp", "wb") as f:
+        np.save(f, numbers)
+    os.replace(f"{names_path}.tmp", names_path)
+    os.replace(f"{numbers_path}.tmp", numbers_path)
+
+
+class MappedDocumentIds(Sequence):
+    """
+    Document IDs of the sections, read from the files written by write_document_ids.
+    The document numbers are memory-mapped, so that only the distinct document IDs are
+    loaded.
+    """
+
+    def __init__(self, names_path, numbers_path):
+        with open(names_path, "r", encoding="utf-8") as f:
+            self.names = json.load(f)
+        self.numbers = np.load(numbers_path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(len(self)))]
+        number = self.numbers[position]
+        return self.names[number] if number >= 0 else None
+
+    def __iter__(self):
+        for number in self.numbers.tolist():
+            yield self.names[number] if number >= 0 else None
@@ -1,21 +1,82 @@
 import numpy as np
-import requests
 import faiss
 import json
 import re
 
 from tqdm.auto import tqdm
 
+from .embedding_cache import QueryEmbeddingCache
+from .index_factory import (
+    build_faiss_index,
+    get_inner_index,
+    get_precision,
+    read_faiss_index,
+    search_filtered,
+)
+from .lexical_index import LexicalIndex
+from .openai_client import OpenAIClient, OpenAIError
+from .text_store import MappedTexts
+from ..utils.chunking import chunk_sections
+from ..utils.metrics import Metrics
+from ..utils.utils import estimate_token_count
+
+# Models accepting the `dimensions` parameter of the embeddings API (shortened vectors)
+SHORTENED_EMBEDDING_MODELS = ("text-embedding-3-small", "text-embedding-3-large")
+
 
 class SemanticVectorizer:
-    def __init__(self, api_key, models_config):
+    def __init__(
+        self,
+        api_key,
+        models_config,
+        max_batch_items=512,
+        max_batch_tokens=100000,
+        query_cache=None,
+        embedding_store=None,
+        client=None,
+        metrics=None,
+    ):
         self.api_key = api_key
         self.models_config = models_config
+        self.client = client or OpenAIClient.from_config(
+            api_key, models_config, metrics=metrics
+        )
+        # Budget of a single embeddings request during ingestion
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
         self.model = None
         self.usage_price_per_token = 0
+        # Size of the vectors of the model, and the size asked for (see get_dimensions)
+        self.native_dimensions = None
+        self.embedding_dimensions = (models_config.get("retrieval") or {}).get(
+            "embedding_dimensions"
+        )
+        # Model, size and precision of the vectors of the index, recorded with its
+        # databases (see get_embedding_settings), None when unknown
+        self.index_embedding = None
         self.texts = []
+        # Stable IDs of the sections in the FAISS index, aligned with self.texts (a
+        # read-only array when memory-mapped), and their positions, mapped on first use
+        # (see get_id_positions)
+        self.ids = []
+        self.id_positions = None
         self.embeddings = []
         self.faiss_index = None
+        # Texts and provenance of the sections, by section ID (see DocumentStore)
+        self.document_store = None
+        # BM25 index of the texts, built on the first keyword search (see LexicalIndex)
+        self.lexical_index = None
+        # Type and parameters of the FAISS index (see index_factory)
+        self.retrieval_config = models_config.get("retrieval")
+        # Token bounds of the chunks embedded during ingestion (see chunk_sections)
+        self.chunking_config = models_config.get("chunking")
+        self.query_cache = query_cache if query_cache else QueryEmbeddingCache()
+        # Content-addressed store of section embeddings (see EmbeddingStore)
+        self.embedding_store = embedding_store
+        self.reused_embeddings = 0
+        self.new_embeddings = 0
+        # Spans of the parse, embed, index add and search stages
+        self.metrics = metrics or Metrics()
 
     def set_model(self, model_name):
         found = False
@@ -24,6 +85,7 @@ class SemanticVectorizer:
                 if variant["model"] == model_name:
                     self.model = model_name
                     self.usage_price_per_token = variant.get("usage_price_per_token", 0)
+                    self.native_dimensions = variant.get("dimensions")
                     found = True
                     break
             if found:
@@ -39,52 +101,214 @@ class SemanticVectorizer:
         return text.replace("\n", " ").strip()
 
     def read_and_process_markdown(self, file_path):
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-        sections = re.split(r"\n(#{1,3} .*)\n", text)
-        self.texts = [self.preprocess_text(sections[0])] + [
-            self.preprocess_text(f"{sections[i]}\n{sections[i + 1]}")
-            for i in range(1, len(sections), 2)
-        ]
+        with self.metrics.span("parse") as span:
+            with open(file_path, "r", encoding="utf-8") as file:
+                text = file.read()
+            sections = re.split(r"\n(#{1,3} .*)\n", text)
+            sections = [{"text": sections[0], "headers": []}] + [
+                {"text": f"{sections[i]}\n{sections[i + 1]}", "headers": [sections[i]]}
+                for i in range(1, len(sections), 2)
+            ]
+            self.texts = [
+                self.preprocess_text(section["text"])
+                for section in chunk_sections(sections, self.chunking_config)
+            ]
+            span.record(items=len(self.texts), bytes=len(text))
         return self.texts
 
     def query_openai_embedding(self, text):
-        preprocessed_text = self.preprocess_text(text)
-        url = "https://api.openai.com/v1/embeddings"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
+        embeddings, usage = self.query_openai_embeddings([text])
+        return embeddings[0], usage
+
+    def query_openai_embeddings(self, texts):
+        """
+        Embeds several texts with a single request.
+
+        Returns a float32 matrix whose rows follow the order of `texts`, and the usage.
+        Raises an OpenAIError when the request fails.
+        """
+        with self.metrics.span("embed", model=self.model) as span:
+            response = self.client.post(
+                "/embeddings", self.make_embeddings_payload(texts)
+            )
+            return self.parse_embeddings_response(response, len(texts), span)
+
+    async def aembed(self, texts):
+        """Async version of query_openai_embeddings()."""
+        with self.metrics.span("embed", model=self.model) as span:
+            response = await self.client.apost(
+                "/embeddings", self.make_embeddings_payload(texts)
+            )
+            return self.parse_embeddings_response(response, len(texts), span)
+
+    def make_embeddings_payload(self, texts):
         payload = {
-            "input": preprocessed_text,
+            "input": [self.preprocess_text(text) for text in texts],
             "model": self.model,
         }
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-        if response.status_code == 200:
-            data = response.json()
-            embedding = np.array(data["data"][0]["embedding"], dtype="float32")
-            return embedding, data.get("usage", {})
-        else:
-            print(
-                f"Failed to generate embedding: Status code {response.status_code}, Response: {response.text}"
+        dimensions = self.get_dimensions()
+        if dimensions:
+            payload["dimensions"] = dimensions
+        return payload
+
+    def get_dimensions(self):
+        """
+        Size of the shortened vectors asked to the embeddings API, or None for the full
+        vectors of the model.
+
+        An index records the model and size it was built with, so queries and new
+        sections are embedded to match it, and another model raises a ValueError.
+        Otherwise `embedding_dimensions` of the retrieval config applies to the models
+        that support it.
+        """
+        if self.index_embedding:
+            if self.index_embedding["model"] != self.model:
+                raise ValueError(
+                    f"The knowledge base was embedded with {self.index_embedding['model']}, not {self.model}."
+                )
+            return self.index_embedding["dimensions"]
+        dimensions = self.embedding_dimensions
+        if self.model not in SHORTENED_EMBEDDING_MODELS:
+            return None
+        if dimensions == self.native_dimensions:
+            return None
+        return dimensions
+
+    def get_embedding_settings(self):
+        """
+        Model, size (None for the full vectors) and precision of the embedded sections,
+        recorded with the databases and the merged index.
+        """
+        if self.model is None:
+            return self.index_embedding
+        return {
+            "model": self.model,
+            "dimensions": self.get_dimensions(),
+            "precision": get_precision(self.retrieval_config),
+        }
+
+    def get_model_key(self):
+        """Model name under which the embeddings are cached, with their size."""
+        dimensions = self.get_dimensions()
+        return f"{self.model}-{dimensions}d" if dimensions else self.model
+
+    def parse_embeddings_response(self, response, num_texts, span=None):
+        data = response.json()
+        items = data["data"]
+        embeddings = np.empty((num_texts, len(items[0]["embedding"])), "float32")
+        # The API tags every vector with the position of its input
+        for item in items:
+            embeddings[item["index"]] = item["embedding"]
+        usage = data.get("usage", {})
+        if span is not None:
+            span.record(
+                items=num_texts,
+                tokens=usage.get("total_tokens"),
+                bytes=len(response.content),
+                cost=self.calculate_cost(usage),
             )
-            return None, None
+        return embeddings, usage
 
-    def generate_embeddings(self, save_index=False, index_path=None, texts_path=None):
+    def make_batches(self, texts):
+        """
+        Groups the positions of `texts` into batches that fit the item and token budget.
+        """
+        batch, batch_tokens = [], 0
+        for position, text in enumerate(texts):
+            tokens = estimate_token_count(text)
+            if batch and (
+                len(batch) >= self.max_batch_items
+                or batch_tokens + tokens > self.max_batch_tokens
+            ):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(position)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def embed_batch(self, texts, positions):
+        """
+        Embeds the texts at `positions`, splitting the batch in two when it is rejected.
+
+        Transient errors are already retried by the client. Returns a list of
+        (positions, embeddings, usage) tuples covering every position.
+        """
+        try:
+            embeddings, usage = self.query_openai_embeddings(
+                [texts[p] for p in positions]
+            )
+        except OpenAIError as e:
+            if len(positions) == 1:
+                raise RuntimeError(
+                    f"Failed to generate the embedding of text {positions[0]}: {e}"
+                ) from e
+            middle = len(positions) // 2
+            return self.embed_batch(texts, positions[:middle]) + self.embed_batch(
+                texts, positions[middle:]
+            )
+        return [(positions, embeddings, usage)]
+
+    def embed_texts(self, texts, show_progress=True, use_store=True):
+        """
+        Embeds `texts` in batches, reusing the embeddings found in the embedding store
+        (sections only: queries are embedded with `use_store=False`, so as not to fill
+        the store with them).
+
+        Returns a float32 matrix with one row per text and the cost of the requests.
+        """
         total_cost = 0
-        embeddings = []  # Local list to collect embeddings
+        embeddings = None  # Preallocated once the dimension is known
+        missing_positions = list(range(len(texts)))
+        embedding_store = self.embedding_store if use_store else None
+
+        # Reuse the embeddings of sections that were already embedded once
+        if embedding_store is not None:
+            embeddings, missing_positions = embedding_store.lookup(
+                self.get_model_key(), [self.preprocess_text(text) for text in texts]
+            )
+        missing_texts = [texts[p] for p in missing_positions]
+        self.reused_embeddings = len(texts) - len(missing_texts)
+        self.new_embeddings = len(missing_texts)
+
+        with tqdm(total=len(missing_texts), disable=not show_progress) as progress_bar:
+            for positions in self.make_batches(missing_texts):
+                for batch_positions, batch_embeddings, usage in self.embed_batch(
+                    missing_texts, positions
+                ):
+                    if embeddings is None:
+                        embeddings = np.empty(
+                            (len(texts), batch_embeddings.shape[1]), "float32"
+                        )
+                    embeddings[[missing_positions[p] for p in batch_positions]] = (
+                        batch_embeddings
+                    )
+                    total_cost += self.calculate_cost(usage)
+                    if embedding_store is not None:
+                        embedding_store.add(
+                            self.get_model_key(),
+                            [
+                                self.preprocess_text(missing_texts[p])
+                                for p in batch_positions
+                            ],
+                            batch_embeddings,
+                        )
+                progress_bar.update(len(positions))
 
-        for text in tqdm(self.texts):
-            embedding, usage = self.query_openai_embedding(text)
-            if embedding is not None:
-                embeddings.append(embedding)
-                total_cost += self.calculate_cost(usage)
+        if embeddings is None:
+            embeddings = np.empty((0, 0), "float32")
+        return embeddings, total_cost
 
-        self.embeddings = np.array(embeddings)  # Convert to numpy array
+    def generate_embeddings(self, save_index=False, index_path=None, texts_path=None):
+        self.embeddings, total_cost = self.embed_texts(self.texts)
+        self.ids = []
         self.create_faiss_index()
 
         if save_index and index_path:
-            self.save_faiss_index(index_path)
             if texts_path:  # Save texts at specified path
-                with open(texts_path, "w", encoding="utf-8") as f:
-                    json.dump(self.texts, f)
+                self.save_faiss_index(index_path, texts_path)
+            else:
+                faiss.write_index(self.faiss_index, index_path)
 
         return total_cost
 
@@ -99,23 +323,249 @@ class SemanticVectorizer:
     def create_faiss_index(self):
         if self.embeddings.size > 0:
             dimension = self.embeddings.shape[1]
-            self.faiss_index = faiss.IndexFlatL2(dimension)
-            self.faiss_index.add(self.embeddings)
+            # Sections without a stable ID are identified by their position
+            if len(self.ids) != len(self.texts):
+                self.ids = list(range(len(self.texts)))
+            with self.metrics.span("index_add") as span:
+                self.faiss_index = build_faiss_index(
+                    dimension, [(self.ids, self.embeddings)], self.retrieval_config
+                )
+                span.record(items=len(self.ids))
+            self.index_embedding = self.get_embedding_settings()
+            self.id_positions = None
+            self.lexical_index = None
         else:
             print("No embeddings to add to FAISS index.")
 
-    def search_similar_sections(self, query_text, num_results):
-        query_embedding, _ = self.query_openai_embedding(query_text)
+    def set_sections(self, ids, texts, faiss_index, embedding=None):
+        """
+        Replaces the sections with `texts` indexed under `ids` in `faiss_index`, whose
+        vectors were embedded with the `embedding` settings (see get_embedding_settings).
+        """
+        # Memory-mapped IDs and texts are kept as they are, to be read on access only
+        self.ids = ids if isinstance(ids, np.ndarray) else list(ids)
+        self.texts = texts if isinstance(texts, MappedTexts) else list(texts)
+        self.faiss_index = faiss_index
+        self.index_embedding = embedding if faiss_index is not None else None
+        if self.index_embedding and self.model is None:
+            # Queries are embedded with the model of the index until another is set
+            self.set_model(self.index_embedding["model"])
+        self.id_positions = None
+        self.lexical_index = None
+
+    def get_id_positions(self):
+        """Positions of the sections in `self.texts` by ID, mapped when first needed."""
+        if self.id_positions is None:
+            ids = self.ids.tolist() if isinstance(self.ids, np.ndarray) else self.ids
+            self.id_positions = {id_: p for p, id_ in enumerate(ids)}
+        return self.id_positions
+
+    def add_sections(self, ids, texts, embeddings):
+        """Adds sections to the live index under their stable `ids`."""
+        if self.faiss_index is not None and not len(self.ids):
+            if self.faiss_index.ntotal:
+                raise ValueError("Sections can only be added to an ID-mapped index.")
+            # Every section was removed: start again from a new index
+            self.faiss_index = None
+        with self.metrics.span("index_add") as span:
+            if self.faiss_index is None:
+                self.faiss_index = build_faiss_index(
+                    embeddings.shape[1], [(ids, embeddings)], self.retrieval_config
+                )
+                self.index_embedding = self.get_embedding_settings()
+            else:
+                self.faiss_index.add_with_ids(embeddings, np.array(ids, dtype="int64"))
+            span.record(items=len(ids))
+        id_positions = self.get_id_positions()
+        if isinstance(self.ids, np.ndarray):
+            self.ids = self.ids.tolist()
+        for id_, text in zip(ids, texts):
+            id_positions[id_] = len(self.ids)
+            self.ids.append(id_)
+            self.texts.append(text)
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, texts)
+
+    def remove_sections(self, ids):
+        """Removes the sections with the given `ids` from the live index."""
+        if not len(ids):
+            return
+        removed_ids = set(ids)
+        section_ids = (
+            self.ids.tolist() if isinstance(self.ids, np.ndarray) else self.ids
+        )
+        kept_positions = [
+            p for p, id_ in enumerate(section_ids) if id_ not in removed_ids
+        ]
+        kept_ids = [section_ids[p] for p in kept_positions]
+        lexical_index = self.lexical_index
+        if lexical_index is not None:
+            id_positions = self.get_id_positions()
+            removed_positions = [
+                id_positions[id_] for id_ in removed_ids if id_ in id_positions
+            ]
+            lexical_index.remove(
+                [section_ids[p] for p in removed_positions],
+                [self.texts[p] for p in removed_positions],
+            )
+        inner_index = get_inner_index(self.faiss_index)
+        if (
+            isinstance(inner_index, faiss.IndexIVF)
+            and inner_index is not self.faiss_index
+        ):
+            # The ID map renumbers the vectors left, but IVF lists keep their internal
+            # IDs: add the kept vectors to an empty copy of the trained index instead
+            vectors = inner_index.reconstruct_n(0, self.faiss_index.ntotal)
+            empty_index = faiss.clone_index(inner_index)
+            empty_index.reset()
+            self.faiss_index = faiss.IndexIDMap2(empty_index)
+            self.faiss_index.add_with_ids(
+                vectors[kept_positions], np.array(kept_ids, dtype="int64")
+            )
+        else:
+            try:
+                self.faiss_index.remove_ids(np.array(ids, dtype="int64"))
+            except RuntimeError:
+                # Graph indexes (HNSW) cannot remove vectors: rebuild from the kept ones
+                vectors = inner_index.reconstruct_n(0, self.faiss_index.ntotal)
+                self.faiss_index = build_faiss_index(
+                    self.faiss_index.d,
+                    [(kept_ids, vectors[kept_positions])],
+                    self.retrieval_config,
+                )
+        self.set_sections(
+            kept_ids,
+            [self.texts[p] for p in kept_positions],
+            self.faiss_index,
+            self.index_embedding,
+        )
+        self.lexical_index = lexical_index
+
+    def get_positions(self, labels):
+        """Maps the labels returned by a FAISS search to positions in `self.texts`."""
+        if not len(self.ids):  # Plain index: labels already are positions
+            return [label for label in labels if 0 <= label < len(self.texts)]
+        id_positions = self.get_id_positions()
+        return [id_positions[label] for label in labels if label in id_positions]
+
+    def embed_query(self, query_text):
+        """
+        Embeds a query, reusing the cached embedding of an identical earlier query.
+        """
+        preprocessed_text = self.preprocess_text(query_text)
+        query_embedding = self.query_cache.get(self.get_model_key(), preprocessed_text)
+        if query_embedding is None:
+            query_embedding, _ = self.query_openai_embedding(query_text)
+            self.query_cache.set(
+                self.get_model_key(), preprocessed_text, query_embedding
+            )
+        return query_embedding
+
+    async def aembed_query(self, query_text):
+        """
+        Async version of embed_query(), also returning the usage (empty when cached).
+        """
+        preprocessed_text = self.preprocess_text(query_text)
+        query_embedding = self.query_cache.get(self.get_model_key(), preprocessed_text)
+        if query_embedding is not None:
+            return query_embedding, {}
+        embeddings, usage = await self.aembed([query_text])
+        self.query_cache.set(self.get_model_key(), preprocessed_text, embeddings[0])
+        return embeddings[0], usage
+
+    def search_similar_sections(self, query_text, num_results, filters=None):
+        if self.faiss_index is None:
+            raise ValueError(
+                "FAISS index is not initialized. Please create the index before searching."
+            )
+        query_embedding = self.embed_query(query_text)
+        return self.search_embedding(query_embedding, num_results, filters)
+
+    def search_embedding(self, query_embedding, num_results, filters=None):
+        """Returns the texts of the sections closest to an already computed embedding."""
+        return [
+            record["text"]
+            for record in self.get_records(
+                self.search_positions(query_embedding, num_results, filters)
+            )
+        ]
+
+    def search_positions(self, query_embedding, num_results, filters=None):
+        """
+        Returns the positions in `self.texts` of the sections closest to the embedding,
+        among those matching `filters` (see DocumentStore.find_ids) when given.
+        """
         if self.faiss_index is None:
             raise ValueError(
                 "FAISS index is not initialized. Please create the index before searching."
             )
         if query_embedding is None:
             return []
-        distances, indices = self.faiss_index.search(
-            np.array([query_embedding], dtype="float32"), num_results
+        queries = np.array([query_embedding], dtype="float32")
+        with self.metrics.span("search") as span:
+            if filters:
+                ids = self.get_filtered_ids(filters)
+                if not ids:
+                    return []
+                distances, indices = search_filtered(
+                    self.faiss_index, queries, num_results, ids
+                )
+            else:
+                distances, indices = self.faiss_index.search(queries, num_results)
+            positions = self.get_positions(indices[0])
+            span.record(items=len(positions))
+        return positions
+
+    def get_filtered_ids(self, filters):
+        """IDs of the sections of the index matching `filters`."""
+        if self.document_store is None:
+            raise ValueError("Filtered searches need the document store.")
+        id_positions = self.get_id_positions()
+        return [
+            id_ for id_ in self.document_store.find_ids(filters) if id_ in id_positions
+        ]
+
+    def get_lexical_index(self):
+        """The BM25 index of the texts, built when first needed."""
+        if self.lexical_index is None or len(self.lexical_index) != len(self.texts):
+            lexical_index = LexicalIndex()
+            lexical_index.build(
+                self.get_section_ids(range(len(self.texts))), self.texts
+            )
+            self.lexical_index = lexical_index
+        return self.lexical_index
+
+    def search_keywords(self, query_text, num_results):
+        """Returns the positions in `self.texts` and BM25 scores of the best matches."""
+        with self.metrics.span("keyword_search") as span:
+            matches = self.get_lexical_index().search(query_text, num_results)
+            span.record(items=len(matches))
+        if not len(self.ids):  # Plain index: the IDs are positions
+            return matches
+        id_positions = self.get_id_positions()
+        return [(id_positions[id_], score) for id_, score in matches]
+
+    def get_section_ids(self, positions):
+        """Stable IDs of the sections at `positions` (the positions for a plain index)."""
+        if not len(self.ids):
+            return list(positions)
+        return [int(self.ids[p]) for p in positions]
+
+    def get_records(self, positions):
+        """
+        Records of the sections at `positions`, fetched from the document store. Sections
+        missing from the store only have their ID and text.
+        """
+        ids = self.get_section_ids(positions)
+        records = (
+            self.document_store.get(ids)
+            if self.document_store is not None
+            else [None] * len(ids)
         )
-        return [self.texts[idx] for idx in indices[0] if idx < len(self.texts)]
+        return [
+            record or {"id": id_, "text": self.texts[p]}
+            for id_, p, record in zip(ids, positions, records)
+        ]
 
     def save_faiss_index(self, index_path, texts_path):
         # Save the FAISS index
@@ -125,11 +575,16 @@ class SemanticVectorizer:
 
         # Save the texts
         with open(texts_path, "w", encoding="utf-8") as f:
-            json.dump(self.texts, f)
+            json.dump(list(self.texts), f)
         print(f"Texts saved successfully to {texts_path}.")
 
     def load_faiss_index(self, index_path):
-        self.faiss_index = faiss.read_index(index_path)
+        self.faiss_index = read_faiss_index(index_path, self.retrieval_config)
+        # A bare index file does not record how its vectors were embedded
+        self.index_embedding = None
+        self.ids = []
+        self.id_positions = None
+        self.lexical_index = None
 
     def calculate_cost(self, usage):
         total_tokens = usage.get("total_tokens", 0)
@@ -0,0 +1,241 @@
+"""
+Headless RAG over a JSONL file of questions.
+
+Usage:
+python -m src.pipelines.bulk_rag questions.jsonl answers.jsonl \
+    --embedding-model text-embedding-3-small --inference-model gpt-3.5-turbo-0125
+
+Every input line is a JSON object with a "question" and an optional "id" (the line
+number by default). Every output line holds the id, the question, the answer, the IDs
+of the retrieved sections, the timings and the costs. Finished ids are skipped when the
+job is started again, so a crashed job resumes where it stopped.
+"""
+
+import numpy as np
+import argparse
+import asyncio
+import json
+import time
+import os
+
+from .query_pipeline import DEFAULT_COLLECTION, QueryPipeline, NO_DOCUMENTS_FOUND
+from ..utils.metrics import Metrics
+from ..utils.utils import load_credentials, load_models_config
+
+
+def read_questions(input_path):
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            if line.strip():
+                row = json.loads(line)
+                yield {"id": row.get("id", line_number), "question": row["question"]}
+
+
+def read_finished_ids(output_path):
+    """
+    Returns the ids already answered in `output_path`, dropping a last line that was
+    only partially written.
+    """
+    finished_ids = set()
+    if not os.path.exists(output_path):
+        return finished_ids
+    valid_size = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                finished_ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            valid_size += len(line)
+    if valid_size != os.path.getsize(output_path):
+        os.truncate(output_path, valid_size)
+    return finished_ids
+
+
+class BulkRAGRunner:
+    def __init__(
+        self,
+        query_pipeline,
+        num_results=2,
+        max_completion_tokens=500,
+        temperature=0.7,
+        batch_size=256,
+        concurrency=None,
+    ):
+        self.query_pipeline = query_pipeline
+        self.num_results = num_results
+        self.max_completion_tokens = max_completion_tokens
+        self.temperature = temperature
+        self.batch_size = batch_size
+        # Bounded by the connection pool of the client by default
+        self.concurrency = concurrency or self.query_pipeline.client.pool_size
+
+    def run(self, input_path, output_path):
+        """Answers every question of `input_path` not yet in `output_path`."""
+        return asyncio.run(self.arun(input_path, output_path))
+
+    async def arun(self, input_path, output_path):
+        finished_ids = read_finished_ids(output_path)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start_time = time.perf_counter()
+        stats = {"answered": 0, "skipped": 0, "failed": 0, "cost": 0.0}
+
+        with open(output_path, "a", encoding="utf-8") as output_file:
+            batch = []
+            for row in read_questions(input_path):
+                if row["id"] in finished_ids:
+                    stats["skipped"] += 1
+                    continue
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    await self.run_batch(batch, semaphore, output_file, stats)
+                    batch = []
+            if batch:
+                await self.run_batch(batch, semaphore, output_file, stats)
+
+        stats["seconds"] = time.perf_counter() - start_time
+        return stats
+
+    async def run_batch(self, batch, semaphore, output_file, stats):
+        embedder = self.query_pipeline.embedder
+        questions = [row["question"] for row in batch]
+
+        try:
+            # One embeddings request per batch, and one FAISS search for all its
+            # questions. The questions are not added to the embedding store of sections
+            stage_start_time = time.perf_counter()
+            embeddings, embedding_cost = embedder.embed_texts(
+                questions, show_progress=False, use_store=False
+            )
+            embedding_time = time.perf_counter() - stage_start_time
+
+            stage_start_time = time.perf_counter()
+            documents = [[] for _ in batch]
+            document_ids = [[] for _ in batch]
+            if self.num_results and embedder.faiss_index is not None:
+                _, labels = embedder.faiss_index.search(
+                    np.ascontiguousarray(embeddings, dtype="float32"),
+                    self.num_results,
+                )
+                for i, row_labels in enumerate(labels):
+                    positions = embedder.get_positions(row_labels)
+                    documents[i] = [embedder.texts[p] for p in positions]
+                    document_ids[i] = embedder.get_section_ids(positions)
+            search_time = time.perf_counter() - stage_start_time
+        except Exception as e:
+            # Not written, so that the questions are retried on the next run
+            print(
+                f"Batch of questions {batch[0]['id']} to {batch[-1]['id']} failed: {e}"
+            )
+            stats["failed"] += len(batch)
+            return
+
+        async def answer(i, row):
+            async with semaphore:
+                try:
+                    result = await self.complete(row["question"], documents[i])
+                except Exception as e:
+                    # Not written, so that the question is retried on the next run
+                    print(f"Question {row['id']} failed: {e}")
+                    stats["failed"] += 1
+                    return
+            result["costs"]["embedding"] = embedding_cost / len(batch)
+            result["timings"].update(
+                {"embedding_batch": embedding_time, "search_batch": search_time}
+            )
+            output_row = {
+                "id": row["id"],
+                "question": row["question"],
+                "answer": result["response"],
+                "expertise_area": result["expertise_area"],
+                "document_ids": document_ids[i],
+                "context_tokens": result["context_tokens"],
+                "dropped_context_tokens": result["dropped_context_tokens"],
+                "timings": result["timings"],
+                "costs": result["costs"],
+                "cost": sum(result["costs"].values()),
+            }
+            # Rows are written as soon as they are answered, so a crash loses little
+            output_file.write(json.dumps(output_row) + "\n")
+            output_file.flush()
+            stats["answered"] += 1
+            stats["cost"] += output_row["cost"]
+
+        await asyncio.gather(*(answer(i, row) for i, row in enumerate(batch)))
+
+    async def complete(self, question, documents):
+        """Runs the expertise and completion calls of one question."""
+        manager = self.query_pipeline.model_inference_manager
+        timings, costs = {}, {}
+
+        stage_start_time = time.perf_counter()
+        expertise_area, usage = await manager.adetermine_expertise_area(
+            question, self.max_completion_tokens, self.temperature
+        )
+        timings["expertise"] = time.perf_counter() - stage_start_time
+        costs["expertise"] = self.query_pipeline.get_inference_cost(usage)
+
+        prompt, context = manager.pack_prompt(
+            expertise_area,
+            question,
+            documents or [NO_DOCUMENTS_FOUND],
+            self.max_completion_tokens,
+        )
+        stage_start_time = time.perf_counter()
+        response, usage = await manager.aquery(
+            prompt, self.max_completion_tokens, self.temperature
+        )
+        timings["completion"] = time.perf_counter() - stage_start_time
+        costs["completion"] = self.query_pipeline.get_inference_cost(usage)
+        return {
+            "response": response,
+            "expertise_area": expertise_area,
+            "context_tokens": context["included_tokens"],
+            "dropped_context_tokens": context["dropped_tokens"],
+            "timings": timings,
+            "costs": costs,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless RAG over a JSONL file.")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--knowledge-base", default="data/processed")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--inference-model", default="gpt-3.5-turbo-0125")
+    parser.add_argument("--num-results", type=int, default=2)
+    parser.add_argument("--max-completion-tokens", type=int, default=500)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    credentials = load_credentials("secrets/credentials.yml")
+    models_config = load_models_config("config/models_config.yml")
+    query_pipeline = QueryPipeline(
+        credentials["OPENAI_CREDENTIALS"],
+        models_config,
+        metrics=Metrics.from_config(models_config),
+    )
+    query_pipeline.load_collection(args.knowledge_base, args.collection)
+    query_pipeline.set_model(args.embedding_model)
+    query_pipeline.model_inference_manager.set_model(args.inference_model)
+
+    runner = BulkRAGRunner(
+        query_pipeline,
+        num_results=args.num_results,
+        max_completion_tokens=args.max_completion_tokens,
+        temperature=args.temperature,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    stats = runner.run(args.input_path, args.output_path)
+    print(
+        f"Answered {stats['answered']} questions ({stats['skipped']} already done, {stats['failed']} failed) in {stats['seconds']:.1f}s for $ {stats['cost']:.4f}."
+    )
+
+
+if __name__ == "__main__":
+    main()
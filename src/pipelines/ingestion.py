@@ -0,0 +1,326 @@
+"""
+Ingestion of a directory (or glob pattern) of markdown files into a knowledge base.
+
+Usage:
+python -m src.pipelines.ingestion docs/ --knowledge-base data/processed \
+    --embedding-model text-embedding-3-small [--collection team-a]
+
+The files are read and split in a pool of processes while the sections already parsed
+are embedded, so parsing overlaps with the requests to the embeddings API. A bounded
+queue between the two stages keeps only a few files in memory. Every file is stored as
+a document, identified by its path (relative to the directory), and files ingested
+again replace their previous version.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from tqdm.auto import tqdm
+import numpy as np
+import threading
+import argparse
+import queue
+import glob
+import time
+import os
+
+from .query_pipeline import (
+    DEFAULT_COLLECTION,
+    QueryPipeline,
+    generate_section_ids,
+    get_collection_directory,
+)
+from ..models.document_store import make_section_records
+from ..utils.chunking import chunk_sections
+from ..utils.metrics import Metrics
+from ..utils.utils import (
+    estimate_token_count,
+    load_credentials,
+    load_models_config,
+    split_markdown_with_metadata,
+)
+
+
+def find_markdown_files(path):
+    """Markdown files of a directory and its sub-directories, or matching a pattern."""
+    pattern = os.path.join(path, "**", "*.md") if os.path.isdir(path) else path
+    return sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+
+
+def parse_markdown_file(file_path, chunking_config=None):
+    """Reads, splits and chunks one file. Runs in the worker processes."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        markdown_content = f.read()
+    sections = chunk_sections(
+        split_markdown_with_metadata(markdown_content), chunking_config
+    )
+    return sections, len(markdown_content.encode("utf-8"))
+
+
+class DirectoryIngester:
+    def __init__(
+        self,
+        query_pipeline,
+        num_workers=None,
+        queue_size=64,
+        max_database_sections=20000,
+    ):
+        self.query_pipeline = query_pipeline
+        # Parsing processes, one per CPU by default
+        self.num_workers = num_workers or os.cpu_count() or 1
+        # Parsed files waiting to be embedded
+        self.queue_size = queue_size
+        # Sections written per database file of the knowledge base
+        self.max_database_sections = max_database_sections
+
+    def run(self, path, embedding_model, directory_path=None):
+        """
+        Ingests the markdown files of `path` (a directory or a glob pattern), saving
+        them to the knowledge base of `directory_path` when given.
+
+        Returns the number of files, sections and bytes ingested, the embedding cost,
+        the number of reused and new embeddings, and the throughput.
+        """
+        query_pipeline = self.query_pipeline
+        file_paths = find_markdown_files(path)
+        root = path if os.path.isdir(path) else None
+        document_ids = [
+            os.path.relpath(file_path, root) if root else file_path
+            for file_path in file_paths
+        ]
+        stats = {
+            "files": 0,
+            "sections": 0,
+            "bytes": 0,
+            "cost": 0.0,
+            "reused_embeddings": 0,
+            "new_embeddings": 0,
+        }
+        start_time = time.perf_counter()
+
+        if directory_path:
+            query_pipeline.load_and_merge_databases(directory_path)
+        # Files ingested again replace their previous version, once the new one is
+        # embedded (see embed_batch)
+        self.replaced_documents = {
+            document_id
+            for document_id in document_ids
+            if document_id in query_pipeline.get_document_sections()
+        }
+        query_pipeline.embedder.set_model(embedding_model)
+        self.document_store = (
+            query_pipeline.open_document_store(directory_path, create=True)
+            if directory_path
+            else None
+        )
+
+        # Sections embedded since the last database was written, and the sections
+        # they replace, deleted from the knowledge base once it is written
+        self.database = []
+        self.replaced_ids = []
+        parsed_files = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        parser_thread = threading.Thread(
+            target=self.parse_files,
+            args=(list(zip(file_paths, document_ids)), parsed_files, stop),
+            daemon=True,
+        )
+        parser_thread.start()
+        try:
+            with query_pipeline.metrics.span("ingest") as span:
+                self.embed_parsed_files(
+                    parsed_files, len(file_paths), directory_path, stats
+                )
+                span.record(
+                    items=stats["files"],
+                    sections=stats["sections"],
+                    bytes=stats["bytes"],
+                )
+        finally:
+            stop.set()
+            parser_thread.join()
+            # What was added to the live index is saved, even when a request failed
+            if directory_path:
+                self.save_database(directory_path)
+
+        if directory_path and stats["files"]:
+            query_pipeline.after_knowledge_base_change(directory_path)
+        stats["seconds"] = time.perf_counter() - start_time
+        stats["files_per_second"] = stats["files"] / stats["seconds"]
+        stats["sections_per_second"] = stats["sections"] / stats["seconds"]
+        return stats
+
+    def parse_files(self, files, parsed_files, stop):
+        """
+        Parses (file path, document ID) pairs in the process pool, and queues them in
+        order with their sections and size. Ends with None, or with the exception that
+        stopped the parsing.
+        """
+
+        def put(item):
+            # Gives up when the embedding stage stopped, instead of blocking forever
+            while not stop.is_set():
+                try:
+                    parsed_files.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            with ProcessPoolExecutor(self.num_workers) as executor:
+                pending = deque()
+                for file_path, document_id in files:
+                    # A few files per worker in flight: enough to keep them all busy
+                    if len(pending) >= 2 * self.num_workers:
+                        if not put(self.get_parsed_file(pending.popleft())):
+                            break
+                    pending.append(
+                        (
+                            file_path,
+                            document_id,
+                            executor.submit(
+                                parse_markdown_file,
+                                file_path,
+                                self.query_pipeline.embedder.chunking_config,
+                            ),
+                        )
+                    )
+                while pending and put(self.get_parsed_file(pending.popleft())):
+                    pass
+                for _, _, future in pending:
+                    future.cancel()
+            put(None)
+        except Exception as e:
+            put(e)
+
+    def get_parsed_file(self, pending_file):
+        file_path, document_id, future = pending_file
+        sections, num_bytes = future.result()
+        return file_path, document_id, sections, num_bytes
+
+    def embed_parsed_files(self, parsed_files, num_files, directory_path, stats):
+        """
+        Embeds the queued files in batches of the size of an embeddings request, and
+        adds them to the live index and to the knowledge base.
+        """
+        embedder = self.query_pipeline.embedder
+        batch = []
+        batch_sections, batch_tokens = 0, 0
+        with tqdm(total=num_files, unit="file") as progress_bar:
+            while True:
+                item = parsed_files.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    break
+                file_path, document_id, sections, num_bytes = item
+                batch.append(item)
+                batch_sections += len(sections)
+                batch_tokens += sum(
+                    estimate_token_count(section["text"]) for section in sections
+                )
+                stats["bytes"] += num_bytes
+                if (
+                    batch_sections >= embedder.max_batch_items
+                    or batch_tokens >= embedder.max_batch_tokens
+                ):
+                    self.embed_batch(batch, directory_path, stats)
+                    progress_bar.update(len(batch))
+                    batch = []
+                    batch_sections, batch_tokens = 0, 0
+            if batch:
+                self.embed_batch(batch, directory_path, stats)
+                progress_bar.update(len(batch))
+
+    def embed_batch(self, batch, directory_path, stats):
+        query_pipeline = self.query_pipeline
+        embedder = query_pipeline.embedder
+        ids, texts, document_ids, document_sections = [], [], [], {}
+        records = []
+        for file_path, document_id, sections, _ in batch:
+            section_ids = generate_section_ids(len(sections))
+            document_sections[document_id] = section_ids
+            ids.extend(section_ids)
+            texts.extend(section["text"] for section in sections)
+            document_ids.extend([document_id] * len(sections))
+            records.extend(
+                make_section_records(section_ids, sections, document_id, file_path)
+            )
+
+        if texts:
+            embeddings, cost = embedder.embed_texts(texts, show_progress=False)
+        # Only now that their new sections are embedded, the previous ones are removed
+        replaced_documents = self.replaced_documents.intersection(document_sections)
+        self.replaced_ids.extend(
+            query_pipeline.remove_live_documents(replaced_documents)
+        )
+        self.replaced_documents -= replaced_documents
+        if texts:
+            if self.document_store is not None:
+                self.document_store.add(records)
+            embedder.add_sections(ids, texts, embeddings)
+            query_pipeline.get_document_sections().update(document_sections)
+            stats["cost"] += cost
+            stats["reused_embeddings"] += embedder.reused_embeddings
+            stats["new_embeddings"] += embedder.new_embeddings
+
+            if directory_path:
+                self.database.append((ids, texts, document_ids, embeddings))
+                if (
+                    sum(len(chunk[0]) for chunk in self.database)
+                    >= self.max_database_sections
+                ):
+                    self.save_database(directory_path)
+        stats["files"] += len(batch)
+        stats["sections"] += len(texts)
+
+    def save_database(self, directory_path):
+        """
+        Writes the sections embedded since the last save as a new database, then
+        deletes the sections they replace from the knowledge base.
+        """
+        if self.database:
+            self.query_pipeline.save_database(
+                directory_path,
+                [id_ for chunk in self.database for id_ in chunk[0]],
+                [text for chunk in self.database for text in chunk[1]],
+                [document_id for chunk in self.database for document_id in chunk[2]],
+                np.vstack([chunk[3] for chunk in self.database]),
+            )
+            self.database = []
+        self.query_pipeline.delete_sections(self.replaced_ids, directory_path)
+        self.replaced_ids = []
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingest a directory of markdown files."
+    )
+    parser.add_argument("path", help="Directory or glob pattern of markdown files")
+    parser.add_argument("--knowledge-base", default="data/processed")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--queue-size", type=int, default=64)
+    args = parser.parse_args()
+
+    credentials = load_credentials("secrets/credentials.yml")
+    models_config = load_models_config("config/models_config.yml")
+    query_pipeline = QueryPipeline(
+        credentials["OPENAI_CREDENTIALS"],
+        models_config,
+        metrics=Metrics.from_config(models_config),
+    )
+    directory_path = get_collection_directory(args.knowledge_base, args.collection)
+    os.makedirs(directory_path, exist_ok=True)
+    ingester = DirectoryIngester(
+        query_pipeline, num_workers=args.workers, queue_size=args.queue_size
+    )
+    stats = ingester.run(args.path, args.embedding_model, directory_path)
+    print(
+        f"Ingested {stats['files']} files ({stats['sections']} sections) in {stats['seconds']:.1f}s: {stats['files_per_second']:.1f} files/s, {stats['sections_per_second']:.1f} sections/s, $ {stats['cost']:.4f}."
+    )
+
+
+if __name__ == "__main__":
+    main()
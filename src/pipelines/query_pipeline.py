@@ -1,20 +1,194 @@
 import numpy as np
 import datetime
+import asyncio
+import time
 import os
 import faiss
 import json
+import uuid
+import re
 
+from ..models.document_store import DocumentStore, make_section_records
+from ..models.embedding_store import EmbeddingStore
+from ..models.index_factory import build_faiss_index, get_precision, read_faiss_index
 from ..models.inference import ModelInferenceManager
+from ..models.lexical_index import fuse_rankings
+from ..models.openai_client import OpenAIClient
+from ..models.text_store import (
+    MappedDocumentIds,
+    MappedTexts,
+    write_document_ids,
+    write_texts,
+)
 from ..models.vectorization import SemanticVectorizer
-from ..utils.utils import split_markdown_by_headers_with_hierarchy
+from ..utils.chunking import chunk_sections
+from ..utils.metrics import Metrics
+from ..utils.utils import split_markdown_with_metadata
+
+# Sub-directory of the knowledge base holding the merged index of all databases
+MERGED_CACHE_DIRECTORY = ".merged"
+# Context given to the LLM when no document of the knowledge base is used
+NO_DOCUMENTS_FOUND = "No documents found related to user query! Use your external knowledge or search the internet if possible"
+# IDs of the sections removed since the last compaction, one per line
+DELETED_IDS_FILENAME = "deleted_ids.txt"
+# Texts and provenance of the sections of the knowledge base (see DocumentStore)
+DOCUMENT_STORE_FILENAME = "documents.sqlite"
+# Collection of the databases kept directly in the knowledge base directory
+DEFAULT_COLLECTION = "default"
+# Names of the other collections, each a sub-directory of the knowledge base directory
+COLLECTION_NAME_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+def generate_database_name():
+    """
+    Builds a unique database file name: microsecond timestamp plus a random suffix.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return f"faiss_db_{timestamp}_{uuid.uuid4().hex[:8]}"
+
+
+def get_collection_directory(root_directory, collection):
+    """
+    Directory of a named collection of the knowledge base, with its own databases and
+    document store. The default collection is `root_directory` itself.
+    """
+    if collection == DEFAULT_COLLECTION:
+        return root_directory
+    if not COLLECTION_NAME_PATTERN.fullmatch(collection):
+        raise ValueError(f"Invalid collection name: {collection!r}")
+    return os.path.join(root_directory, collection)
+
+
+def list_collections(root_directory):
+    """Names of the collections of the knowledge base, the default one first."""
+    collections = []
+    if os.path.isdir(root_directory):
+        collections = sorted(
+            name
+            for name in os.listdir(root_directory)
+            if name != DEFAULT_COLLECTION
+            and COLLECTION_NAME_PATTERN.fullmatch(name)
+            and os.path.isdir(os.path.join(root_directory, name))
+        )
+    return [DEFAULT_COLLECTION] + collections
+
+
+def is_same_embedding(first, second):
+    """
+    Whether vectors embedded with two settings (see get_embedding_settings) belong in
+    the same index: same model and size. Unknown settings (None) match any.
+    """
+    if first is None or second is None:
+        return True
+    return (first["model"], first["dimensions"]) == (
+        second["model"],
+        second["dimensions"],
+    )
+
+
+def generate_section_ids(count):
+    """
+    Random 63-bit section IDs: unique across ingestion runs without a shared counter.
+    """
+    return [uuid.uuid4().int >> 65 for _ in range(count)]
+
+
+def read_database(index_path, texts_path):
+    """
+    Reads a database written by write_database, or a legacy one (bare list of texts).
+
+    Returns the section IDs (None for a legacy database), texts, document IDs, embedding
+    settings (see SemanticVectorizer.get_embedding_settings, None when unknown) and
+    vectors.
+    """
+    faiss_index = faiss.read_index(index_path)
+
+    # Extract all vectors of the database in a single call
+    if isinstance(faiss_index, faiss.IndexIDMap):
+        vectors = faiss_index.index.reconstruct_n(0, faiss_index.ntotal)
+    else:
+        vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+
+    return read_texts(texts_path) + (vectors,)
+
+
+def read_texts(texts_path):
+    """
+    Returns the section IDs (None for a legacy database), texts, document IDs and
+    embedding settings (None when unknown).
+    """
+    with open(texts_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return None, data, [None] * len(data), None
+    return data["ids"], data["texts"], data["document_ids"], data.get("embedding")
+
+
+def write_database(
+    index_path, texts_path, ids, texts, document_ids, faiss_index, embedding=None
+):
+    """
+    Writes an ID-mapped index and its texts, along with the settings its vectors were
+    embedded with, swapping in complete files only.
+    """
+    with open(f"{texts_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "ids": ids,
+                "texts": texts,
+                "document_ids": document_ids,
+                "embedding": embedding,
+            },
+            f,
+        )
+    faiss.write_index(faiss_index, f"{index_path}.tmp")
+    os.replace(f"{texts_path}.tmp", texts_path)
+    os.replace(f"{index_path}.tmp", index_path)
 
 
 class QueryPipeline:
-    def __init__(self, openai_api_key, models_config):
-        self.embedder = SemanticVectorizer(openai_api_key, models_config)
+    def __init__(
+        self,
+        openai_api_key,
+        models_config,
+        query_cache=None,
+        embedding_store_directory=None,
+        metrics=None,
+        answer_cache=None,
+        client=None,
+    ):
+        # Spans of every stage, exported to the sinks of `metrics` (see Metrics)
+        self.metrics = metrics or Metrics()
+        # One connection pool and one set of rate limits for every call of the pipeline,
+        # or of every pipeline given the same `client` (e.g. one per collection)
+        self.client = client or OpenAIClient.from_config(
+            openai_api_key, models_config, metrics=self.metrics
+        )
+        self.embedder = SemanticVectorizer(
+            openai_api_key,
+            models_config,
+            client=self.client,
+            metrics=self.metrics,
+            query_cache=query_cache,
+            embedding_store=(
+                EmbeddingStore(embedding_store_directory)
+                if embedding_store_directory
+                else None
+            ),
+        )
         self.model_inference_manager = ModelInferenceManager(
-            openai_api_key, models_config
+            openai_api_key, models_config, client=self.client, metrics=self.metrics
         )
+        # Answers reused for similar questions (see SemanticAnswerCache)
+        self.answer_cache = answer_cache
+        # Databases the current index was merged from (see get_databases_manifest)
+        self.loaded_manifest = None
+        # Section IDs of every document (see get_document_sections), mapped on first
+        # use from the (section IDs, document IDs) of the loaded sections
+        self.document_sections = {}
+        self.section_documents = None
+        # Number of database files above which the knowledge base is compacted
+        self.max_database_files = 32
 
     def set_model(self, model_name):
         self.embedder.set_model(model_name)
@@ -27,6 +201,7 @@ class QueryPipeline:
         save_index=False,
         directory_path=None,
         markdown_content=None,
+        append_to=None,
     ):
         # Ensure the embedding model is set
         self.embedder.set_model(embedding_model)
@@ -34,49 +209,303 @@ class QueryPipeline:
         # Check if content is directly provided, otherwise read from the path
         if markdown_content:
             # Directly use provided markdown content
-            texts = split_markdown_by_headers_with_hierarchy(markdown_content)
+            texts = self.split_markdown(markdown_content)
         elif markdown_path:
             # Read and process markdown file if path is provided
             texts = self.embedder.read_and_process_markdown(markdown_path)
+        else:
+            texts = []
 
-        total_cost = 0
-        total_documents_processed = 0
+        if not texts:
+            return 0, 0
 
-        # Iterate over each text chunk and process them individually
-        for i, text in enumerate(texts):
-            # Set the current text to the embedder
-            self.embedder.texts = [text]
+        # Embed every section of the run at once and build a single index
+        self.loaded_manifest = None
+        self.embedder.texts = texts
+        total_cost = self.embedder.generate_embeddings()
 
-            # Reset embeddings for each chunk
-            self.embedder.embeddings = []
+        if save_index and directory_path:
+            if append_to:
+                # Grow an existing database instead of creating a new pair of files
+                self.append_to_database(directory_path, append_to)
+            else:
+                self.save_database(
+                    directory_path,
+                    generate_section_ids(len(texts)),
+                    texts,
+                    [markdown_path or None] * len(texts),
+                    self.embedder.embeddings,
+                )
 
-            # Generate embeddings and calculate the cost for each chunk
-            cost = self.embedder.generate_embeddings()
+        return total_cost, len(texts)
 
-            # Update the total cost
-            total_cost += cost
+    def split_markdown(self, markdown_content, with_metadata=False):
+        """
+        Splits markdown into sections, chunked to the configured token bounds (see
+        chunk_sections), or into dicts with the text, headers and byte offsets of the
+        sections `with_metadata`.
+        """
+        with self.metrics.span("parse") as span:
+            sections = chunk_sections(
+                split_markdown_with_metadata(markdown_content),
+                self.embedder.chunking_config,
+            )
+            span.record(items=len(sections), bytes=len(markdown_content))
+        if not with_metadata:
+            return [section["text"] for section in sections]
+        return sections
 
-            if save_index and directory_path:
-                # Generate unique filenames for saving the index and texts
-                timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-                index_filename = f"faiss_db_chunk_{i}_{timestamp}.bin"
-                texts_filename = f"faiss_db_chunk_{i}_{timestamp}.json"
+    def open_document_store(self, directory_path, create=False):
+        """
+        Opens the document store of a knowledge base directory, if it exists or when
+        `create` is set, and attaches it to the embedder.
+        """
+        store_path = os.path.join(directory_path, DOCUMENT_STORE_FILENAME)
+        document_store = self.embedder.document_store
+        if document_store is not None and (
+            document_store.store_path != store_path or not os.path.exists(store_path)
+        ):
+            # Another knowledge base, or the store was deleted with the databases
+            document_store.close()
+            document_store = None
+        if document_store is None and (create or os.path.exists(store_path)):
+            document_store = DocumentStore(store_path)
+        self.embedder.document_store = document_store
+        return document_store
 
-                # Generate full file paths
-                index_path = os.path.join(directory_path, index_filename)
-                texts_path = os.path.join(directory_path, texts_filename)
+    def save_database(
+        self,
+        directory_path,
+        ids,
+        texts,
+        document_ids,
+        embeddings,
+        database_name=None,
+        embedding=None,
+    ):
+        """
+        Writes sections and their embeddings as a new database of the directory, with
+        the `embedding` settings (by default, those of the embedder).
+        """
+        # A flat index, storing the vectors with the configured precision
+        faiss_index = build_faiss_index(
+            embeddings.shape[1],
+            [(ids, embeddings)],
+            {
+                "index_type": "flat",
+                "precision": get_precision(self.embedder.retrieval_config),
+            },
+        )
+        database_name = database_name or generate_database_name()
+        write_database(
+            os.path.join(directory_path, f"{database_name}.bin"),
+            os.path.join(directory_path, f"{database_name}.json"),
+            list(ids),
+            list(texts),
+            list(document_ids),
+            faiss_index,
+            embedding or self.embedder.get_embedding_settings(),
+        )
+
+    def append_to_database(self, directory_path, database_name):
+        """Appends the current embeddings and texts to an existing database."""
+        index_path = os.path.join(directory_path, f"{database_name}.bin")
+        texts_path = os.path.join(directory_path, f"{database_name}.json")
+
+        ids, texts, document_ids, embedding, vectors = read_database(
+            index_path, texts_path
+        )
+        if not is_same_embedding(embedding, self.embedder.get_embedding_settings()):
+            raise ValueError(
+                f"{database_name} was embedded with other settings: {embedding}."
+            )
+        if ids is None:
+            ids = generate_section_ids(len(texts))
+        self.save_database(
+            directory_path,
+            ids + generate_section_ids(len(self.embedder.texts)),
+            texts + self.embedder.texts,
+            document_ids + [None] * len(self.embedder.texts),
+            np.vstack([vectors, self.embedder.embeddings]),
+            database_name=database_name,
+        )
 
-                # Save the index and texts for each chunk
-                self.embedder.save_faiss_index(index_path, texts_path)
+    def add_documents(self, documents, embedding_model, directory_path=None):
+        """
+        Adds documents ({document ID: markdown content}) to the live index.
 
-            total_documents_processed += 1
+        With a `directory_path`, the new sections are persisted as a small database of
+        their own, and the knowledge base is compacted once it has too many files.
+        Returns the embedding cost and the number of sections added.
+        """
+        if directory_path:
+            self.load_and_merge_databases(directory_path)
+        existing_ids = [
+            doc_id for doc_id in documents if doc_id in self.get_document_sections()
+        ]
+        if existing_ids:
+            raise ValueError(
+                f"Documents {existing_ids} already exist. Use update_documents() instead."
+            )
+
+        ids, texts, document_ids, document_sections = [], [], [], {}
+        records = []
+        for document_id, markdown_content in documents.items():
+            sections = self.split_markdown(markdown_content, with_metadata=True)
+            section_ids = generate_section_ids(len(sections))
+            document_sections[document_id] = section_ids
+            ids.extend(section_ids)
+            texts.extend(section["text"] for section in sections)
+            document_ids.extend([document_id] * len(sections))
+            records.extend(
+                make_section_records(
+                    section_ids, sections, document_id, source=document_id
+                )
+            )
+        if not texts:
+            return 0, 0
+
+        self.embedder.set_model(embedding_model)
+        # Raises before anything is added when the embeddings cannot be generated
+        embeddings, total_cost = self.embedder.embed_texts(texts)
+        if directory_path:
+            self.open_document_store(directory_path, create=True).add(records)
+        self.embedder.add_sections(ids, texts, embeddings)
+        self.get_document_sections().update(document_sections)
+
+        if directory_path:
+            self.save_database(directory_path, ids, texts, document_ids, embeddings)
+            self.after_knowledge_base_change(directory_path)
+        return total_cost, len(texts)
+
+    def remove_documents(self, document_ids, directory_path=None):
+        """
+        Removes documents from the live index.
+
+        With a `directory_path`, the removed section IDs are appended to the deleted IDs
+        file of the knowledge base, until the next compaction drops them for good.
+        """
+        if directory_path:
+            self.load_and_merge_databases(directory_path)
+        ids = self.remove_live_documents(document_ids)
+        self.delete_sections(ids, directory_path)
+
+        if directory_path and ids:
+            self.after_knowledge_base_change(directory_path)
+        return len(ids)
+
+    def remove_live_documents(self, document_ids):
+        """
+        Removes documents from the live index only, and returns the IDs of their
+        sections, to be deleted from the knowledge base with delete_sections().
+        """
+        ids = []
+        for document_id in document_ids:
+            ids.extend(self.get_document_sections().pop(document_id, []))
+        self.embedder.remove_sections(ids)
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(ids)
+        return ids
 
-        return total_cost, total_documents_processed
+    def delete_sections(self, ids, directory_path=None):
+        """
+        Drops sections from the document store and, with a `directory_path`, appends
+        their IDs to the deleted IDs file of the knowledge base.
+        """
+        if self.embedder.document_store is not None:
+            self.embedder.document_store.remove(ids)
+        if directory_path and ids:
+            with open(os.path.join(directory_path, DELETED_IDS_FILENAME), "a") as f:
+                f.writelines(f"{id_}\n" for id_ in ids)
 
-    def find_similar_documents(self, query_text, num_results):
-        similar_docs = self.embedder.search_similar_sections(query_text, num_results)
+    def update_documents(self, documents, embedding_model, directory_path=None):
+        """Replaces documents (or adds them if they do not exist yet)."""
+        self.remove_documents(list(documents), directory_path)
+        return self.add_documents(documents, embedding_model, directory_path)
+
+    def after_knowledge_base_change(self, directory_path):
+        """Compacts the knowledge base when needed, and marks the live index as current."""
+        manifest = self.get_databases_manifest(directory_path)
+        num_deleted_ids = len(self.read_deleted_ids(directory_path))
+        if len(
+            manifest["databases"]
+        ) > self.max_database_files or num_deleted_ids > max(
+            len(self.embedder.ids), 1000
+        ):
+            self.compact_databases(directory_path)
+            manifest = self.get_databases_manifest(directory_path)
+        # The live index already includes the change: no need to merge it again
+        self.loaded_manifest = manifest
+
+    def compact_databases(self, directory_path):
+        """Rewrites all databases as a single one and drops the deleted IDs file."""
+        manifest = self.get_databases_manifest(directory_path)
+        ids, texts, document_ids, chunks, embedding = self.read_databases(
+            directory_path, manifest
+        )
+        if ids:
+            self.save_database(
+                directory_path,
+                ids,
+                texts,
+                document_ids,
+                np.vstack([vectors for _, vectors in chunks]),
+                embedding=embedding,
+            )
+        # If this is interrupted, load_and_merge_databases skips duplicate sections
+        for (index_filename, _, _), (texts_filename, _, _) in manifest["databases"]:
+            os.remove(os.path.join(directory_path, index_filename))
+            os.remove(os.path.join(directory_path, texts_filename))
+        deleted_ids_path = os.path.join(directory_path, DELETED_IDS_FILENAME)
+        if os.path.exists(deleted_ids_path):
+            os.remove(deleted_ids_path)
+        self.loaded_manifest = self.get_databases_manifest(directory_path)
+
+    def read_deleted_ids(self, directory_path):
+        deleted_ids_path = os.path.join(directory_path, DELETED_IDS_FILENAME)
+        if not os.path.exists(deleted_ids_path):
+            return set()
+        with open(deleted_ids_path, "r") as f:
+            return {int(line) for line in f if line.strip()}
+
+    def find_similar_documents(self, query_text, num_results, filters=None):
+        """
+        Returns the texts of the sections most similar to the query, among those
+        matching `filters` when given: {"source": ..., "document_id": ...,
+        "header_prefix": [...], "ingested_after": ..., "ingested_before": ...} (see
+        DocumentStore.find_ids). Filters are applied inside the FAISS search.
+        """
+        similar_docs = self.embedder.search_similar_sections(
+            query_text, num_results, filters
+        )
         return similar_docs
 
+    def search_keywords(self, query_text, num_results):
+        """Returns the (text, BM25 score) of the sections best matching the keywords."""
+        return [
+            (self.embedder.texts[p], score)
+            for p, score in self.embedder.search_keywords(query_text, num_results)
+        ]
+
+    def hybrid_search(self, query_text, num_results, num_candidates=50):
+        """
+        Returns the (text, fused score) of the best sections, fusing the keyword and the
+        similarity rankings of their top `num_candidates` with reciprocal rank fusion.
+        """
+        num_candidates = max(num_results, num_candidates)
+        keyword_positions = [
+            p for p, _ in self.embedder.search_keywords(query_text, num_candidates)
+        ]
+        similar_positions = self.embedder.search_positions(
+            self.embedder.embed_query(query_text), num_candidates
+        )
+        return [
+            (self.embedder.texts[p], score)
+            for p, score in fuse_rankings(
+                [keyword_positions, similar_positions], num_results
+            )
+        ]
+
     def determine_expertise_and_prepare_prompt(
         self,
         user_query,
@@ -98,7 +527,7 @@ class QueryPipeline:
                 expertise_area_usage
             )
         context_enhanced_prompt = self.model_inference_manager.prepare_prompt_for_llm(
-            identified_expertise_area, user_query, similar_docs
+            identified_expertise_area, user_query, similar_docs, max_completion_tokens
         )
         return context_enhanced_prompt, expertise_area_cost, identified_expertise_area
 
@@ -115,6 +544,260 @@ class QueryPipeline:
 
         return contextual_response, response_cost
 
+    def answer(
+        self,
+        user_query,
+        num_results,
+        inference_model,
+        max_completion_tokens,
+        temperature,
+        filters=None,
+    ):
+        """
+        Answers a question with the full RAG chain, see aanswer().
+        """
+        return asyncio.run(
+            self.aanswer(
+                user_query,
+                num_results,
+                inference_model,
+                max_completion_tokens,
+                temperature,
+                filters,
+            )
+        )
+
+    async def aanswer(
+        self,
+        user_query,
+        num_results,
+        inference_model,
+        max_completion_tokens,
+        temperature,
+        filters=None,
+    ):
+        """
+        Answers a question with the full RAG chain.
+
+        The expertise area does not depend on the retrieved documents, so it is
+        determined while the query is embedded and searched (among the sections
+        matching `filters`, see find_similar_documents), unless the answer cache is
+        looked up first (see aprepare_answer). Returns a dict with the
+        response, the documents, the expertise area, the prompt and its packed context
+        (see pack_context), the cost of every stage and the total cost, and the
+        duration of every stage in seconds.
+        """
+        start_time = time.perf_counter()
+        result = await self.aprepare_answer(
+            user_query,
+            num_results,
+            inference_model,
+            max_completion_tokens,
+            temperature,
+            filters,
+        )
+        if result["cached"]:
+            result["timings"]["total"] = time.perf_counter() - start_time
+            return result
+
+        stage_start_time = time.perf_counter()
+        response, usage = await self.model_inference_manager.aquery(
+            result["prompt"], max_completion_tokens, temperature
+        )
+        result["response"] = response
+        result["timings"]["completion"] = time.perf_counter() - stage_start_time
+        result["costs"]["completion"] = self.get_inference_cost(usage)
+        result["cost"] = sum(result["costs"].values())
+        result["timings"]["total"] = time.perf_counter() - start_time
+        self.cache_answer(result, inference_model, temperature)
+        return result
+
+    def stream_answer(
+        self,
+        user_query,
+        num_results,
+        inference_model,
+        max_completion_tokens,
+        temperature,
+        filters=None,
+    ):
+        """
+        Like answer(), but with the completion streamed.
+
+        The returned dict has no response yet: iterating over its "stream" yields the
+        tokens of the response as they arrive, then fills in the response, its cost
+        and the timings ("first_token" is the time to the first token). The completion
+        request is sent before returning, so that its errors are raised here.
+        """
+        start_time = time.perf_counter()
+        result = asyncio.run(
+            self.aprepare_answer(
+                user_query,
+                num_results,
+                inference_model,
+                max_completion_tokens,
+                temperature,
+                filters,
+            )
+        )
+
+        if result["cached"]:
+            chat_stream = None
+        else:
+            stage_start_time = time.perf_counter()
+            chat_stream = self.model_inference_manager.stream_openai(
+                result["prompt"], max_completion_tokens, temperature
+            )
+
+        def stream_tokens():
+            if chat_stream is None:
+                result["timings"]["first_token"] = time.perf_counter() - start_time
+                yield result["response"]
+                result["timings"]["total"] = time.perf_counter() - start_time
+                return
+            for token in chat_stream:
+                if "first_token" not in result["timings"]:
+                    result["timings"]["first_token"] = time.perf_counter() - start_time
+                yield token
+            result["response"] = chat_stream.content
+            result["timings"]["completion"] = time.perf_counter() - stage_start_time
+            result["costs"]["completion"] = self.get_inference_cost(chat_stream.usage)
+            result["cost"] = sum(result["costs"].values())
+            result["timings"]["total"] = time.perf_counter() - start_time
+            self.cache_answer(result, inference_model, temperature)
+
+        result["stream"] = stream_tokens()
+        return result
+
+    async def aprepare_answer(
+        self,
+        user_query,
+        num_results,
+        inference_model,
+        max_completion_tokens,
+        temperature,
+        filters=None,
+    ):
+        """
+        Runs the stages of aanswer() that come before the completion.
+
+        With an answer cache, the documents are retrieved before the expertise area is
+        determined, so that a cached answer (marked "cached") skips both LLM calls.
+        """
+        self.model_inference_manager.set_model(inference_model)
+        timings, costs = {}, {}
+        retrieval = {"query_embedding": None, "section_ids": [], "sources": []}
+
+        async def retrieve():
+            stage_start_time = time.perf_counter()
+            similar_docs, usage = [], None
+            if num_results:
+                query_embedding, usage = await self.embedder.aembed_query(user_query)
+                timings["embedding"] = time.perf_counter() - stage_start_time
+                search_start_time = time.perf_counter()
+                positions = self.embedder.search_positions(
+                    query_embedding, num_results, filters
+                )
+                timings["search"] = time.perf_counter() - search_start_time
+                records = self.embedder.get_records(positions)
+                similar_docs = [record["text"] for record in records]
+                retrieval["query_embedding"] = query_embedding
+                retrieval["section_ids"] = [record["id"] for record in records]
+                # Provenance of the documents, for display
+                retrieval["sources"] = [
+                    {key: value for key, value in record.items() if key != "text"}
+                    for record in records
+                ]
+            costs["embedding"] = self.embedder.calculate_cost(usage or {})
+            return similar_docs
+
+        async def determine_expertise():
+            stage_start_time = time.perf_counter()
+            expertise_area, usage = (
+                await self.model_inference_manager.adetermine_expertise_area(
+                    user_query, max_completion_tokens, temperature
+                )
+            )
+            timings["expertise"] = time.perf_counter() - stage_start_time
+            costs["expertise"] = self.get_inference_cost(usage)
+            return expertise_area
+
+        if self.answer_cache is not None and num_results:
+            similar_docs = await retrieve()
+            cached_answer = None
+            if retrieval["query_embedding"] is not None:
+                cached_answer = self.answer_cache.get(
+                    inference_model,
+                    temperature,
+                    retrieval["query_embedding"],
+                    retrieval["section_ids"],
+                )
+            if cached_answer is not None:
+                costs.update(expertise=0, completion=0)
+                return {
+                    "similar_docs": similar_docs,
+                    **retrieval,
+                    **cached_answer,
+                    "cached": True,
+                    "cached_cost": cached_answer["cost"],
+                    "costs": costs,
+                    "cost": sum(costs.values()),
+                    "timings": timings,
+                }
+            expertise_area = await determine_expertise()
+        else:
+            similar_docs, expertise_area = await asyncio.gather(
+                retrieve(), determine_expertise()
+            )
+
+        stage_start_time = time.perf_counter()
+        prompt, context = self.model_inference_manager.pack_prompt(
+            expertise_area,
+            user_query,
+            similar_docs or [NO_DOCUMENTS_FOUND],
+            max_completion_tokens,
+        )
+        timings["prompt"] = time.perf_counter() - stage_start_time
+        return {
+            "similar_docs": similar_docs,
+            **retrieval,
+            "expertise_area": expertise_area,
+            "prompt": prompt,
+            "context": context,
+            "cached": False,
+            "costs": costs,
+            "cost": sum(costs.values()),
+            "timings": timings,
+        }
+
+    def cache_answer(self, result, inference_model, temperature):
+        """Stores the answer of `result` for the next similar questions."""
+        if self.answer_cache is None or result["query_embedding"] is None:
+            return
+        self.answer_cache.set(
+            inference_model,
+            temperature,
+            result["query_embedding"],
+            result["section_ids"],
+            {
+                "response": result["response"],
+                "expertise_area": result["expertise_area"],
+                "prompt": result["prompt"],
+                "context": {
+                    key: value
+                    for key, value in result["context"].items()
+                    if key != "documents"
+                },
+                "cost": result["cost"],
+            },
+        )
+
+    def get_inference_cost(self, usage):
+        # On errors the usage is missing (or an error message)
+        if not isinstance(usage, dict):
+            return 0
+        return self.model_inference_manager.calculate_cost(usage)
+
     def load_faiss_index(self, index_path):
         """Loads the FAISS index from a specified path."""
         try:
@@ -122,50 +805,234 @@ class QueryPipeline:
         except Exception as e:
             print(f"Error loading FAISS index: {e}")
 
-    def load_and_merge_databases(self, directory_path):
-        all_texts = []
-        all_embeddings = []
-
-        # Iterate over the files in the given directory
-        for filename in os.listdir(directory_path):
+    def get_databases_manifest(self, directory_path):
+        """
+        Lists the databases of a directory with the name, size and mtime of their files,
+        along with the size and mtime of the deleted IDs file and the index settings.
+        """
+        databases = []
+        for filename in sorted(os.listdir(directory_path)):
             if filename.endswith(".bin"):
-                # Construct the full paths for the index and texts files
-                index_path = os.path.join(directory_path, filename)
                 texts_filename = filename.replace(".bin", ".json")
+                index_path = os.path.join(directory_path, filename)
                 texts_path = os.path.join(directory_path, texts_filename)
-
-                # Load FAISS index if both the index and texts files exist
                 if os.path.exists(index_path) and os.path.exists(texts_path):
-                    faiss_index = faiss.read_index(index_path)
-
-                    with open(texts_path, "r", encoding="utf-8") as f:
-                        texts = json.load(f)
-
-                    embeddings = np.zeros(
-                        (faiss_index.ntotal, faiss_index.d), dtype="float32"
+                    databases.append(
+                        [
+                            [name, os.stat(path).st_size, os.stat(path).st_mtime_ns]
+                            for name, path in (
+                                (filename, index_path),
+                                (texts_filename, texts_path),
+                            )
+                        ]
                     )
-                    for i in range(faiss_index.ntotal):
-                        embeddings[i, :] = faiss_index.reconstruct(i)
-
-                    all_texts.extend(texts)
-                    all_embeddings.append(embeddings)
                 else:
                     print(
                         f"Warning: Required files for {filename} are missing. Skipping."
                     )
+        deleted_ids_path = os.path.join(directory_path, DELETED_IDS_FILENAME)
+        deleted_ids = None
+        if os.path.exists(deleted_ids_path):
+            stat = os.stat(deleted_ids_path)
+            deleted_ids = [stat.st_size, stat.st_mtime_ns]
+        return {
+            "databases": databases,
+            "deleted_ids": deleted_ids,
+            # A merged index built with other index settings must be rebuilt
+            "retrieval": self.embedder.retrieval_config,
+        }
+
+    def load_and_merge_databases(self, directory_path, use_cache=True):
+        self.open_document_store(directory_path)
+        manifest = self.get_databases_manifest(directory_path)
 
-        # Handle the case with zero or one database file
-        if len(all_embeddings) == 0:
+        # Nothing changed since the last load of this pipeline
+        if manifest == self.loaded_manifest:
+            return
+
+        if len(manifest["databases"]) == 0:
             print("No databases were loaded. Please check the directory.")
-        elif len(all_embeddings) == 1:
-            # When there's only one database, directly use it
-            self.embedder.faiss_index = faiss.IndexFlatL2(all_embeddings[0].shape[1])
-            self.embedder.faiss_index.add(all_embeddings[0])
-            self.embedder.texts = all_texts
-        else:
-            # Combine and rebuild the index for multiple databases
-            combined_embeddings = np.vstack(all_embeddings)
-            combined_index = faiss.IndexFlatL2(combined_embeddings.shape[1])
-            combined_index.add(combined_embeddings)
-            self.embedder.faiss_index = combined_index
-            self.embedder.texts = all_texts
+            self.set_sections([], [], [], None, None)
+            self.loaded_manifest = manifest
+            return
+
+        cache_directory = os.path.join(directory_path, MERGED_CACHE_DIRECTORY)
+        if use_cache and self.load_merged_cache(cache_directory, manifest):
+            self.loaded_manifest = manifest
+            return
+
+        ids, texts, document_ids, chunks, embedding = self.read_databases(
+            directory_path, manifest
+        )
+        with self.metrics.span("index_add") as span:
+            combined_index = build_faiss_index(
+                chunks[0][1].shape[1], chunks, self.embedder.retrieval_config
+            )
+            span.record(items=len(ids))
+        if embedding is not None:
+            # The merged index stores the vectors with the configured precision
+            embedding = dict(
+                embedding, precision=get_precision(self.embedder.retrieval_config)
+            )
+        self.set_sections(ids, texts, document_ids, combined_index, embedding)
+        self.loaded_manifest = manifest
+
+        if use_cache:
+            self.save_merged_cache(cache_directory, manifest, document_ids)
+
+    def close(self):
+        """
+        Closes the document store and drops the loaded index and texts. Their memory
+        maps are released with the last view of the pipeline still using them.
+        """
+        if self.embedder.document_store is not None:
+            self.embedder.document_store.close()
+            self.embedder.document_store = None
+        self.set_sections([], [], [], None)
+        self.loaded_manifest = None
+
+    def load_collection(self, root_directory, collection=DEFAULT_COLLECTION):
+        """
+        Loads a single collection of the knowledge base (see get_collection_directory),
+        and returns its directory.
+        """
+        directory_path = get_collection_directory(root_directory, collection)
+        if not os.path.isdir(directory_path):
+            raise ValueError(f"Unknown collection: {collection!r}")
+        self.load_and_merge_databases(directory_path)
+        return directory_path
+
+    def read_databases(self, directory_path, manifest):
+        """
+        Reads the databases of `manifest`, leaving out deleted and duplicate sections.
+
+        Returns the section IDs, texts and document IDs, the (IDs, vectors) chunks of
+        every database, and the settings they were embedded with (None when unknown).
+        """
+        deleted_ids = self.read_deleted_ids(directory_path)
+        all_ids, all_texts, all_document_ids, chunks = [], [], [], []
+        seen_ids = set()
+        legacy_sections = 0
+        merged_embedding = None
+        for (index_filename, _, _), (texts_filename, _, _) in manifest["databases"]:
+            ids, texts, document_ids, embedding, vectors = read_database(
+                os.path.join(directory_path, index_filename),
+                os.path.join(directory_path, texts_filename),
+            )
+            if ids is None:
+                # Legacy databases have no IDs: number their sections in load order
+                ids = list(range(legacy_sections, legacy_sections + len(texts)))
+                legacy_sections += len(texts)
+
+            if chunks and vectors.shape[1] != chunks[0][1].shape[1]:
+                print(
+                    f"Warning: {index_filename} has dimension {vectors.shape[1]} instead of {chunks[0][1].shape[1]}. Skipping."
+                )
+                continue
+            if not is_same_embedding(embedding, merged_embedding):
+                print(
+                    f"Warning: {index_filename} was embedded with {embedding['model']} ({embedding['dimensions'] or 'full'} dimensions) instead of {merged_embedding['model']} ({merged_embedding['dimensions'] or 'full'} dimensions). Skipping."
+                )
+                continue
+            merged_embedding = merged_embedding or embedding
+
+            kept_positions = [
+                p
+                for p, id_ in enumerate(ids)
+                if id_ not in deleted_ids and id_ not in seen_ids
+            ]
+            if len(kept_positions) < len(ids):
+                ids = [ids[p] for p in kept_positions]
+                texts = [texts[p] for p in kept_positions]
+                document_ids = [document_ids[p] for p in kept_positions]
+                vectors = vectors[kept_positions]
+            seen_ids.update(ids)
+
+            chunks.append((ids, vectors))
+            all_ids.extend(ids)
+            all_texts.extend(texts)
+            all_document_ids.extend(document_ids)
+        return all_ids, all_texts, all_document_ids, chunks, merged_embedding
+
+    def set_sections(self, ids, texts, document_ids, faiss_index, embedding=None):
+        self.embedder.set_sections(ids, texts, faiss_index, embedding)
+        self.document_sections = None
+        self.section_documents = (ids, document_ids)
+
+    def get_document_sections(self):
+        """Section IDs of every document, mapped when first needed."""
+        if self.document_sections is None:
+            ids, document_ids = self.section_documents
+            if isinstance(ids, np.ndarray):
+                ids = ids.tolist()
+            self.document_sections = {}
+            for id_, document_id in zip(ids, document_ids):
+                if document_id is not None:
+                    self.document_sections.setdefault(document_id, []).append(id_)
+            self.section_documents = None
+        return self.document_sections
+
+    def load_merged_cache(self, cache_directory, manifest):
+        """
+        Loads the merged index if it was built from the databases of `manifest`.
+
+        The vectors, section IDs, texts and document IDs are memory-mapped (see
+        read_faiss_index, MappedTexts and MappedDocumentIds): only the sections
+        returned by a search are read from disk.
+        """
+        try:
+            with open(os.path.join(cache_directory, "manifest.json"), "r") as f:
+                if json.load(f) != manifest:
+                    return False
+            ids = np.load(os.path.join(cache_directory, "ids.npy"), mmap_mode="r")
+            texts = MappedTexts(
+                os.path.join(cache_directory, "texts.bin"),
+                os.path.join(cache_directory, "offsets.npy"),
+            )
+            document_ids = MappedDocumentIds(
+                os.path.join(cache_directory, "documents.json"),
+                os.path.join(cache_directory, "document_numbers.npy"),
+            )
+            with open(os.path.join(cache_directory, "embedding.json"), "r") as f:
+                embedding = json.load(f)
+            faiss_index = read_faiss_index(
+                os.path.join(cache_directory, "index.bin"),
+                self.embedder.retrieval_config,
+            )
+        except (OSError, RuntimeError, ValueError, KeyError):
+            return False
+
+        self.set_sections(ids, texts, document_ids, faiss_index, embedding)
+        return True
+
+    def save_merged_cache(self, cache_directory, manifest, document_ids):
+        """Persists the merged index so the next start only has to read one file."""
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            # The manifest is written last: a partial cache never matches
+            manifest_path = os.path.join(cache_directory, "manifest.json")
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            index_path = os.path.join(cache_directory, "index.bin")
+            faiss.write_index(self.embedder.faiss_index, f"{index_path}.tmp")
+            os.replace(f"{index_path}.tmp", index_path)
+            np.save(
+                os.path.join(cache_directory, "ids.npy"),
+                np.array(self.embedder.ids, dtype="int64"),
+            )
+            write_texts(
+                os.path.join(cache_directory, "texts.bin"),
+                os.path.join(cache_directory, "offsets.npy"),
+                self.embedder.texts,
+            )
+            write_document_ids(
+                os.path.join(cache_directory, "documents.json"),
+                os.path.join(cache_directory, "document_numbers.npy"),
+                document_ids,
+            )
+            with open(os.path.join(cache_directory, "embedding.json"), "w") as f:
+                json.dump(self.embedder.index_embedding, f)
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f)
+        except OSError as e:
+            print(f"Warning: Could not save the merged databases cache: {e}")
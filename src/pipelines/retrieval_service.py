@@ -0,0 +1,257 @@
+import collections
+import threading
+import time
+import copy
+import os
+
+from contextlib import contextmanager
+
+from .query_pipeline import get_collection_directory, list_collections
+
+
+class ReadWriteLock:
+    """Lock shared by any number of readers, or held by a single writer."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            # Waiting writers go first, so that a stream of readers cannot starve them
+            while self.writing or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+class RetrievalService:
+    """
+    Process-wide owner of the loaded knowledge base, shared by every session.
+
+    The index of `knowledge_base_dir` is loaded once, and reloaded by refresh() only
+    when its files change (checked at most every `check_interval` seconds). Searches
+    and answers run concurrently through reader(), which hands out a view of the
+    pipeline with its own model settings; changes to the knowledge base wait for the
+    running readers and hold the others back.
+    """
+
+    def __init__(self, query_pipeline, knowledge_base_dir, check_interval=1.0):
+        self.query_pipeline = query_pipeline
+        self.knowledge_base_dir = knowledge_base_dir
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.lock = ReadWriteLock()
+        # Set once unloaded by close(), until the knowledge base is loaded again
+        self.closed = False
+
+    def refresh(self, force=False):
+        """Reloads the knowledge base if its files changed since the last load."""
+        now = time.monotonic()
+        if (
+            not force
+            and self.checked_at is not None
+            and now - self.checked_at < self.check_interval
+        ):
+            return
+        self.checked_at = now
+        manifest = self.query_pipeline.get_databases_manifest(self.knowledge_base_dir)
+        if manifest == self.query_pipeline.loaded_manifest:
+            return
+        with self.lock.write():
+            self.query_pipeline.load_and_merge_databases(self.knowledge_base_dir)
+            self.closed = False
+
+    def close(self):
+        """
+        Unloads the knowledge base once the running readers are done (see
+        QueryPipeline.close). It is loaded again if the service is used afterwards.
+        """
+        with self.lock.write():
+            self.query_pipeline.close()
+            self.closed = True
+
+    @contextmanager
+    def reader(self, embedding_model=None):
+        """
+        Yields a view of the pipeline for one request, sharing its index, documents,
+        client and caches, but not the models selected with set_model().
+        """
+        if self.closed:
+            # Unloaded by the CollectionManager while this request held the service
+            self.refresh(force=True)
+        with self.lock.read():
+            query_pipeline = copy.copy(self.query_pipeline)
+            query_pipeline.embedder = copy.copy(self.query_pipeline.embedder)
+            query_pipeline.model_inference_manager = copy.copy(
+                self.query_pipeline.model_inference_manager
+            )
+            if embedding_model:
+                query_pipeline.set_model(embedding_model)
+            yield query_pipeline
+            # Keep the keyword index and the ID positions built by the view for the
+            # next ones
+            embedder = self.query_pipeline.embedder
+            if query_pipeline.embedder.texts is embedder.texts:
+                if embedder.lexical_index is None:
+                    embedder.lexical_index = query_pipeline.embedder.lexical_index
+                if embedder.id_positions is None:
+                    embedder.id_positions = query_pipeline.embedder.id_positions
+
+    def get_texts(self):
+        """Sections of the knowledge base, decoded on access when memory-mapped."""
+        with self.lock.read():
+            return self.query_pipeline.embedder.texts
+
+    def get_sources(self):
+        """Source files of the sections in the document store, to filter searches."""
+        with self.lock.read():
+            document_store = self.query_pipeline.embedder.document_store
+            return document_store.get_sources() if document_store is not None else []
+
+    def get_memory_usage(self):
+        """Estimated memory of the loaded knowledge base: the size of its databases."""
+        manifest = self.query_pipeline.loaded_manifest or {"databases": []}
+        return sum(
+            size for database in manifest["databases"] for _, size, _ in database
+        )
+
+    def update_documents(self, documents, embedding_model):
+        """
+        Adds or replaces documents in the knowledge base, see
+        QueryPipeline.update_documents(). Returns the cost, the number of sections,
+        and the number of reused and new embeddings.
+        """
+        with self.lock.write():
+            total_cost, total_sections = self.query_pipeline.update_documents(
+                documents,
+                embedding_model=embedding_model,
+                directory_path=self.knowledge_base_dir,
+            )
+            embedder = self.query_pipeline.embedder
+            return (
+                total_cost,
+                total_sections,
+                embedder.reused_embeddings,
+                embedder.new_embeddings,
+            )
+
+
+class CollectionManager:
+    """
+    Process-wide owner of the named collections of the knowledge base (see
+    get_collection_directory), each with its own index, document store and
+    RetrievalService.
+
+    A collection is loaded by the first request that targets it. When the loaded
+    collections exceed `memory_budget` bytes (estimated from the size of their
+    databases), the least recently used ones are unloaded, once the requests still
+    running on them are done. Every collection has its own locks, so that loading or
+    updating one never holds back the queries of another.
+    """
+
+    def __init__(
+        self, create_pipeline, root_directory, memory_budget=None, check_interval=1.0
+    ):
+        # Returns a new QueryPipeline, called once per loaded collection
+        self.create_pipeline = create_pipeline
+        self.root_directory = root_directory
+        self.memory_budget = memory_budget
+        self.check_interval = check_interval
+        # Loaded collections, least recently used first
+        self.services = collections.OrderedDict()
+        # Guards the collections and their load locks, only held for bookkeeping
+        self.lock = threading.Lock()
+        # Serializes the loads and reloads of each collection
+        self.load_locks = {}
+
+    @classmethod
+    def from_config(cls, create_pipeline, models_config):
+        """Creates the manager from the `collections` section of the models config."""
+        config = dict((models_config or {}).get("collections") or {})
+        memory_budget_mb = config.pop("memory_budget_mb", None)
+        return cls(
+            create_pipeline,
+            memory_budget=memory_budget_mb and memory_budget_mb * 1024 * 1024,
+            **config,
+        )
+
+    def names(self):
+        return list_collections(self.root_directory)
+
+    def create(self, collection):
+        """Creates an empty collection, if it does not exist yet."""
+        os.makedirs(
+            get_collection_directory(self.root_directory, collection), exist_ok=True
+        )
+
+    def get(self, collection):
+        """
+        Returns the RetrievalService of a collection, loading it on first use and
+        reloading it if its files changed (see RetrievalService.refresh).
+        """
+        directory_path = get_collection_directory(self.root_directory, collection)
+        if not os.path.isdir(directory_path):
+            raise ValueError(f"Unknown collection: {collection!r}")
+        with self.lock:
+            load_lock = self.load_locks.setdefault(collection, threading.Lock())
+        with load_lock:
+            with self.lock:
+                service = self.services.get(collection)
+            if service is None:
+                service = RetrievalService(
+                    self.create_pipeline(), directory_path, self.check_interval
+                )
+            service.refresh()
+        with self.lock:
+            self.services[collection] = service
+            self.services.move_to_end(collection)
+            evicted_services = self.evict()
+        for evicted_service in evicted_services:
+            # Closed in the background, so as not to wait for its running requests
+            threading.Thread(target=evicted_service.close, daemon=True).start()
+        return service
+
+    def evict(self):
+        """
+        Drops the least recently used collections while over the memory budget, and
+        returns their services, to be closed.
+        """
+        evicted_services = []
+        if self.memory_budget is None:
+            return evicted_services
+        # Collections grow with their updates: their usage is estimated on every call
+        memory_usage = {
+            collection: service.get_memory_usage()
+            for collection, service in self.services.items()
+        }
+        while (
+            len(self.services) > 1 and sum(memory_usage.values()) > self.memory_budget
+        ):
+            collection, service = self.services.popitem(last=False)
+            del memory_usage[collection]
+            evicted_services.append(service)
+        return evicted_services
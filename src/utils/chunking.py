@@ -0,0 +1,157 @@
+import re
+
+from .utils import estimate_token_count
+
+# Boundaries a long section is split at, tried in order: paragraphs, sentences, words
+SEPARATORS = (
+    re.compile(r"\n\s*\n"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+)
+
+
+def chunk_sections(sections, chunking_config=None):
+    """
+    Turns the sections returned by split_markdown_with_metadata() into chunks of
+    `min_tokens` to `max_tokens` estimated tokens (see the `chunking` section of the
+    models config), keeping the header hierarchy at the start of every chunk.
+
+    Consecutive sections below `min_tokens` under the same parent header are merged,
+    and sections above `max_tokens` are split at paragraph, then sentence, then word
+    boundaries, repeating up to `overlap_tokens` of a chunk at the start of the next.
+    Sections are returned as they are without a config.
+    """
+    if not chunking_config:
+        return sections
+    max_tokens = chunking_config.get("max_tokens", 512)
+    min_tokens = chunking_config.get("min_tokens", 0)
+    overlap_tokens = chunking_config.get("overlap_tokens", 0)
+
+    chunks = []
+    for section in merge_small_sections(sections, min_tokens, max_tokens):
+        chunks.extend(split_large_section(section, max_tokens, overlap_tokens))
+    return chunks
+
+
+def get_prefix(headers):
+    return "".join(f"{header}\n" for header in headers)
+
+
+def merge_small_sections(sections, min_tokens, max_tokens):
+    """
+    Merges runs of sibling sections (same parent headers) while one of them is below
+    `min_tokens`, as long as the merged section fits in `max_tokens`. A merged section
+    is headed by the parent headers, followed by the header and content of every
+    sibling.
+    """
+    merged_sections = []
+    for section in sections:
+        previous = merged_sections[-1] if merged_sections else None
+        if (
+            previous is not None
+            and previous["parent"] == section["headers"][:-1]
+            and (
+                estimate_token_count(previous["text"]) < min_tokens
+                or estimate_token_count(section["text"]) < min_tokens
+            )
+        ):
+            # The headers of the siblings move from the prefix into the content
+            parent_prefix = get_prefix(previous["parent"])
+            text = f"{previous['text']}\n{section['text'][len(parent_prefix):]}"
+            if estimate_token_count(text) <= max_tokens:
+                previous.update(
+                    text=text,
+                    headers=list(previous["parent"]),
+                    end_byte=section.get("end_byte"),
+                )
+                continue
+        merged_sections.append(dict(section, parent=section["headers"][:-1]))
+    for section in merged_sections:
+        del section["parent"]
+    return merged_sections
+
+
+def split_span(content, start, end, max_tokens, level=0):
+    """
+    Splits content[start:end] into spans of at most `max_tokens`, at the boundaries of
+    SEPARATORS[level] first. Spans of a single word that is still too long are cut.
+    """
+    if estimate_token_count(content[start:end]) <= max_tokens:
+        return [(start, end)]
+    if level == len(SEPARATORS):
+        size = max(4 * (max_tokens - 1), 1)
+        return [(s, min(s + size, end)) for s in range(start, end, size)]
+    spans = []
+    piece_start = start
+    for match in SEPARATORS[level].finditer(content, start, end):
+        spans.extend(
+            split_span(content, piece_start, match.start(), max_tokens, level + 1)
+        )
+        piece_start = match.end()
+    spans.extend(split_span(content, piece_start, end, max_tokens, level + 1))
+    return [(s, e) for s, e in spans if e > s]
+
+
+def split_large_section(section, max_tokens, overlap_tokens=0):
+    """
+    Splits a section above `max_tokens` into chunks of consecutive spans of its content
+    (see split_span), each prefixed with the headers of the section.
+    """
+    if estimate_token_count(section["text"]) <= max_tokens:
+        return [section]
+    prefix = get_prefix(section["headers"])
+    content = section["text"][len(prefix) :]
+    # Very long header hierarchies still leave room for the content
+    budget = max(max_tokens - estimate_token_count(prefix), max_tokens // 2)
+    spans = split_span(content, 0, len(content), budget)
+
+    chunks = []
+    first, overlap_start = 0, None
+    while first < len(spans):
+        start = spans[first][0]
+        # Starts with the end of the previous chunk, when it leaves room for a span
+        if (
+            overlap_start is not None
+            and estimate_token_count(content[overlap_start : spans[first][1]]) <= budget
+        ):
+            start = overlap_start
+        last = first
+        while (
+            last + 1 < len(spans)
+            and estimate_token_count(content[start : spans[last + 1][1]]) <= budget
+        ):
+            last += 1
+        end = spans[last][1]
+        chunk = dict(section, text=f"{prefix}{content[start:end]}")
+        if section.get("start_byte") is not None:
+            chunk["start_byte"] = section["start_byte"] + len(
+                content[:start].encode("utf-8")
+            )
+            chunk["end_byte"] = chunk["start_byte"] + len(
+                content[start:end].encode("utf-8")
+            )
+        chunks.append(chunk)
+        first = last + 1
+        overlap_start = get_overlap_start(content, start, end, overlap_tokens)
+    return chunks
+
+
+def get_overlap_start(content, start, end, overlap_tokens):
+    """
+    Start of the last sentences (or paragraphs) of content[start:end] that fit in
+    `overlap_tokens`, or None.
+    """
+    if not overlap_tokens:
+        return None
+    boundaries = sorted(
+        match.end()
+        for separator in SEPARATORS[:2]
+        for match in separator.finditer(content, start, end)
+    )
+    for boundary in boundaries:
+        if (
+            boundary < end
+            and estimate_token_count(content[boundary:end]) <= overlap_tokens
+        ):
+            return boundary
+    return None
@@ -0,0 +1,210 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+import threading
+import bisect
+import json
+import time
+import sys
+
+# Upper bounds (seconds) of the buckets of the Prometheus duration histograms
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Span:
+    """
+    Duration and counters (tokens, bytes, cost, ...) of one run of a pipeline stage.
+
+    Sent to the sinks of its Metrics when finished.
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.values = {}
+        self.start_time = time.perf_counter()
+        self.duration = None
+
+    def record(self, **values):
+        """Adds numeric values (None values are ignored) to the counters of the span."""
+        for key, value in values.items():
+            if value is not None:
+                self.values[key] = self.values.get(key, 0) + value
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start_time
+            self.metrics.emit(self)
+
+
+class Metrics:
+    """
+    Creates spans around the stages of the pipeline and exports them to pluggable sinks
+    (InMemorySink, JSONLogSink, PrometheusSink).
+
+    Without sinks, spans are only timed and then dropped.
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    @classmethod
+    def from_config(cls, models_config):
+        """
+        Creates the sinks of the optional `metrics` section of the models config, and
+        starts the Prometheus endpoint when a port is given.
+        """
+        metrics_config = (models_config or {}).get("metrics") or {}
+        sinks = []
+        if metrics_config.get("json_log_path"):
+            sinks.append(JSONLogSink(metrics_config["json_log_path"]))
+        if metrics_config.get("prometheus_port"):
+            prometheus_sink = PrometheusSink()
+            prometheus_sink.serve(
+                metrics_config["prometheus_port"],
+                metrics_config.get("prometheus_host") or "127.0.0.1",
+            )
+            sinks.append(prometheus_sink)
+        return cls(sinks)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def start_span(self, name, **labels):
+        return Span(self, name, labels)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Times the body of the `with` block, counting an error if it raises."""
+        span = self.start_span(name, **labels)
+        try:
+            yield span
+        except BaseException:
+            span.record(errors=1)
+            raise
+        finally:
+            span.finish()
+
+    def emit(self, span):
+        for sink in self.sinks:
+            sink.emit(span)
+
+
+class InMemorySink:
+    """Keeps every finished span, e.g. for tests."""
+
+    def __init__(self):
+        self.spans = []
+
+    def emit(self, span):
+        self.spans.append(span)
+
+    def get_spans(self, name):
+        return [span for span in self.spans if span.name == name]
+
+
+class JSONLogSink:
+    """Writes one JSON line per finished span to a file path or a stream."""
+
+    def __init__(self, output=None):
+        self.lock = threading.Lock()
+        if isinstance(output, str):
+            self.stream = open(output, "a", encoding="utf-8")
+        else:
+            self.stream = output or sys.stderr
+
+    def emit(self, span):
+        line = json.dumps(
+            {
+                "timestamp": time.time(),
+                "span": span.name,
+                "duration": span.duration,
+                **span.labels,
+                **span.values,
+            }
+        )
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+class PrometheusSink:
+    """
+    Aggregates spans into a duration histogram and counters per stage, rendered in the
+    Prometheus text format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="llm_rag"):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}  # label set -> [bucket counts, sum, count]
+        self.counters = {}  # (value name, label set) -> total
+
+    def emit(self, span):
+        labels = tuple(sorted({"stage": span.name, **span.labels}.items()))
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                labels, [[0] * len(self.buckets), 0.0, 0]
+            )
+            bucket = bisect.bisect_left(self.buckets, span.duration)
+            if bucket < len(self.buckets):
+                histogram[0][bucket] += 1
+            histogram[1] += span.duration
+            histogram[2] += 1
+            for key, value in span.values.items():
+                self.counters[(key, labels)] = (
+                    self.counters.get((key, labels), 0) + value
+                )
+
+    @staticmethod
+    def format_labels(labels, **extra_labels):
+        pairs = list(labels) + list(extra_labels.items())
+        return ",".join(f'{key}="{value}"' for key, value in pairs if value is not None)
+
+    def render(self):
+        name = f"{self.prefix}_stage_duration_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        with self.lock:
+            for labels, (bucket_counts, total, count) in sorted(
+                self.histograms.items()
+            ):
+                cumulative_count = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(
+                        f"{name}_bucket{{{self.format_labels(labels, le=bound)}}} {cumulative_count}"
+                    )
+                lines.append(
+                    f"{name}_bucket{{{self.format_labels(labels, le='+Inf')}}} {count}"
+                )
+                lines.append(f"{name}_sum{{{self.format_labels(labels)}}} {total}")
+                lines.append(f"{name}_count{{{self.format_labels(labels)}}} {count}")
+            for key in sorted({key for key, _ in self.counters}):
+                name = f"{self.prefix}_stage_{key}_total"
+                lines.append(f"# TYPE {name} counter")
+                for (counter_key, labels), total in sorted(self.counters.items()):
+                    if counter_key == key:
+                        lines.append(f"{name}{{{self.format_labels(labels)}}} {total}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves render() on http://<host>:<port>/metrics from a background thread."""
+        sink = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.render().encode()
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
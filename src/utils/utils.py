@@ -34,13 +34,32 @@ def load_models_config(config_file_path):
             return None
 
 
+def estimate_token_count(text):
+    """
+    Estimates the number of tokens of a text (roughly 4 characters per token in English).
+    """
+    return len(text) // 4 + 1
+
+
 def split_markdown_by_headers_with_hierarchy(markdown_content):
+    return [
+        section["text"] for section in split_markdown_with_metadata(markdown_content)
+    ]
+
+
+def split_markdown_with_metadata(markdown_content):
+    """
+    Splits markdown like split_markdown_by_headers_with_hierarchy(), also returning the
+    headers of every section and the byte offsets of its content in the markdown.
+    """
     pattern = re.compile(r"(?m)(^#{1,6}\s.*$)")
     parts = pattern.split(markdown_content)
     sections = []
     header_stack = []
+    byte_offset = 0
 
     for part in parts:
+        part_start, byte_offset = byte_offset, byte_offset + len(part.encode("utf-8"))
         if pattern.match(part):
             # Extract header level and text
             header_level = part.count("#")
@@ -54,7 +73,18 @@ def split_markdown_by_headers_with_hierarchy(markdown_content):
         elif part.strip():
             # Ensure there is content and at least one header in the stack
             if header_stack:
+                content = part.strip()
+                start = part_start + len(
+                    part[: len(part) - len(part.lstrip())].encode("utf-8")
+                )
                 combined_header = "\n".join(header_stack)
-                sections.append(f"{combined_header}\n{part.strip()}")
+                sections.append(
+                    {
+                        "text": f"{combined_header}\n{content}",
+                        "headers": list(header_stack),
+                        "start_byte": start,
+                        "end_byte": start + len(content.encode("utf-8")),
+                    }
+                )
 
     return sections
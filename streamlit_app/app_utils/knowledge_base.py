@@ -3,12 +3,12 @@ import time
 import string
 
 from .others import read_file_content, search_documents
+from src.models.openai_client import OpenAIError
 
 
 def setup_knowledge_base_tab(
-    query_pipeline,
+    retrieval_service,
     selected_embedding_model,
-    output_directory,
     selected_embedding_model_cost,
 ):
     st.header("📁 Setup :green[Knowledge Base]")
@@ -23,28 +23,34 @@ def setup_knowledge_base_tab(
         uploaded_file_names = ", ".join(["'" + f.name + "'" for f in uploaded_files])
         st.info(f"**Uploaded Files:** **`{uploaded_file_names}`**", icon="🤖")
 
-        markdown_content = ""
+        documents = {}
         for uploaded_file in uploaded_files:
             with st.expander(f":red[View Content of **`{uploaded_file.name}`**]"):
                 file_content = read_file_content(uploaded_file)
-                markdown_content += file_content + "\n"
+                documents[uploaded_file.name] = file_content
                 st.text(file_content)
 
         if st.button("Add documents to **:green[Knowledge Base]**", key="create_db"):
             with st.spinner("Creating database from files..."):
 
-                print(markdown_content)
-
                 start_time = time.time()
-                total_cost, total_documents_processed = (
-                    query_pipeline.setup_semantic_database(
-                        markdown_path="",
-                        embedding_model=selected_embedding_model,
-                        save_index=True,
-                        directory_path=output_directory,
-                        markdown_content=markdown_content,
+                try:
+                    # Files uploaded again replace their previous version
+                    (
+                        total_cost,
+                        total_documents_processed,
+                        reused_embeddings,
+                        new_embeddings,
+                    ) = retrieval_service.update_documents(
+                        documents, embedding_model=selected_embedding_model
                     )
-                )
+                except (OpenAIError, RuntimeError) as e:
+                    st.error(f"❌ The documents could not be embedded: {e}")
+                    return
+                except ValueError as e:
+                    # The knowledge base was embedded with another model
+                    st.error(f"❌ {e} Select this embedding model in the sidebar.")
+                    return
 
                 end_time = time.time()
                 elapsed_time = end_time - start_time
@@ -66,6 +72,8 @@ def setup_knowledge_base_tab(
                 | 💰 **Total Estimated Cost** | Cost estimated based on the processing required for the uploaded documents. | **:green[{formatted_cost}]** |
                 | 🤖 **Embedding Model Used** | AI model used to create embeddings for the knowledge base. | **:green[{selected_embedding_model}]** |
                 | 📄 **Total Documents Processed** | Number of documents added to the knowledge base. | **:red[{total_documents_processed}]** |
+                | ♻️ **Reused Embeddings** | Documents already embedded before, taken from the embedding store. | **:green[{reused_embeddings}]** |
+                | 🆕 **New Embeddings** | Documents sent to the embedding model. | **:red[{new_embeddings}]** |
                 | 💵 **Model Cost Per Token** | The cost per Token of processing with the selected model. | $ {selected_embedding_model_cost:.8f} |
                 """
 
@@ -78,9 +86,7 @@ def setup_knowledge_base_tab(
         )
 
 
-def display_knowledge_base_tab(
-    all_texts, query_pipeline, selected_embedding_model, knowledge_base_dir
-):
+def display_knowledge_base_tab(all_texts, retrieval_service, selected_embedding_model):
 
     st.header("🔍Explore the :green[Knowledge Base] Content")
     if len(all_texts) == 0:
@@ -104,7 +110,24 @@ def display_knowledge_base_tab(
                 ":red[Maximum Documents to Display]", 1, len(all_texts), 2
             )
         with col2:
-            use_semantic_search = st.checkbox(":red[Activate Similarity Search]")
+            search_mode = st.radio(
+                ":red[Search Mode]",
+                ["keyword", "semantic", "hybrid"],
+                format_func=lambda mode: {
+                    "keyword": "Keyword",
+                    "semantic": "Similarity",
+                    "hybrid": "Hybrid",
+                }[mode],
+                help="**Keyword** ranks the documents with BM25, **Similarity** with their embeddings, and **Hybrid** fuses both rankings.",
+            )
+
+        # Similarity searches can be restricted to some of the uploaded files
+        selected_sources = st.multiselect(
+            ":red[Restrict to Files]",
+            retrieval_service.get_sources(),
+            disabled=search_mode != "semantic",
+            help="Only search the documents of these files (**Similarity** search only). Leave empty to search the whole knowledge base.",
+        )
 
         search = st.button("**:red[Search]**")
 
@@ -117,33 +140,44 @@ def display_knowledge_base_tab(
                 )
 
             else:
-                if use_semantic_search:
+                if search_mode != "keyword":
                     st.info(
                         "📌 The :red[Similarity Search] feature may sometimes return **less relevant documents**, depending on the **Content** and the **Size** of the :green[knowledge base]."
                     )
-                # Filter texts and sort by the number of occurrences of the search query
+                # Rank the documents against the search query
                 with st.spinner("Searching Relevant Documents... 🤔"):
-                    filtered_texts = search_documents(
-                        max_documents,
-                        search_query,
-                        all_texts,
-                        use_semantic_search,
-                        query_pipeline,
-                        selected_embedding_model,
-                    )
+                    try:
+                        filtered_texts = search_documents(
+                            max_documents,
+                            search_query,
+                            search_mode,
+                            retrieval_service,
+                            selected_embedding_model,
+                            filters=(
+                                {"source": selected_sources}
+                                if selected_sources
+                                else None
+                            ),
+                        )
+                    except OpenAIError as e:
+                        st.error(f"❌ The search query could not be embedded: {e}")
+                        return
+                    except ValueError as e:
+                        st.error(f"❌ {e} Select this embedding model in the sidebar.")
+                        return
                 # Check if any texts match the query
                 if not filtered_texts:
                     st.warning(
-                        "☹️ No matches found. Please try a different keyword. Or Activate the :red[Similarity Search]"
+                        "☹️ No matches found. Please try a different keyword. Or switch to the :red[Similarity Search]"
                     )
                     st.info(
                         "❓ The :red[Similarity Search] feature allows you to **locate** the documents most closely related to your query within the :green[knowledge base]"
                     )
                 else:
-                    for index, (text, count) in enumerate(filtered_texts, start=1):
+                    for index, (text, score) in enumerate(filtered_texts, start=1):
                         col1, col2 = st.columns([1, 4])
                         with col1:
-                            st.metric(label="Occurrences", value=count)
+                            st.metric(label="Score", value=score)
                         with col2:
                             with st.expander(
                                 f":green[Document **{index}**]", expanded=False
@@ -2,14 +2,7 @@ import base64
 from io import BytesIO
 import os
 import glob
-import time
-
-
-def stream_response(response):
-    """Stream the response word by word to simulate typing."""
-    for word in response.split():
-        yield word + " "
-        time.sleep(0.02)
+import shutil
 
 
 def image_to_base64(image):
@@ -60,44 +53,58 @@ def get_llm_models(models_config):
 
 
 def delete_files(directory):
-    # Gather all .json and .bin files
-    files_to_delete = glob.glob(os.path.join(directory, "*.json")) + glob.glob(
-        os.path.join(directory, "*.bin")
+    # Gather all .json and .bin files, the IDs of removed documents and the document store
+    files_to_delete = (
+        glob.glob(os.path.join(directory, "*.json"))
+        + glob.glob(os.path.join(directory, "*.bin"))
+        + glob.glob(os.path.join(directory, "deleted_ids.txt"))
+        + glob.glob(os.path.join(directory, "documents.sqlite"))
     )
 
     # Delete the files
     for file_path in files_to_delete:
         os.remove(file_path)
 
+    # Drop the merged index built from these files as well
+    shutil.rmtree(os.path.join(directory, ".merged"), ignore_errors=True)
+
 
 def search_documents(
     num_results,
     search_query,
-    all_texts,
-    is_semantic,
-    query_pipeline,
+    search_mode,
+    retrieval_service,
     selected_embedding_model,
+    filters=None,
 ):
-    if search_query:
-        if not is_semantic:
-            # Filter texts and sort by the number of occurrences of the search query
-            similar_docs = sorted(
-                [
-                    (text, text.lower().count(search_query.lower()))
-                    for text in all_texts
-                    if search_query.lower() in text.lower()
-                ],
-                key=lambda x: x[1],
-                reverse=True,
-            )[:num_results]
+    """
+    Searches the knowledge base, with `search_mode` one of "keyword" (BM25 over the
+    inverted index), "semantic" (FAISS, restricted to the sections matching `filters`)
+    or "hybrid" (both rankings fused).
+    Returns (text, score) pairs, with no score for the semantic search.
+    """
+    if not search_query:
+        return []
+    # Use the specified embedding model for the semantic and hybrid searches
+    with retrieval_service.reader(selected_embedding_model) as query_pipeline:
+        if search_mode == "keyword":
+            similar_docs = [
+                (text, round(score, 2))
+                for text, score in query_pipeline.search_keywords(
+                    search_query, num_results
+                )
+            ]
+        elif search_mode == "hybrid":
+            similar_docs = [
+                (text, round(score, 4))
+                for text, score in query_pipeline.hybrid_search(
+                    search_query, num_results
+                )
+            ]
         else:
-            # Use semantic search with the specified embedding model
-            query_pipeline.set_model(selected_embedding_model)
             docs = query_pipeline.find_similar_documents(
-                query_text=search_query, num_results=num_results
+                query_text=search_query, num_results=num_results, filters=filters
             )
-            # None here, because we don't have occurrence count in similarity search
+            # None here, because we don't have a score in similarity search
             similar_docs = [(doc, None) for doc in docs]
-        return similar_docs
-    else:
-        return []
+    return similar_docs
@@ -1,12 +1,12 @@
 import streamlit as st
-from .others import stream_response
-import time
 import string
 
+from src.models.openai_client import OpenAIError
+
 
 def initialize_rag_query_tab(
     selected_embedding_model_name,
-    query_pipeline,
+    retrieval_service,
     selected_llm_name,
     selected_llm_temp,
     selected_llm_tokens_limit,
@@ -44,87 +44,15 @@ def initialize_rag_query_tab(
                     "❌ Please enter a valid word. The input should not be only **spaces**, **punctuation**, or **empty**."
                 )
             else:
-                start_time = time.time()
-                with st.spinner("Finding similar documents..."):
-                    query_pipeline.set_model(selected_embedding_model_name)
-                    similar_docs = []
-
-                    if not similar_docs:
-                        st.error(
-                            "❌ User has chosen not to provide documents from the knowledge base!"
-                        )
-                    else:
-                        with st.expander(
-                            "Used **:green[Relevent Documents]** in Context",
-                            expanded=False,
-                        ):
-                            for doc in similar_docs:
-                                st.info(doc)
-
-                # Prepare context-enhanced prompt
-                with st.spinner("Preparing context-enhanced prompt..."):
-                    if len(similar_docs) == 0:
-                        similar_docs = [
-                            "No documents found related to user query! Use your external knowledge or search the internet if possible"
-                        ]
-                    (
-                        context_enhanced_prompt,
-                        expertise_area_cost,
-                        identified_expertise_area,
-                    ) = query_pipeline.determine_expertise_and_prepare_prompt(
-                        user_query=user_query,
-                        similar_docs=similar_docs,
-                        inference_model=selected_llm_name,
-                        max_completion_tokens=selected_llm_tokens_limit,
-                        temperature=selected_llm_temp,
-                    )
-                    with st.expander("Expertise Area Identification", expanded=False):
-                        st.info(
-                            f"Identified Expertise Area: **:red[{identified_expertise_area}]**"
-                        )
-                        st.success(
-                            f"Cost for expertise area determination: **:red[$ {expertise_area_cost:.6f}]**"
-                        )
-
-                with st.expander("Final **:green[RAG] Prompt**", expanded=False):
-                    st.text(context_enhanced_prompt)
-
-                # Generate response
-                with st.spinner("Generating the response... 🤔"):
-                    contextual_response, response_cost = (
-                        query_pipeline.query_model_for_response(
-                            context_enhanced_prompt=context_enhanced_prompt,
-                            max_completion_tokens=selected_llm_tokens_limit,
-                            temperature=selected_llm_temp,
-                        )
-                    )
-
-                # Display message
-                st.chat_message("assistant").write_stream(
-                    stream_response(contextual_response)
+                run_rag_query(
+                    retrieval_service,
+                    user_query,
+                    0,
+                    selected_embedding_model_name,
+                    selected_llm_name,
+                    selected_llm_temp,
+                    selected_llm_tokens_limit,
                 )
-
-                # Display summary of costs and steps with enhanced visual and detailed tooltips
-                with st.expander("📊 Detailed Summary of Inference", expanded=True):
-                    # Metrics for display
-                    end_time = time.time()
-                    elapsed_time = end_time - start_time
-
-                    # Formatting Cost and Price
-                    elapsed_time_formatted = f"{elapsed_time:.2f} seconds"
-                    formatted_cost = f"$ {(response_cost + expertise_area_cost):.4f}"
-
-                    # Display detailed summary of inference
-                    detailed_summary_table = f"""
-                        | Metric | Details | Value |
-                        | :--- | :--- | :---: |
-                        | ⏱ **Time Taken** | Total time taken to process the query and generate the response. | **:red[{elapsed_time_formatted}]** |
-                        | 💵 **Cost for Determining Expertise Area** | Cost from the initial prompt to determine the expertise area. | **:red[$ {expertise_area_cost:.6f}]** |
-                        | 🤑 **Cost to Query the LLM** | Cost estimated based on the processing and querying with the RAG model. | **:red[{formatted_cost}]** |
-                        | 🤖 **LLM Model Used** | AI model used for generating the response. | **:green[{selected_llm_name}]** | 
-                        """
-
-                    st.markdown(detailed_summary_table, unsafe_allow_html=True)
     else:
         # Display basic info about the Knowledge Base
         st.markdown(
@@ -148,6 +76,13 @@ def initialize_rag_query_tab(
             help="Specify how many of the most relevant documents you want to include for generating the response. This helps in refining the context for more accurate answers.",
         )
 
+        # Restrict the context to the documents of some files
+        selected_sources = st.multiselect(
+            "Restrict the context to the documents of these :green[files]",
+            retrieval_service.get_sources(),
+            help="Only the documents of the selected files are searched for the context. Leave empty to search the whole knowledge base.",
+        )
+
         # User input for query
         user_query = st.text_input(
             "Type the Question to ask the :green[RAG LLM]",
@@ -166,89 +101,106 @@ def initialize_rag_query_tab(
                     "❌ Please enter a valid word. The input should not be only **spaces**, **punctuation**, or **empty**."
                 )
             else:
-                start_time = time.time()
-                with st.spinner("Finding similar documents..."):
-                    query_pipeline.set_model(selected_embedding_model_name)
-                    if num_results != 0:
-                        similar_docs = query_pipeline.find_similar_documents(
-                            query_text=user_query, num_results=num_results
-                        )
-                    else:
-                        similar_docs = []
-
-                    if not similar_docs:
-                        st.error(
-                            "❌ User has chosen not to provide documents from the knowledge base!"
-                        )
-                    else:
-                        with st.expander(
-                            "Used **:green[Relevent Documents]** in Context",
-                            expanded=False,
-                        ):
-                            for doc in similar_docs:
-                                st.info(doc)
-
-                # Prepare context-enhanced prompt
-                with st.spinner("Preparing context-enhanced prompt..."):
-                    if len(similar_docs) == 0:
-                        similar_docs = [
-                            "No documents found related to user query! Use your external knowledge or search the internet if possible"
-                        ]
-                    (
-                        context_enhanced_prompt,
-                        expertise_area_cost,
-                        identified_expertise_area,
-                    ) = query_pipeline.determine_expertise_and_prepare_prompt(
-                        user_query=user_query,
-                        similar_docs=similar_docs,
-                        inference_model=selected_llm_name,
-                        max_completion_tokens=selected_llm_tokens_limit,
-                        temperature=selected_llm_temp,
-                    )
-                    with st.expander("Expertise Area Identification", expanded=False):
-                        st.info(
-                            f"Identified Expertise Area: **:red[{identified_expertise_area}]**"
-                        )
-                        st.success(
-                            f"Cost for expertise area determination: **:red[$ {expertise_area_cost:.6f}]**"
-                        )
-
-                with st.expander("Final **:green[RAG] Prompt**", expanded=False):
-                    st.text(context_enhanced_prompt)
-
-                # Generate response
-                with st.spinner("Generating the response... 🤔"):
-                    contextual_response, response_cost = (
-                        query_pipeline.query_model_for_response(
-                            context_enhanced_prompt=context_enhanced_prompt,
-                            max_completion_tokens=selected_llm_tokens_limit,
-                            temperature=selected_llm_temp,
-                        )
-                    )
+                run_rag_query(
+                    retrieval_service,
+                    user_query,
+                    num_results,
+                    selected_embedding_model_name,
+                    selected_llm_name,
+                    selected_llm_temp,
+                    selected_llm_tokens_limit,
+                    filters={"source": selected_sources} if selected_sources else None,
+                )
 
-                # Display message
-                st.chat_message("assistant").write_stream(
-                    stream_response(contextual_response)
+
+def run_rag_query(
+    retrieval_service,
+    user_query,
+    num_results,
+    selected_embedding_model_name,
+    selected_llm_name,
+    selected_llm_temp,
+    selected_llm_tokens_limit,
+    filters=None,
+):
+    with st.spinner(
+        "Finding similar documents and identifying the expertise area... 🤔"
+    ):
+        try:
+            with retrieval_service.reader(
+                selected_embedding_model_name
+            ) as query_pipeline:
+                # Retrieval and expertise identification run concurrently
+                result = query_pipeline.stream_answer(
+                    user_query=user_query,
+                    num_results=num_results,
+                    inference_model=selected_llm_name,
+                    max_completion_tokens=selected_llm_tokens_limit,
+                    temperature=selected_llm_temp,
+                    filters=filters,
                 )
+        except OpenAIError as e:
+            st.error(f"❌ The OpenAI API could not answer: {e}")
+            return
+        except ValueError as e:
+            # The knowledge base was embedded with another model than the selected one
+            st.error(f"❌ {e} Select this embedding model in the sidebar.")
+            return
+
+    if not result["similar_docs"]:
+        st.error("❌ User has chosen not to provide documents from the knowledge base!")
+    else:
+        with st.expander(
+            "Used **:green[Relevent Documents]** in Context",
+            expanded=False,
+        ):
+            for doc, source in zip(result["similar_docs"], result["sources"]):
+                # Provenance of the document, when it is in the document store
+                if source.get("source"):
+                    st.caption(
+                        f"📄 `{source['source']}` › {' › '.join(source['headers'] or [])}"
+                    )
+                st.info(doc)
+
+    with st.expander("Expertise Area Identification", expanded=False):
+        st.info(f"Identified Expertise Area: **:red[{result['expertise_area']}]**")
+        st.success(
+            f"Cost for expertise area determination: **:red[$ {result['costs']['expertise']:.6f}]**"
+        )
+
+    with st.expander("Final **:green[RAG] Prompt**", expanded=False):
+        st.text(result["prompt"])
+
+    # Display the response as its tokens arrive
+    st.chat_message("assistant").write_stream(result["stream"])
+
+    # Display summary of costs and steps with enhanced visual and detailed tooltips
+    with st.expander("📊 Detailed Summary of Inference", expanded=True):
+        timings = result["timings"]
+        stage_timings = " / ".join(
+            f"{stage} {timings[stage]:.2f}s"
+            for stage in (
+                "embedding",
+                "search",
+                "expertise",
+                "prompt",
+                "first_token",
+                "completion",
+            )
+            if stage in timings
+        )
 
-                # Display summary of costs and steps with enhanced visual and detailed tooltips
-                with st.expander("📊 Detailed Summary of Inference", expanded=True):
-                    # Metrics for display
-                    end_time = time.time()
-                    elapsed_time = end_time - start_time
-
-                    # Formatting Cost and Price
-                    elapsed_time_formatted = f"{elapsed_time:.2f} seconds"
-                    formatted_cost = f"$ {(response_cost + expertise_area_cost):.4f}"
-
-                    # Display detailed summary of inference
-                    detailed_summary_table = f"""
-                        | Metric | Details | Value |
-                        | :--- | :--- | :---: |
-                        | ⏱ **Time Taken** | Total time taken to process the query and generate the response. | **:red[{elapsed_time_formatted}]** |
-                        | 💵 **Cost for Determining Expertise Area** | Cost from the initial prompt to determine the expertise area. | **:red[$ {expertise_area_cost:.6f}]** |
-                        | 🤑 **Cost to Query the LLM** | Cost estimated based on the processing and querying with the RAG model. | **:red[{formatted_cost}]** |
-                        | 🤖 **LLM Model Used** | AI model used for generating the response. | **:green[{selected_llm_name}]** | 
-                        """
-
-                    st.markdown(detailed_summary_table, unsafe_allow_html=True)
+        # Display detailed summary of inference
+        detailed_summary_table = f"""
+            | Metric | Details | Value |
+            | :--- | :--- | :---: |
+            | ⏱ **Time Taken** | Total time taken to process the query and generate the response. | **:red[{timings['total']:.2f} seconds]** |
+            | 🧩 **Time per Stage** | Embedding and search run concurrently with the expertise area determination. | {stage_timings} |
+            | 📚 **Context Tokens** | Tokens of the documents given to the LLM, and of the duplicates or overflow left out of the budget. | {result['context']['included_tokens']} included / {result['context']['dropped_tokens']} dropped |
+            | ♻️ **Cached Answer** | Whether the answer was reused from a similar question over the same documents. | {'yes' if result['cached'] else 'no'} |
+            | 💵 **Cost for Determining Expertise Area** | Cost from the initial prompt to determine the expertise area. | **:red[$ {result['costs']['expertise']:.6f}]** |
+            | 🤑 **Cost to Query the LLM** | Cost estimated based on the processing and querying with the RAG model. | **:red[$ {result['cost']:.4f}]** |
+            | 🤖 **LLM Model Used** | AI model used for generating the response. | **:green[{selected_llm_name}]** | 
+            """
+
+        st.markdown(detailed_summary_table, unsafe_allow_html=True)
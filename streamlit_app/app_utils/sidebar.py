@@ -4,13 +4,35 @@ from PIL import Image
 from app_utils.others import get_embedding_models, get_llm_models, image_to_base64
 from .others import delete_files
 
+from src.pipelines.query_pipeline import get_collection_directory
 
-def configure_sidebar(models_config, output_directory):
+
+def configure_sidebar(models_config, collection_manager):
     logo = Image.open("./streamlit_app/app_utils/app_logo.png")
     st.sidebar.markdown(
         f'<div style="text-align: center;"><a href="https://github.com/labrijisaad"><img src="data:image/png;base64,{image_to_base64(logo)}" alt="Direct Assurance Logo" width="100"></a></div>',
         unsafe_allow_html=True,
     )
+    # Sidebar configuration - Knowledge Base Collection
+    st.sidebar.title("📚 Knowledge Base *Collection*")
+    new_collection = st.sidebar.text_input(
+        "Create a collection",
+        help="Each collection has its own documents and index, e.g. one per team. Names may contain letters, digits, - and _.",
+    )
+    if new_collection:
+        try:
+            collection_manager.create(new_collection)
+        except ValueError as e:
+            st.sidebar.error(str(e))
+    selected_collection = st.sidebar.selectbox(
+        "Choose the collection",
+        collection_manager.names(),
+        help="Documents are added to, and questions answered from, the selected collection only.",
+    )
+    output_directory = get_collection_directory(
+        collection_manager.root_directory, selected_collection
+    )
+
     # Sidebar configuration - Embedding Models Settings
     st.sidebar.title("🔢 OpenAI *Embedding Model* Settings")
     embedding_model_info = get_embedding_models(models_config)
@@ -71,10 +93,10 @@ def configure_sidebar(models_config, output_directory):
         f"Selected Max Completion Tokens: **`{selected_llm_max_tokens_completion}`**"
     )
     # Sidebar configuration - Knowledge base Documents
-    st.sidebar.title("❌ Drop **:red[All Documents]** in Knowledge Base")
+    st.sidebar.title("❌ Drop **:red[All Documents]** in Collection")
     delete_confirmation = st.sidebar.text_input(
         "Type **:red[DELETE]** to confirm",
-        help="Enter **:red[DELETE]** to confirm the **:red[removal of all documents]** in the Knowledge Base.",
+        help="Enter **:red[DELETE]** to confirm the **:red[removal of all documents]** in the selected collection.",
     )
 
     if delete_confirmation == "DELETE":
@@ -103,4 +125,5 @@ def configure_sidebar(models_config, output_directory):
         selected_llm_model,
         selected_llm_temperature,
         selected_llm_max_tokens_completion,
+        selected_collection,
     )
@@ -12,10 +12,53 @@ from streamlit_app.app_utils.sidebar import configure_sidebar
 from streamlit_app.app_utils.rag import initialize_rag_query_tab
 from streamlit_app.app_utils.about import about_tab
 
+from src.models.embedding_cache import QueryEmbeddingCache
+from src.models.answer_cache import SemanticAnswerCache
+from src.models.openai_client import OpenAIClient
 from src.pipelines.query_pipeline import QueryPipeline
+from src.pipelines.retrieval_service import CollectionManager
+from src.utils.metrics import Metrics
 from src.utils.utils import load_models_config, load_credentials
 
 
+@st.cache_resource
+def get_query_embedding_cache():
+    # Shared by all reruns and sessions, so repeated questions skip the embeddings API
+    return QueryEmbeddingCache(max_size=4096)
+
+
+@st.cache_resource
+def get_metrics(models_config):
+    # Created once, so that the Prometheus endpoint is only started once
+    return Metrics.from_config(models_config)
+
+
+@st.cache_resource
+def get_answer_cache(models_config):
+    # Shared by all sessions, so similar questions reuse the same answer
+    return SemanticAnswerCache.from_config(models_config)
+
+
+@st.cache_resource
+def get_collection_manager(openai_api_key, models_config):
+    # Collections loaded on first use and shared by all sessions, with one client and
+    # one set of rate limits for all of them
+    metrics = get_metrics(models_config)
+    client = OpenAIClient.from_config(openai_api_key, models_config, metrics=metrics)
+    return CollectionManager.from_config(
+        lambda: QueryPipeline(
+            openai_api_key,
+            models_config,
+            query_cache=get_query_embedding_cache(),
+            embedding_store_directory="data/embeddings",
+            metrics=metrics,
+            answer_cache=get_answer_cache(models_config),
+            client=client,
+        ),
+        models_config,
+    )
+
+
 def main():
     # Set up the main configuration for the Streamlit page
     st.set_page_config(page_title="LLM RAG Application", page_icon="🪄")
@@ -25,7 +68,7 @@ def main():
     credentials = load_credentials("secrets/credentials.yml")
     openai_api_key = credentials["OPENAI_CREDENTIALS"]
     models_config = load_models_config("config/models_config.yml")
-    knowledge_base_dir = "data/processed"
+    collection_manager = get_collection_manager(openai_api_key, models_config)
 
     # Initialize sidebar elements and retrieve selected settings
     (
@@ -34,16 +77,11 @@ def main():
         selected_llm_name,
         selected_llm_temp,
         selected_llm_tokens_limit,
-    ) = configure_sidebar(models_config, knowledge_base_dir)
+        selected_collection,
+    ) = configure_sidebar(models_config, collection_manager)
 
-    # Create a QueryPipeline instance to interact with the Knowledge Base
-    query_pipeline = QueryPipeline(openai_api_key, models_config)
-
-    # Load and process the Knowledge Base documents
-    query_pipeline.load_and_merge_databases(knowledge_base_dir)
-
-    # Set the model
-    query_pipeline.set_model(selected_llm_name)
+    # Shared service holding the selected collection, reloaded if its files changed
+    retrieval_service = collection_manager.get(selected_collection)
 
     # Create tabs for the application interface
     setup_kb_tab, view_kb_tab, rag_query_tab, setup_about_tab = st.tabs(
@@ -53,37 +91,30 @@ def main():
     # Tab for setting up the Knowledge Base
     with setup_kb_tab:
         setup_knowledge_base_tab(
-            query_pipeline,
+            retrieval_service,
             selected_embedding_model_name,
-            knowledge_base_dir,
             selected_embedding_model_cost,
         )
 
     # Tab for displaying and exploring the Knowledge Base
     with view_kb_tab:
-        # Load and process the Knowledge Base documents
-        query_pipeline.load_and_merge_databases(knowledge_base_dir)
+        # Pick up the documents added from the setup tab
+        retrieval_service.refresh(force=True)
 
-        # Filter out empty documents
-        processed_documents = [
-            doc for doc in query_pipeline.embedder.texts if doc.strip()
-        ]
+        # Sections of the knowledge base, not decoded until displayed
+        processed_documents = retrieval_service.get_texts()
         # Display the documents in the Knowledge Base tab
         display_knowledge_base_tab(
             processed_documents,
-            query_pipeline,
+            retrieval_service,
             selected_embedding_model_name,
-            knowledge_base_dir,
         )
 
     # Tab for performing queries using the RAG model
     with rag_query_tab:
-        # Load and process the Knowledge Base documents
-        query_pipeline.load_and_merge_databases(knowledge_base_dir)
-
         initialize_rag_query_tab(
             selected_embedding_model_name,
-            query_pipeline,
+            retrieval_service,
             selected_llm_name,
             selected_llm_temp,
             selected_llm_tokens_limit,
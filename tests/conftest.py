@@ -0,0 +1,132 @@
+from src.models import openai_client
+from src.models.vectorization import SemanticVectorizer
+from src.pipelines.query_pipeline import QueryPipeline
+from src.utils.utils import load_models_config
+import numpy as np
+import asyncio
+import pytest
+import json
+
+
+class MockResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.text = "mock error"
+
+    @property
+    def content(self):
+        return json.dumps(self.data).encode()
+
+    def json(self):
+        return self.data
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def mock_response():
+    """Stand-in for a `requests.Response`: mock_response(status_code, data, headers)."""
+    return MockResponse
+
+
+@pytest.fixture
+def mock_embeddings_api():
+    """
+    Returns a factory of `requests.Session.post` stand-ins that embed each text as
+    [len(text), 1.0], reject the batches containing one of `failing_texts`, and
+    append the inputs of every request to `calls` when given.
+    """
+
+    def make(failing_texts=(), calls=None):
+        def post(self, url, json=None, timeout=None):
+            inputs = json["input"]
+            if calls is not None:
+                calls.append(list(inputs))
+            if any(text in failing_texts for text in inputs):
+                return MockResponse(400)
+            # Answer in reverse order to make sure results are mapped back by index
+            data = [
+                {"index": i, "embedding": [float(len(text)), 1.0]}
+                for i, text in reversed(list(enumerate(inputs)))
+            ]
+            return MockResponse(200, {"data": data, "usage": {"total_tokens": 10}})
+
+        return post
+
+    return make
+
+
+@pytest.fixture
+def make_vectorizer():
+    """Returns a factory of vectorizers set to text-embedding-3-small."""
+
+    def make(**kwargs):
+        models_config = load_models_config("config/models_config.yml")
+        vectorizer = SemanticVectorizer("sk-test", models_config, **kwargs)
+        vectorizer.set_model("text-embedding-3-small")
+        return vectorizer
+
+    return make
+
+
+@pytest.fixture
+def make_pipeline(monkeypatch, mock_embeddings_api):
+    """Returns a factory of pipelines embedding through mock_embeddings_api."""
+
+    def make():
+        monkeypatch.setattr(
+            openai_client.requests.Session, "post", mock_embeddings_api()
+        )
+        models_config = load_models_config("config/models_config.yml")
+        # One section per header, so that the sections can be counted
+        models_config.pop("chunking")
+        return QueryPipeline("sk-test", models_config)
+
+    return make
+
+
+@pytest.fixture
+def make_answering_pipeline(monkeypatch):
+    """
+    Returns a factory of pipelines over two sections, whose query embedding and LLM
+    calls are mocked. Every call appends ("start" or "end", "embedding", "expertise"
+    or "completion") to `events` when given, and lets the other tasks run between.
+    """
+
+    def make(events=None):
+        models_config = load_models_config("config/models_config.yml")
+        query_pipeline = QueryPipeline("sk-test", models_config)
+        query_pipeline.set_model("text-embedding-3-small")
+        embedder = query_pipeline.embedder
+        embedder.texts = ["first section", "second section"]
+        embedder.embeddings = np.array([[0.0, 1.0], [1.0, 0.0]], "float32")
+        embedder.create_faiss_index()
+
+        async def call(stage):
+            if events is not None:
+                events.append(("start", stage))
+            await asyncio.sleep(0)
+            if events is not None:
+                events.append(("end", stage))
+
+        async def aembed(texts):
+            await call("embedding")
+            return np.array([[1.0, 0.0]], "float32"), {"total_tokens": 5}
+
+        async def aquery(
+            prompt_text, max_completion_tokens=100, temperature=0.7, **kwargs
+        ):
+            if "identify the relevant expertise" in prompt_text:
+                await call("expertise")
+                return "expertise", {"prompt_tokens": 10, "completion_tokens": 10}
+            await call("completion")
+            return "answer", {"prompt_tokens": 10, "completion_tokens": 10}
+
+        monkeypatch.setattr(embedder, "aembed", aembed)
+        monkeypatch.setattr(query_pipeline.model_inference_manager, "aquery", aquery)
+        return query_pipeline
+
+    return make
@@ -0,0 +1,67 @@
+from src.models.openai_client import OpenAIError
+import pytest
+
+
+def test_answer_runs_retrieval_and_expertise_concurrently(make_answering_pipeline):
+    events = []
+    query_pipeline = make_answering_pipeline(events)
+
+    result = query_pipeline.answer("Which section?", 1, "gpt-3.5-turbo-0125", 100, 0.5)
+
+    assert result["response"] == "answer"
+    assert result["similar_docs"] == ["second section"]
+    assert result["expertise_area"] == "expertise"
+    assert "second section" in result["prompt"]
+    # The expertise call starts while the query is embedded, and the completion once
+    # both are done
+    assert events.index(("start", "expertise")) < events.index(("end", "embedding"))
+    assert events.index(("start", "completion")) > max(
+        events.index(("end", "embedding")), events.index(("end", "expertise"))
+    )
+    assert set(result["timings"]) >= {"embedding", "search", "expertise", "completion"}
+    assert result["cost"] == sum(result["costs"].values()) > 0
+
+
+def test_stream_answer_finalises_cost_when_the_stream_ends(
+    monkeypatch, make_answering_pipeline
+):
+    query_pipeline = make_answering_pipeline()
+
+    class MockStream:
+        content = "streamed answer"
+        usage = {"prompt_tokens": 10, "completion_tokens": 2}
+
+        def __iter__(self):
+            yield from ["streamed", " answer"]
+
+    monkeypatch.setattr(
+        query_pipeline.model_inference_manager,
+        "stream_openai",
+        lambda *args: MockStream(),
+    )
+    result = query_pipeline.stream_answer(
+        "Which section?", 1, "gpt-3.5-turbo-0125", 100, 0.5
+    )
+    assert "response" not in result
+
+    assert "".join(result["stream"]) == "streamed answer"
+    assert result["response"] == "streamed answer"
+    assert result["timings"]["first_token"] <= result["timings"]["total"]
+    assert result["costs"]["completion"] > 0
+
+
+def test_stream_answer_raises_completion_errors_before_streaming(
+    monkeypatch, make_answering_pipeline
+):
+    query_pipeline = make_answering_pipeline()
+
+    def stream_openai(*args):
+        raise OpenAIError("HTTP Error 429: Rate limit reached", 429)
+
+    monkeypatch.setattr(
+        query_pipeline.model_inference_manager, "stream_openai", stream_openai
+    )
+    with pytest.raises(OpenAIError):
+        query_pipeline.stream_answer(
+            "Which section?", 1, "gpt-3.5-turbo-0125", 100, 0.5
+        )
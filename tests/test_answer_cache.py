@@ -0,0 +1,66 @@
+from src.models.answer_cache import SemanticAnswerCache
+
+ANSWER = {"response": "answer", "cost": 0.01}
+
+
+def test_similar_question_with_same_context_hits():
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    cache.set("gpt-4", 0.7, [1.0, 0.0], [2, 1], ANSWER)
+
+    assert cache.get("gpt-4", 0.7, [1.0, 0.05], [1, 2]) == ANSWER
+    assert cache.get("gpt-4", 0.7, [0.0, 1.0], [1, 2]) is None
+    assert cache.get("gpt-4", 0.2, [1.0, 0.0], [1, 2]) is None
+    assert cache.get("gpt-4", 0.7, [1.0, 0.0], [1, 3]) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_invalidate_and_evict():
+    cache = SemanticAnswerCache(max_size=2)
+    cache.set("gpt-4", 0.7, [1.0, 0.0], [1], ANSWER)
+    cache.set("gpt-4", 0.7, [0.0, 1.0], [2], ANSWER)
+    cache.get("gpt-4", 0.7, [1.0, 0.0], [1])
+    cache.set("gpt-4", 0.7, [1.0, 1.0], [3], ANSWER)
+
+    # The least recently used answer was evicted
+    assert cache.get("gpt-4", 0.7, [0.0, 1.0], [2]) is None
+    assert cache.invalidate([1, 5]) == 1
+    assert cache.get("gpt-4", 0.7, [1.0, 0.0], [1]) is None
+    assert cache.stats()["size"] == 1
+
+
+def test_answers_persist_across_restarts(tmp_path):
+    cache_path = str(tmp_path / "answers.sqlite")
+    cache = SemanticAnswerCache(cache_path=cache_path)
+    cache.set("gpt-4", 0.7, [1.0, 0.0], [1], ANSWER)
+    cache.set("gpt-4", 0.7, [0.0, 1.0], [2], ANSWER)
+    cache.invalidate([2])
+
+    cache = SemanticAnswerCache(cache_path=cache_path)
+    assert cache.get("gpt-4", 0.7, [1.0, 0.0], [1]) == ANSWER
+    assert cache.get("gpt-4", 0.7, [0.0, 1.0], [2]) is None
+
+
+def test_pipeline_reuses_cached_answer(make_answering_pipeline):
+    events = []
+    query_pipeline = make_answering_pipeline(events)
+    query_pipeline.answer_cache = SemanticAnswerCache()
+
+    first = query_pipeline.answer("Which section?", 1, "gpt-3.5-turbo-0125", 100, 0.5)
+    # The cache is looked up before the expertise call, once the query is embedded
+    assert events.index(("end", "embedding")) < events.index(("start", "expertise"))
+    del events[:]
+    second = query_pipeline.answer("Which one?", 1, "gpt-3.5-turbo-0125", 100, 0.5)
+
+    assert not first["cached"] and second["cached"]
+    assert second["response"] == "answer"
+    assert second["cached_cost"] == first["cost"]
+    # Only the query of the second question was embedded: both LLM calls were skipped
+    assert events == [("start", "embedding"), ("end", "embedding")]
+    assert second["costs"]["completion"] == second["costs"]["expertise"] == 0
+
+    # Removing the cited document drops its answers
+    query_pipeline.get_document_sections()["doc.md"] = first["section_ids"]
+    query_pipeline.remove_documents(["doc.md"])
+    assert query_pipeline.answer_cache.stats()["size"] == 0
+    third = query_pipeline.answer("Which one?", 1, "gpt-3.5-turbo-0125", 100, 0.5)
+    assert not third["cached"] and third["similar_docs"] == ["first section"]
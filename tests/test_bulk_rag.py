@@ -0,0 +1,84 @@
+from src.pipelines.bulk_rag import BulkRAGRunner
+from src.pipelines.query_pipeline import QueryPipeline
+from src.utils.utils import load_models_config
+import numpy as np
+import json
+
+
+def make_runner(monkeypatch, embed_calls, query_prompts):
+    models_config = load_models_config("config/models_config.yml")
+    query_pipeline = QueryPipeline("sk-test", models_config)
+    query_pipeline.set_model("text-embedding-3-small")
+    query_pipeline.embedder.texts = ["first section", "second section"]
+    query_pipeline.embedder.embeddings = np.array([[0.0, 1.0], [1.0, 0.0]], "float32")
+    query_pipeline.embedder.create_faiss_index()
+    query_pipeline.model_inference_manager.set_model("gpt-3.5-turbo-0125")
+
+    def embed_texts(texts, **kwargs):
+        embed_calls.append(list(texts))
+        if "fail" in texts[0]:
+            raise RuntimeError("embeddings request failed")
+        return np.array([[1.0, 0.0]] * len(texts), "float32"), 0.001
+
+    async def aquery(prompt_text, max_completion_tokens=100, temperature=0.7, **kwargs):
+        query_prompts.append(prompt_text)
+        return "answer", {"prompt_tokens": 10, "completion_tokens": 10}
+
+    monkeypatch.setattr(query_pipeline.embedder, "embed_texts", embed_texts)
+    monkeypatch.setattr(query_pipeline.model_inference_manager, "aquery", aquery)
+    return BulkRAGRunner(query_pipeline, num_results=1, batch_size=2, concurrency=2)
+
+
+def test_bulk_runner_batches_questions_and_resumes(monkeypatch, tmp_path):
+    input_path = tmp_path / "questions.jsonl"
+    output_path = tmp_path / "answers.jsonl"
+    with open(input_path, "w") as f:
+        for i in range(5):
+            f.write(json.dumps({"id": f"q{i}", "question": f"Question {i}?"}) + "\n")
+
+    embed_calls, query_prompts = [], []
+    runner = make_runner(monkeypatch, embed_calls, query_prompts)
+    stats = runner.run(str(input_path), str(output_path))
+
+    assert stats["answered"] == 5
+    # One embeddings call per batch of questions, two LLM calls per question
+    assert [len(texts) for texts in embed_calls] == [2, 2, 1]
+    assert len(query_prompts) == 10
+    with open(output_path) as f:
+        rows = [json.loads(line) for line in f]
+    assert sorted(row["id"] for row in rows) == [f"q{i}" for i in range(5)]
+    assert rows[0]["answer"] == "answer"
+    assert rows[0]["document_ids"] == [1]
+    assert set(rows[0]["timings"]) >= {"embedding_batch", "search_batch", "completion"}
+    assert rows[0]["cost"] == sum(rows[0]["costs"].values()) > 0
+
+    # Simulate a crash: two answers lost, the last one only partially written
+    with open(output_path) as f:
+        lines = f.readlines()
+    with open(output_path, "w") as f:
+        f.writelines(lines[:2] + [lines[2][:10]])
+
+    embed_calls.clear()
+    stats = runner.run(str(input_path), str(output_path))
+
+    assert (stats["answered"], stats["skipped"]) == (3, 2)
+    assert sum(len(texts) for texts in embed_calls) == 3
+    with open(output_path) as f:
+        rows = [json.loads(line) for line in f]
+    assert sorted(row["id"] for row in rows) == [f"q{i}" for i in range(5)]
+
+
+def test_bulk_runner_counts_failed_batches_and_goes_on(monkeypatch, tmp_path):
+    input_path = tmp_path / "questions.jsonl"
+    output_path = tmp_path / "answers.jsonl"
+    questions = ["Please fail?", "Question 1?", "Question 2?", "Question 3?"]
+    with open(input_path, "w") as f:
+        for i, question in enumerate(questions):
+            f.write(json.dumps({"id": f"q{i}", "question": question}) + "\n")
+
+    runner = make_runner(monkeypatch, [], [])
+    stats = runner.run(str(input_path), str(output_path))
+
+    assert (stats["answered"], stats["failed"]) == (2, 2)
+    with open(output_path) as f:
+        assert sorted(json.loads(line)["id"] for line in f) == ["q2", "q3"]
@@ -0,0 +1,67 @@
+from src.utils.chunking import chunk_sections
+from src.utils.utils import estimate_token_count, split_markdown_with_metadata
+
+CHUNKING_CONFIG = {"max_tokens": 40, "min_tokens": 10, "overlap_tokens": 12}
+
+
+def test_long_sections_are_split_with_headers_and_overlap():
+    paragraphs = [
+        " ".join(f"Sentence {p}.{s} of the guide." for s in range(4)) for p in range(6)
+    ]
+    markdown = "# Guide\n## Setup\n" + "\n\n".join(paragraphs)
+    sections = split_markdown_with_metadata(markdown)
+
+    chunks = chunk_sections(sections, CHUNKING_CONFIG)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_token_count(chunk["text"]) <= 40
+        assert chunk["text"].startswith("# Guide\n## Setup\n")
+        assert chunk["headers"] == ["# Guide", "## Setup"]
+        # Byte offsets point at the content of the chunk in the markdown
+        content = chunk["text"][len("# Guide\n## Setup\n") :]
+        source = markdown.encode("utf-8")[chunk["start_byte"] : chunk["end_byte"]]
+        assert source.decode("utf-8") == content
+        assert content[0].isupper() and content.endswith(".")
+    # Consecutive chunks share the last sentence of the first one
+    assert chunks[0]["text"].endswith("Sentence 0.3 of the guide.")
+    assert "\nSentence 0.3 of the guide.\n\nSentence 1.0" in chunks[1]["text"]
+    joined = " ".join(chunk["text"] for chunk in chunks)
+    assert all(paragraph.split(". ")[0] in joined for paragraph in paragraphs)
+
+
+def test_small_siblings_are_merged_under_their_parent():
+    markdown = (
+        "# API\n## get\nReads one value.\n## set\nWrites one value.\n"
+        "## delete\n" + "Removes every value of the key from the store. " * 8 + "\n"
+        "# Other\nUnrelated."
+    )
+    sections = split_markdown_with_metadata(markdown)
+
+    chunks = chunk_sections(sections, dict(CHUNKING_CONFIG, max_tokens=200))
+
+    assert [chunk["headers"] for chunk in chunks] == [
+        ["# API"],
+        ["# API", "## delete"],
+        ["# Other"],
+    ]
+    assert (
+        chunks[0]["text"]
+        == "# API\n## get\nReads one value.\n## set\nWrites one value."
+    )
+    assert chunks[0]["start_byte"] == sections[0]["start_byte"]
+    assert chunks[0]["end_byte"] == sections[1]["end_byte"]
+
+
+def test_sections_are_kept_without_config():
+    sections = split_markdown_with_metadata("# A\nfirst\n# B\nsecond")
+    assert chunk_sections(sections) == sections
+
+
+def test_long_words_are_cut():
+    sections = [{"text": "# A\n" + "x" * 1000, "headers": ["# A"]}]
+
+    chunks = chunk_sections(sections, CHUNKING_CONFIG)
+
+    assert all(estimate_token_count(chunk["text"]) <= 40 for chunk in chunks)
+    assert sum(len(chunk["text"]) - len("# A\n") for chunk in chunks) >= 1000
@@ -0,0 +1,46 @@
+from src.models.context_packer import pack_context, truncate_at_sentence
+from src.models.inference import ModelInferenceManager
+from src.utils.utils import load_models_config
+
+
+def test_duplicates_are_dropped_and_budget_is_filled_in_order():
+    documents = [
+        "The index is built once. It is then searched for every query.",
+        "the index is built  once. It is then searched for every query.",
+        "The index is built once. It is then searched for every single query.",
+        "Embeddings are cached. Sections are split by headers. Prompts are packed.",
+        "This document comes after the budget is reached.",
+    ]
+    context = pack_context(documents, budget=40, near_duplicate_threshold=0.7)
+
+    assert context["duplicates"] == 2
+    assert context["documents"][0] == documents[0]
+    # The fourth document is cut after a sentence, and the last one is dropped
+    assert context["documents"][1] == "Embeddings are cached."
+    assert context["truncated"]
+    assert context["included_tokens"] <= 40
+    assert context["dropped_tokens"] > 0
+
+
+def test_truncate_at_sentence_keeps_whole_sentences():
+    text = "First sentence. Second sentence!\nThird line"
+    assert truncate_at_sentence(text, 5) == "First sentence."
+    assert truncate_at_sentence(text, 9) == "First sentence. Second sentence!"
+    assert truncate_at_sentence(text, 100) == text
+    assert truncate_at_sentence(text, 1) == ""
+
+
+def test_prompt_fits_the_context_window_of_the_model():
+    models_config = load_models_config("config/models_config.yml")
+    models_config["context"] = {"max_context_tokens": None}
+    manager = ModelInferenceManager("sk-test", models_config)
+    manager.set_model("gpt-3.5-turbo-instruct")  # 4096 tokens
+    documents = [f"Document number {i}. " + "word " * 400 for i in range(20)]
+
+    prompt, context = manager.pack_prompt("Expert", "Question?", documents, 500)
+
+    assert len(prompt) // 4 + 500 <= 4096
+    assert 0 < len(context["documents"]) < len(documents)
+    assert manager.prepare_prompt_for_llm("Expert", "Question?", documents[:1]) == (
+        manager.build_prompt("Expert", "Question?", documents[:1])
+    )
@@ -0,0 +1,177 @@
+from src.models.text_store import MappedTexts
+import numpy as np
+import faiss
+import json
+import os
+import pytest
+
+
+def test_one_database_per_ingestion_run(make_pipeline, tmpdir):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+
+    for _ in range(2):
+        _, total_documents_processed = query_pipeline.setup_semantic_database(
+            markdown_path="data/raw/mock_markdown.md",
+            embedding_model="text-embedding-3-small",
+            save_index=True,
+            directory_path=output_directory,
+        )
+
+    files = sorted(os.listdir(output_directory))
+    # Two runs, one index and one texts file each, with names that never collide
+    assert len(files) == 4
+    assert sum(f.endswith(".bin") for f in files) == 2
+    with open(os.path.join(output_directory, files[0].replace(".bin", ".json"))) as f:
+        assert len(json.load(f)["texts"]) == total_documents_processed
+
+
+def test_append_to_existing_database(make_pipeline, tmpdir):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+
+    query_pipeline.setup_semantic_database(
+        markdown_content="# A\nfirst section\n# B\nsecond section",
+        embedding_model="text-embedding-3-small",
+        save_index=True,
+        directory_path=output_directory,
+    )
+    database_name = os.listdir(output_directory)[0].rsplit(".", 1)[0]
+    query_pipeline.setup_semantic_database(
+        markdown_content="# C\nthird section",
+        embedding_model="text-embedding-3-small",
+        save_index=True,
+        directory_path=output_directory,
+        append_to=database_name,
+    )
+
+    assert len(os.listdir(output_directory)) == 2
+    query_pipeline.load_and_merge_databases(output_directory)
+    assert query_pipeline.embedder.faiss_index.ntotal == 3
+    assert query_pipeline.embedder.texts[-1] == "# C\nthird section"
+
+
+def test_merged_databases_are_cached(make_pipeline, monkeypatch, tmpdir):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+    for markdown_content in ("# A\nfirst\n# B\nsecond", "# C\nthird"):
+        query_pipeline.setup_semantic_database(
+            markdown_content=markdown_content,
+            embedding_model="text-embedding-3-small",
+            save_index=True,
+            directory_path=output_directory,
+        )
+
+    query_pipeline.load_and_merge_databases(output_directory)
+    merged_texts = query_pipeline.embedder.texts
+    assert len(merged_texts) == 3
+    assert os.path.exists(os.path.join(output_directory, ".merged", "index.bin"))
+
+    # A new pipeline is served from the cache without touching the databases
+    warm_pipeline = make_pipeline()
+    monkeypatch.setattr(
+        warm_pipeline, "save_merged_cache", lambda *args: pytest.fail("cache miss")
+    )
+    warm_pipeline.load_and_merge_databases(output_directory)
+    assert warm_pipeline.embedder.texts == merged_texts
+    assert warm_pipeline.embedder.faiss_index.ntotal == 3
+
+
+def test_add_update_and_remove_documents(make_pipeline, tmpdir):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+    query_pipeline.add_documents(
+        {"a.md": "# A\nfirst\n# A2\nsecond", "b.md": "# B\nthird"},
+        "text-embedding-3-small",
+        output_directory,
+    )
+    query_pipeline.update_documents(
+        {"a.md": "# A\nfirst, edited"}, "text-embedding-3-small", output_directory
+    )
+    query_pipeline.remove_documents(["b.md"], output_directory)
+
+    live_texts = query_pipeline.embedder.texts
+    assert live_texts == ["# A\nfirst, edited"]
+    assert query_pipeline.embedder.faiss_index.ntotal == 1
+
+    # A fresh process sees the same knowledge base, from the databases and deleted IDs
+    fresh_pipeline = make_pipeline()
+    fresh_pipeline.load_and_merge_databases(output_directory, use_cache=False)
+    assert fresh_pipeline.embedder.texts == live_texts
+    assert fresh_pipeline.embedder.ids == query_pipeline.embedder.ids
+
+    # Compaction leaves a single database and no deleted IDs
+    query_pipeline.compact_databases(output_directory)
+    assert "deleted_ids.txt" not in os.listdir(output_directory)
+    assert sum(f.endswith(".bin") for f in os.listdir(output_directory)) == 1
+    fresh_pipeline = make_pipeline()
+    fresh_pipeline.load_and_merge_databases(output_directory)
+    assert (
+        fresh_pipeline.get_document_sections() == query_pipeline.get_document_sections()
+    )
+    assert fresh_pipeline.find_similar_documents("first", 1) == live_texts
+
+
+@pytest.mark.parametrize(
+    "retrieval_config",
+    [
+        {"index_type": "ivf_flat", "ivf_flat": {"nlist": 2, "nprobe": 2}},
+        {"index_type": "hnsw", "hnsw": {"m": 8}},
+    ],
+)
+def test_approximate_indexes(make_pipeline, tmpdir, retrieval_config):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+    query_pipeline.embedder.retrieval_config = retrieval_config
+    documents = {
+        f"{i}.md": "\n".join(f"# {i}-{j}\n" + "x" * (i * 10 + j) for j in range(10))
+        for i in range(10)
+    }
+    query_pipeline.add_documents(documents, "text-embedding-3-small", output_directory)
+    query_pipeline.remove_documents(["0.md"], output_directory)
+
+    fresh_pipeline = make_pipeline()
+    fresh_pipeline.embedder.retrieval_config = retrieval_config
+    fresh_pipeline.load_and_merge_databases(output_directory)
+    faiss_index = fresh_pipeline.embedder.faiss_index
+    assert faiss_index.ntotal == 90
+    assert type(faiss.downcast_index(faiss_index.index)).__name__ in (
+        "IndexIVFFlat",
+        "IndexHNSWFlat",
+    )
+    assert len(fresh_pipeline.find_similar_documents("query", 5)) == 5
+
+
+def test_merged_cache_is_memory_mapped(make_pipeline, tmpdir):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+    query_pipeline.add_documents(
+        {"a.md": "# A\nfirst\n# B\nsecönd"}, "text-embedding-3-small", output_directory
+    )
+    query_pipeline.load_and_merge_databases(output_directory, use_cache=True)
+    query_pipeline.save_merged_cache(
+        os.path.join(output_directory, ".merged"),
+        query_pipeline.loaded_manifest,
+        ["a.md", "a.md"],
+    )
+
+    warm_pipeline = make_pipeline()
+    warm_pipeline.load_and_merge_databases(output_directory)
+    texts = warm_pipeline.embedder.texts
+    assert isinstance(texts, MappedTexts)
+    assert isinstance(warm_pipeline.embedder.ids, np.memmap)
+    assert texts[1] == "# B\nsecönd" and texts[-2] == "# A\nfirst"
+    # The sections are only mapped by ID and by document when first needed
+    assert warm_pipeline.embedder.id_positions is None
+    assert warm_pipeline.document_sections is None
+    assert (
+        warm_pipeline.get_document_sections() == query_pipeline.get_document_sections()
+    )
+
+    # The mapped sections can still be added to and removed
+    warm_pipeline.add_documents(
+        {"c.md": "# C\nthird"}, "text-embedding-3-small", output_directory
+    )
+    warm_pipeline.remove_documents(["a.md"], output_directory)
+    assert list(warm_pipeline.embedder.texts) == ["# C\nthird"]
+    assert warm_pipeline.embedder.faiss_index.ntotal == 1
@@ -0,0 +1,57 @@
+from src.models.document_store import DocumentStore, make_section_records
+from src.utils.utils import (
+    split_markdown_by_headers_with_hierarchy,
+    split_markdown_with_metadata,
+)
+import os
+
+MARKDOWN = "intro\n# Café\nfirst\n## Menu\n  second  \n# End\nthird"
+
+
+def test_sections_keep_their_headers_and_byte_offsets():
+    sections = split_markdown_with_metadata(MARKDOWN)
+    data = MARKDOWN.encode("utf-8")
+
+    assert [section["text"] for section in sections] == (
+        split_markdown_by_headers_with_hierarchy(MARKDOWN)
+    )
+    assert sections[1]["headers"] == ["# Café", "## Menu"]
+    assert [
+        data[section["start_byte"] : section["end_byte"]].decode("utf-8")
+        for section in sections
+    ] == ["first", "second", "third"]
+
+
+def test_store_fetches_records_by_id(tmpdir):
+    store = DocumentStore(os.path.join(tmpdir.strpath, "documents.sqlite"))
+    sections = split_markdown_with_metadata(MARKDOWN)
+    store.add(make_section_records([7, 8, 9], sections, "menu.md", "menu.md"))
+    store.remove([8])
+
+    first, missing, last = store.get([9, 8, 7])
+    assert missing is None
+    assert first["text"] == "# End\nthird" and first["headers"] == ["# End"]
+    assert last["document_id"] == "menu.md" and last["token_count"] > 0
+    assert len(last["content_hash"]) == 64 and len(store) == 2
+
+
+def test_search_reads_the_top_sections_from_the_store(make_pipeline, tmpdir):
+    output_directory = tmpdir.strpath
+    query_pipeline = make_pipeline()
+    query_pipeline.add_documents(
+        {"menu.md": MARKDOWN, "other.md": "# Other\nfourth"},
+        "text-embedding-3-small",
+        output_directory,
+    )
+    query_pipeline.remove_documents(["other.md"], output_directory)
+
+    fresh_pipeline = make_pipeline()
+    fresh_pipeline.load_and_merge_databases(output_directory)
+    fresh_pipeline.set_model("text-embedding-3-small")
+    records = fresh_pipeline.embedder.get_records([0, 1, 2])
+    assert [record["source"] for record in records] == ["menu.md"] * 3
+    assert len(fresh_pipeline.embedder.document_store) == 3
+
+    # Texts come from the store rather than from the loaded list
+    fresh_pipeline.embedder.texts = ["stale"] * 3
+    assert fresh_pipeline.find_similar_documents("xxxxx", 1)[0].startswith("# ")
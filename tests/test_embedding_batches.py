@@ -0,0 +1,50 @@
+from src.models import openai_client
+import numpy as np
+import pytest
+
+
+def test_generate_embeddings_in_batches(
+    mock_embeddings_api, make_vectorizer, monkeypatch
+):
+    calls = []
+    monkeypatch.setattr(
+        openai_client.requests.Session, "post", mock_embeddings_api(calls=calls)
+    )
+    vectorizer = make_vectorizer(max_batch_items=3)
+    vectorizer.texts = ["a" * n for n in range(1, 8)]
+
+    total_cost = vectorizer.generate_embeddings()
+
+    assert [len(call) for call in calls] == [3, 3, 1]
+    assert vectorizer.embeddings.dtype == np.float32
+    assert vectorizer.embeddings[:, 0].tolist() == list(range(1, 8))
+    assert vectorizer.faiss_index.ntotal == 7
+    assert total_cost == 3 * 10 * vectorizer.usage_price_per_token
+
+
+def test_batches_respect_token_budget(make_vectorizer):
+    vectorizer = make_vectorizer(max_batch_items=100, max_batch_tokens=10)
+    texts = ["x" * 20, "x" * 20, "x" * 40, "x"]
+
+    assert list(vectorizer.make_batches(texts)) == [[0], [1], [2], [3]]
+
+
+def test_failed_batch_is_split_and_retried(
+    mock_embeddings_api, make_vectorizer, monkeypatch
+):
+    calls = []
+    monkeypatch.setattr(
+        openai_client.requests.Session,
+        "post",
+        mock_embeddings_api(failing_texts={"ccc"}, calls=calls),
+    )
+    vectorizer = make_vectorizer()
+    texts = ["a", "bb", "ccc", "dddd"]
+
+    results = vectorizer.embed_batch(texts[:2], [0, 1])
+    assert [positions for positions, _, _ in results] == [[0, 1]]
+
+    with pytest.raises(RuntimeError):
+        vectorizer.embed_batch(texts, [0, 1, 2, 3])
+    # The rejected batch was split in halves down to the failing text
+    assert ["ccc"] in calls and ["a", "bb"] in calls
@@ -0,0 +1,97 @@
+from src.models import openai_client
+from src.models.embedding_cache import QueryEmbeddingCache
+from src.models.embedding_store import EmbeddingStore
+import numpy as np
+import os
+
+
+def mock_query_embedding(calls):
+    def query_openai_embedding(text):
+        calls.append(text)
+        return np.array([float(len(text)), 1.0], dtype="float32"), {}
+
+    return query_openai_embedding
+
+
+def test_query_embeddings_are_cached(make_vectorizer, monkeypatch):
+    calls = []
+    vectorizer = make_vectorizer()
+    monkeypatch.setattr(
+        vectorizer, "query_openai_embedding", mock_query_embedding(calls)
+    )
+    vectorizer.texts = ["first section", "second section"]
+    vectorizer.embeddings = np.array([[13.0, 1.0], [14.0, 1.0]], dtype="float32")
+    vectorizer.create_faiss_index()
+
+    # The same question, up to case and whitespace, is embedded only once
+    for query in ("Which section?", "which section?\n", "Which section?"):
+        assert vectorizer.search_similar_sections(query, 1) == ["second section"]
+
+    assert len(calls) == 1
+    assert vectorizer.query_cache.stats()["hits"] == 2
+    assert vectorizer.query_cache.stats()["misses"] == 1
+
+
+def test_cache_size_and_ttl_limits(monkeypatch):
+    cache = QueryEmbeddingCache(max_size=2, ttl=60)
+    for text in ("a", "b", "c"):
+        cache.set("model", text, [1.0])
+
+    # "a" is the least recently used entry
+    assert cache.get("model", "a") is None
+    assert cache.get("model", "c") is not None
+    assert cache.get("other-model", "c") is None
+
+    # Long after the TTL every entry has expired
+    monkeypatch.setattr("src.models.embedding_cache.time.time", lambda: 1e12)
+    assert cache.get("model", "c") is None
+
+
+def test_disk_cache_survives_restarts(tmpdir):
+    cache_path = os.path.join(tmpdir.strpath, "query_embeddings.sqlite")
+    QueryEmbeddingCache(cache_path=cache_path).set("model", "question", [1.0, 2.0])
+
+    cache = QueryEmbeddingCache(cache_path=cache_path)
+    assert cache.get("model", "question").tolist() == [1.0, 2.0]
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_unchanged_sections_are_not_embedded_again(
+    mock_embeddings_api, make_vectorizer, monkeypatch, tmpdir
+):
+    calls = []
+    monkeypatch.setattr(
+        openai_client.requests.Session, "post", mock_embeddings_api(calls=calls)
+    )
+    vectorizer = make_vectorizer()
+    vectorizer.embedding_store = EmbeddingStore(tmpdir.strpath)
+
+    vectorizer.texts = ["first section", "second section"]
+    vectorizer.generate_embeddings()
+    first_embeddings = vectorizer.embeddings.copy()
+
+    # Same sections plus an edited one, in a new process
+    vectorizer.embedding_store = EmbeddingStore(tmpdir.strpath)
+    vectorizer.texts = ["second section", "edited section", "first section"]
+    vectorizer.generate_embeddings()
+
+    assert calls[-1] == ["edited section"]
+    assert (vectorizer.reused_embeddings, vectorizer.new_embeddings) == (2, 1)
+    assert (vectorizer.embeddings[[2, 0]] == first_embeddings).all()
+
+
+def test_queries_are_not_added_to_the_embedding_store(
+    mock_embeddings_api, make_vectorizer, monkeypatch, tmpdir
+):
+    calls = []
+    monkeypatch.setattr(
+        openai_client.requests.Session, "post", mock_embeddings_api(calls=calls)
+    )
+    vectorizer = make_vectorizer()
+    vectorizer.embedding_store = EmbeddingStore(tmpdir.strpath)
+
+    for _ in range(2):
+        vectorizer.embed_texts(["a question?"], use_store=False)
+    vectorizer.embed_texts(["a question?"])
+
+    assert len(calls) == 3
@@ -0,0 +1,106 @@
+from src.models.document_store import DocumentStore, make_section_records
+from src.models.index_factory import build_faiss_index, search_filtered
+import numpy as np
+import pytest
+import faiss
+
+
+@pytest.mark.parametrize(
+    "retrieval_config",
+    [
+        {"index_type": "flat"},
+        {"index_type": "hnsw", "hnsw": {"m": 8, "ef_search": 16}},
+        {"index_type": "ivf_flat", "ivf_flat": {"nlist": 16, "nprobe": 2}},
+    ],
+)
+def test_search_filtered_returns_the_nearest_selected_vectors(retrieval_config):
+    vectors = np.random.default_rng(0).standard_normal((2000, 16)).astype("float32")
+    ids = np.arange(2000) * 3 + 1
+    faiss_index = build_faiss_index(16, [(ids, vectors)], retrieval_config)
+    queries = vectors[:2]
+
+    # A wide filter goes through the ID selector, a narrow one compares vectors directly
+    for selected_positions in (np.arange(0, 2000, 2), np.arange(5, 2000, 400)):
+        selected_ids = ids[selected_positions]
+        distances, labels = search_filtered(faiss_index, queries, 5, selected_ids)
+
+        assert set(labels.ravel()) <= set(selected_ids)
+        assert (labels >= 0).all()
+        _, expected = faiss.knn(queries, vectors[selected_positions], 5)
+        if retrieval_config["index_type"] == "flat" or len(selected_ids) == 5:
+            np.testing.assert_array_equal(labels, selected_ids[expected])
+
+
+def test_search_filtered_pads_small_selections():
+    vectors = np.eye(4, dtype="float32")
+    vectors = np.vstack([vectors, np.zeros((96, 4), "float32")])
+    faiss_index = build_faiss_index(4, [(np.arange(10, 110), vectors)])
+
+    # Through the ID selector (3% of the index), and through the direct comparison
+    for ids in ([12, 14, 13], [12]):
+        distances, labels = search_filtered(faiss_index, vectors[2:3], 4, ids)
+        assert list(labels[0]) == ids + [-1] * (4 - len(ids))
+        assert distances[0][-1] == np.finfo("float32").max
+
+
+def test_find_ids(tmp_path):
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite"))
+    sections = [
+        {"text": "a", "headers": ["# Guide", "## Setup"]},
+        {"text": "b", "headers": ["# Guide", "## Setup", "### Linux"]},
+        {"text": "c", "headers": ["# Guide", "## Setup tips"]},
+    ]
+    document_store.add(make_section_records([1, 2, 3], sections, "guide", "guide.md"))
+    document_store.add(
+        make_section_records(
+            [4], [{"text": "d", "headers": ["# FAQ"]}], "faq", "faq.md"
+        )
+    )
+
+    assert sorted(document_store.find_ids({"source": "guide.md"})) == [1, 2, 3]
+    assert sorted(
+        document_store.find_ids({"header_prefix": ["# Guide", "## Setup"]})
+    ) == [1, 2]
+    assert sorted(
+        document_store.find_ids({"document_id": ["faq", "guide"], "ingested_after": 0})
+    ) == [1, 2, 3, 4]
+    assert document_store.find_ids({"ingested_before": 0}) == []
+    assert document_store.get_sources() == ["faq.md", "guide.md"]
+    with pytest.raises(ValueError):
+        document_store.find_ids({"author": "me"})
+
+
+def test_find_similar_documents_with_filters(make_pipeline, tmp_path):
+    query_pipeline = make_pipeline()
+    query_pipeline.add_documents(
+        {
+            "a.md": "# A\nshort\n# A2\nsomewhat longer text",
+            "b.md": "# B\nthe other file\n# B2\nand its second section",
+        },
+        embedding_model="text-embedding-3-small",
+        directory_path=str(tmp_path),
+    )
+
+    docs = query_pipeline.find_similar_documents("x" * 20, 5, {"source": "b.md"})
+    assert sorted(docs) == ["# B\nthe other file", "# B2\nand its second section"]
+    assert query_pipeline.find_similar_documents("x", 5, {"source": "c.md"}) == []
+    assert len(query_pipeline.find_similar_documents("x", 5)) == 4
+
+
+def test_removed_sections_keep_their_ids_in_ivf_indexes(make_pipeline):
+    query_pipeline = make_pipeline()
+    embedder = query_pipeline.embedder
+    embedder.retrieval_config = {"index_type": "ivf_flat", "ivf_flat": {"nlist": 4}}
+    vectors = np.random.default_rng(0).standard_normal((200, 8)).astype("float32")
+    ids = list(range(1000, 1200))
+    embedder.set_sections(
+        ids,
+        [str(id_) for id_ in ids],
+        build_faiss_index(8, [(ids, vectors)], embedder.retrieval_config),
+    )
+
+    embedder.remove_sections(ids[:50])
+
+    _, labels = embedder.faiss_index.search(vectors[100:101], 1)
+    assert labels[0][0] == 1100
+    assert embedder.faiss_index.ntotal == 150
@@ -0,0 +1,94 @@
+from src.pipelines.ingestion import DirectoryIngester, find_markdown_files
+import pytest
+import os
+
+
+def write_markdown_files(root, num_files):
+    for i in range(num_files):
+        directory = os.path.join(root, f"part{i % 3}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"doc{i}.md"), "w") as f:
+            f.write(f"# Doc {i}\nintro {i}\n## Details\ndetails of doc {i}\n")
+
+
+def test_find_markdown_files(tmp_path):
+    write_markdown_files(str(tmp_path), 4)
+    (tmp_path / "notes.txt").write_text("not markdown")
+
+    assert len(find_markdown_files(str(tmp_path))) == 4
+    assert len(find_markdown_files(str(tmp_path / "part0" / "*.md"))) == 2
+
+
+def test_ingest_directory_into_knowledge_base(make_pipeline, tmp_path):
+    source_directory = str(tmp_path / "docs")
+    knowledge_base = str(tmp_path / "knowledge_base")
+    os.makedirs(knowledge_base)
+    write_markdown_files(source_directory, 10)
+
+    query_pipeline = make_pipeline()
+    query_pipeline.embedder.max_batch_items = 4
+    # A tiny queue and small databases, to go through back-pressure and several saves
+    ingester = DirectoryIngester(
+        query_pipeline, num_workers=2, queue_size=1, max_database_sections=8
+    )
+    stats = ingester.run(source_directory, "text-embedding-3-small", knowledge_base)
+
+    assert stats["files"] == 10 and stats["sections"] == 20
+    assert stats["files_per_second"] > 0 and stats["sections_per_second"] > 0
+    assert len(query_pipeline.embedder.texts) == 20
+    document_id = os.path.join("part1", "doc4.md")
+    assert len(query_pipeline.get_document_sections()[document_id]) == 2
+
+    # Sections are persisted with the file they come from
+    loaded_pipeline = make_pipeline()
+    loaded_pipeline.load_and_merge_databases(knowledge_base)
+    assert sorted(loaded_pipeline.embedder.texts) == sorted(
+        query_pipeline.embedder.texts
+    )
+    (record,) = loaded_pipeline.embedder.document_store.get(
+        loaded_pipeline.get_document_sections()[document_id][:1]
+    )
+    assert record["source"] == os.path.join(source_directory, document_id)
+    assert record["headers"] == ["# Doc 4"]
+
+    # Files ingested again replace their previous sections
+    stats = ingester.run(source_directory, "text-embedding-3-small", knowledge_base)
+    assert stats["files"] == 10
+    loaded_pipeline.load_and_merge_databases(knowledge_base)
+    assert len(loaded_pipeline.embedder.texts) == 20
+
+
+def test_failed_ingestion_keeps_the_previous_documents(
+    make_pipeline, monkeypatch, tmp_path
+):
+    source_directory = str(tmp_path / "docs")
+    knowledge_base = str(tmp_path / "knowledge_base")
+    os.makedirs(knowledge_base)
+    write_markdown_files(source_directory, 10)
+    query_pipeline = make_pipeline()
+    query_pipeline.embedder.max_batch_items = 4
+    ingester = DirectoryIngester(query_pipeline, num_workers=2)
+    ingester.run(source_directory, "text-embedding-3-small", knowledge_base)
+
+    # The second batch of the next run fails to embed
+    embed_texts = query_pipeline.embedder.embed_texts
+    calls = []
+
+    def failing_embed_texts(texts, **kwargs):
+        calls.append(texts)
+        if len(calls) == 2:
+            raise RuntimeError("embeddings request failed")
+        return embed_texts(texts, **kwargs)
+
+    monkeypatch.setattr(query_pipeline.embedder, "embed_texts", failing_embed_texts)
+    with pytest.raises(RuntimeError):
+        ingester.run(source_directory, "text-embedding-3-small", knowledge_base)
+
+    # Every file is still there once, in its previous or its new version
+    for pipeline in (query_pipeline, make_pipeline()):
+        pipeline.load_and_merge_databases(knowledge_base, use_cache=False)
+        assert len(pipeline.get_document_sections()) == 10
+        assert sorted(pipeline.embedder.texts) == sorted(
+            [f"# Doc {i}\nintro {i}" for i in range(10)]
+            + [f"# Doc {i}\n## Details\ndetails of doc {i}" for i in range(10)]
+        )
@@ -0,0 +1,56 @@
+from src.models.lexical_index import LexicalIndex, fuse_rankings, tokenize
+import numpy as np
+
+
+def test_bm25_ranks_rarer_and_denser_matches_first():
+    index = LexicalIndex()
+    index.build(
+        [10, 11, 12],
+        [
+            "FAISS stores vectors. FAISS searches vectors.",
+            "The vectors of the knowledge base.",
+            "Streamlit renders the knowledge base.",
+        ],
+    )
+
+    matches = index.search("faiss vectors", 3)
+
+    assert [id_ for id_, _ in matches] == [10, 11]
+    assert matches[0][1] > matches[1][1] > 0
+    assert index.search("missing", 3) == []
+
+
+def test_sections_are_added_and_removed_incrementally():
+    index = LexicalIndex()
+    index.build([1, 2], ["alpha beta", "beta gamma"])
+    index.remove([1], ["alpha beta"])
+    index.add([3, 4], ["alpha delta", "alpha epsilon"])
+    index.remove([4], ["alpha epsilon"])
+
+    assert [id_ for id_, _ in index.search("alpha", 5)] == [3]
+    assert [id_ for id_, _ in index.search("beta", 5)] == [2]
+    assert "epsilon" not in index.postings
+    assert index.total_length == 4 and len(index) == 2
+    assert tokenize("Hello, World!") == ["hello", "world"]
+
+
+def test_fuse_rankings_favours_documents_ranked_by_both():
+    fused = fuse_rankings([[1, 2, 3], [3, 4, 1]], 2)
+
+    assert [id_ for id_, _ in fused] == [1, 3]
+
+
+def test_pipeline_keyword_index_follows_live_changes(make_answering_pipeline):
+    query_pipeline = make_answering_pipeline()
+    embedder = query_pipeline.embedder
+    embedder.add_sections([5], ["third section"], np.array([[0.5, 0.5]], "float32"))
+
+    assert query_pipeline.search_keywords("third", 2)[0][0] == "third section"
+    embedder.add_sections([6], ["fourth section"], np.array([[0.2, 0.8]], "float32"))
+    assert query_pipeline.search_keywords("fourth", 2)[0][0] == "fourth section"
+    embedder.remove_sections([5])
+    assert query_pipeline.search_keywords("third", 2) == []
+
+    embedder.embed_query = lambda query_text: np.array([1.0, 0.0], "float32")
+    fused = query_pipeline.hybrid_search("fourth", 2)
+    assert {text for text, _ in fused} == {"fourth section", "second section"}
@@ -0,0 +1,61 @@
+from benchmarks.openai_stand_in import OpenAIStandIn
+from src.pipelines.query_pipeline import QueryPipeline
+from src.utils.metrics import InMemorySink, JSONLogSink, Metrics, PrometheusSink
+from src.utils.utils import load_models_config
+import io
+import json
+
+
+def test_pipeline_records_a_span_per_stage():
+    models_config = load_models_config("config/models_config.yml")
+    sink = InMemorySink()
+    with OpenAIStandIn(dimension=8) as stand_in:
+        models_config["client"] = {"base_url": stand_in.base_url}
+        query_pipeline = QueryPipeline(
+            "sk-test", models_config, metrics=Metrics([sink])
+        )
+        query_pipeline.setup_semantic_database(
+            markdown_content="# Title\nFirst section\n## Part\nSecond section",
+            embedding_model="text-embedding-3-small",
+        )
+        query_pipeline.answer("Which section?", 1, "gpt-3.5-turbo-0125", 100, 0.5)
+
+    stages = {span.name for span in sink.spans}
+    assert stages >= {
+        "parse",
+        "embed",
+        "index_add",
+        "search",
+        "expertise",
+        "prompt_build",
+        "completion",
+    }
+    assert sink.get_spans("parse")[0].values["items"] == 2
+    completion = sink.get_spans("completion")[0]
+    assert completion.labels == {"model": "gpt-3.5-turbo-0125"}
+    assert completion.values["prompt_tokens"] > 0
+    assert completion.values["cost"] > 0
+    assert all(span.duration >= 0 for span in sink.spans)
+
+
+def test_span_sinks_export_errors_histograms_and_json_lines():
+    prometheus_sink = PrometheusSink(buckets=(0.1, 1))
+    stream = io.StringIO()
+    metrics = Metrics([prometheus_sink, JSONLogSink(stream)])
+
+    with metrics.span("search") as span:
+        span.record(items=2)
+    try:
+        with metrics.span("embed", model="m"):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    text = prometheus_sink.render()
+    assert 'llm_rag_stage_duration_seconds_bucket{stage="search",le="+Inf"} 1' in text
+    assert 'llm_rag_stage_duration_seconds_count{model="m",stage="embed"} 1' in text
+    assert 'llm_rag_stage_errors_total{model="m",stage="embed"} 1' in text
+    assert 'llm_rag_stage_items_total{stage="search"} 2' in text
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["span"] for line in lines] == ["search", "embed"]
+    assert lines[1]["errors"] == 1
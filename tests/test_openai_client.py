@@ -0,0 +1,77 @@
+from src.models.inference import ModelInferenceManager
+from src.models.openai_client import OpenAIClient
+from src.utils.utils import load_models_config
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import threading
+
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        ChatCompletionsHandler.connections += 1
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        content = payload["messages"][0]["content"]
+        usage = {"prompt_tokens": 1, "completion_tokens": 1}
+        if payload.get("stream"):
+            # One server-sent event per word, then the usage and the end marker
+            chunks = [
+                {"choices": [{"delta": {"content": word}}]}
+                for word in content.split(" ")
+            ]
+            chunks.append({"choices": [], "usage": usage})
+            body = "".join(
+                f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks
+            )
+            body = (body + "data: [DONE]\n\n").encode("utf-8")
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps(
+                {"choices": [{"message": {"content": content}}], "usage": usage}
+            ).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_client_reuses_connections_to_a_local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = OpenAIClient(
+            "sk-test", base_url=f"http://127.0.0.1:{server.server_port}"
+        )
+        models_config = load_models_config("config/models_config.yml")
+        manager = ModelInferenceManager("sk-test", models_config, client=client)
+        manager.set_model("gpt-3.5-turbo-0125")
+
+        for i in range(3):
+            assert manager.query_openai(f"question {i}")[0] == f"question {i}"
+        assert ChatCompletionsHandler.connections == 1
+
+        async def ask_concurrently():
+            return await asyncio.gather(
+                *(manager.aquery(f"async question {i}") for i in range(4))
+            )
+
+        answers = [content for content, _ in asyncio.run(ask_concurrently())]
+        assert answers == [f"async question {i}" for i in range(4)]
+
+        chat_stream = manager.stream_openai("a streamed café 東京")
+        assert list(chat_stream) == ["a", "streamed", "café", "東京"]
+        assert chat_stream.usage == {"prompt_tokens": 1, "completion_tokens": 1}
+        client.close()
+    finally:
+        server.shutdown()
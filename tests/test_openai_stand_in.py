@@ -0,0 +1,27 @@
+from benchmarks.openai_stand_in import OpenAIStandIn
+from src.models.inference import ModelInferenceManager
+from src.models.openai_client import OpenAIClient
+from src.models.vectorization import SemanticVectorizer
+from src.utils.utils import load_models_config
+import numpy as np
+
+
+def test_stand_in_serves_deterministic_embeddings_and_completions():
+    models_config = load_models_config("config/models_config.yml")
+    with OpenAIStandIn(dimension=8) as stand_in:
+        client = OpenAIClient("sk-test", base_url=stand_in.base_url)
+        vectorizer = SemanticVectorizer("sk-test", models_config, client=client)
+        vectorizer.set_model("text-embedding-3-small")
+        manager = ModelInferenceManager("sk-test", models_config, client=client)
+        manager.set_model("gpt-3.5-turbo-0125")
+
+        embeddings, usage = vectorizer.query_openai_embeddings(["a", "b", "a"])
+        response, _ = manager.query_openai("question")
+        streamed = "".join(manager.stream_openai("question"))
+
+    assert embeddings.shape == (3, 8)
+    np.testing.assert_array_equal(embeddings[0], embeddings[2])
+    assert not np.allclose(embeddings[0], embeddings[1])
+    assert usage["total_tokens"] > 0
+    assert response.startswith("Stand-in answer")
+    assert streamed.strip() == response
@@ -0,0 +1,88 @@
+from src.models import openai_client
+from src.models.openai_client import OpenAIClient, OpenAIError
+from src.models.rate_limiter import RateLimiter, TokenBucket
+from src.utils.metrics import InMemorySink, Metrics
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def mock_api(mock_response):
+    """
+    Returns a factory of `requests.Session.post` stand-ins answering with `statuses`
+    in turn.
+    """
+
+    def make(statuses, calls):
+        def post(self, url, json=None, timeout=None):
+            calls.append(url)
+            status_code, headers = statuses.pop(0)
+            return mock_response(status_code, {"error": {"message": "busy"}}, headers)
+
+        return post
+
+    return make
+
+
+def test_token_bucket_delays_requests_over_the_limit():
+    bucket = TokenBucket(60)  # One unit per second, bursts of 60
+
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(2) == pytest.approx(2, abs=0.05)
+
+
+def test_rate_limiter_reads_per_model_limits():
+    rate_limiter = RateLimiter.from_config(
+        {
+            "models": [
+                {
+                    "variants": [
+                        {"model": "m", "requests_per_minute": 60},
+                        {"model": "free"},
+                    ]
+                }
+            ]
+        }
+    )
+    assert rate_limiter.reserve("m", 10**6) == 0  # No token limit
+    assert rate_limiter.reserve("m", 0) == 0
+    assert rate_limiter.buckets["free"] == (None, None)
+
+
+def test_client_retries_after_retry_after_and_records_throttling(mock_api, monkeypatch):
+    calls = []
+    statuses = [(429, {"retry-after-ms": "50"}), (503, {}), (200, {})]
+    monkeypatch.setattr(
+        openai_client.requests.Session, "post", mock_api(statuses, calls)
+    )
+    sink = InMemorySink()
+    client = OpenAIClient(
+        "sk-test", backoff_base=0.01, backoff_max=1, metrics=Metrics([sink])
+    )
+
+    response = client.post("/embeddings", {"model": "m", "input": ["text"]})
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+    waits = [span.values["wait_seconds"] for span in sink.get_spans("throttle")]
+    assert waits[0] == 0.05  # Retry-After of the 429
+    assert len(waits) <= 2  # The jittered backoff of the 503 can be 0
+    assert sink.get_spans("throttle")[0].labels == {"model": "m", "reason": "retry"}
+
+
+def test_client_raises_on_client_errors_and_exhausted_retries(mock_api, monkeypatch):
+    calls = []
+    statuses = [(400, {})] + [(500, {})] * 3
+    monkeypatch.setattr(
+        openai_client.requests.Session, "post", mock_api(statuses, calls)
+    )
+    client = OpenAIClient("sk-test", max_retries=2, backoff_base=0.001)
+
+    with pytest.raises(OpenAIError) as error:
+        client.post("/chat/completions", {"model": "m", "messages": []})
+    assert error.value.status_code == 400
+    assert len(calls) == 1  # Bad requests are not retried
+
+    with pytest.raises(OpenAIError, match="busy"):
+        asyncio.run(client.apost("/chat/completions", {"model": "m", "messages": []}))
+    assert len(calls) == 4
@@ -0,0 +1,180 @@
+from src.pipelines.retrieval_service import (
+    CollectionManager,
+    ReadWriteLock,
+    RetrievalService,
+)
+import threading
+import pytest
+import time
+
+
+def test_knowledge_base_is_only_reloaded_when_its_files_change(
+    make_pipeline, monkeypatch, tmpdir
+):
+    query_pipeline = make_pipeline()
+    service = RetrievalService(query_pipeline, tmpdir.strpath, check_interval=0)
+    loads = []
+    set_sections = query_pipeline.set_sections
+    monkeypatch.setattr(
+        query_pipeline,
+        "set_sections",
+        lambda *args: loads.append(args) or set_sections(*args),
+    )
+
+    service.refresh()
+    service.refresh()
+    assert len(loads) == 1
+
+    service.update_documents(
+        {"doc.md": "# A\nfirst section\n# B\nsecond section"},
+        "text-embedding-3-small",
+    )
+    service.refresh()
+    # The live index already includes the update: no reload from the files
+    assert len(loads) == 1
+    assert list(service.get_texts()) == ["# A\nfirst section", "# B\nsecond section"]
+
+    with service.reader("text-embedding-3-small") as view:
+        assert view.search_keywords("second", 1)[0][0] == "# B\nsecond section"
+
+
+def test_views_do_not_share_model_settings(make_pipeline, tmpdir):
+    service = RetrievalService(make_pipeline(), tmpdir.strpath)
+
+    with service.reader("text-embedding-3-small") as first:
+        with service.reader("text-embedding-3-large") as second:
+            first.model_inference_manager.set_model("gpt-4")
+            assert first.embedder.model == "text-embedding-3-small"
+            assert second.model_inference_manager.model is None
+            assert first.embedder.texts is second.embedder.texts
+    assert service.query_pipeline.embedder.model is None
+
+
+def test_writer_waits_for_readers():
+    lock = ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.write():
+            events.append("write")
+
+    with lock.read():
+        with lock.read():
+            writer = threading.Thread(target=write)
+            writer.start()
+            time.sleep(0.05)
+            events.append("read")
+    writer.join()
+
+    assert events == ["read", "write"]
+
+
+def test_keyword_index_built_by_a_view_is_shared(make_pipeline, tmpdir):
+    service = RetrievalService(make_pipeline(), tmpdir.strpath)
+    service.update_documents({"doc.md": "# A\nfirst section"}, "text-embedding-3-small")
+    assert service.query_pipeline.embedder.lexical_index is None
+
+    with service.reader() as view:
+        view.search_keywords("first", 1)
+    lexical_index = service.query_pipeline.embedder.lexical_index
+    assert lexical_index is not None
+
+    with service.reader() as view:
+        view.search_keywords("first", 1)
+        assert view.embedder.lexical_index is lexical_index
+
+
+def test_collections_are_loaded_lazily_and_kept_apart(make_pipeline, tmpdir):
+    pipelines = []
+    manager = CollectionManager(
+        lambda: pipelines.append(make_pipeline()) or pipelines[-1],
+        tmpdir.strpath,
+    )
+    for collection in ("team-a", "team-b"):
+        manager.create(collection)
+    assert manager.names() == ["default", "team-a", "team-b"]
+    assert pipelines == []
+
+    manager.get("team-a").update_documents(
+        {"a.md": "# A\nteam a section"}, "text-embedding-3-small"
+    )
+    manager.get("team-b").update_documents(
+        {"b.md": "# B\nteam b section"}, "text-embedding-3-small"
+    )
+    assert len(pipelines) == 2
+    with manager.get("team-b").reader("text-embedding-3-small") as view:
+        assert view.find_similar_documents("section", 5) == ["# B\nteam b section"]
+    assert len(pipelines) == 2
+
+    with pytest.raises(ValueError):
+        manager.get("missing")
+    with pytest.raises(ValueError):
+        manager.create("../outside")
+
+
+def test_least_recently_used_collections_are_unloaded(make_pipeline, tmpdir):
+    manager = CollectionManager(make_pipeline, tmpdir.strpath)
+    for collection in ("a", "b", "c"):
+        manager.create(collection)
+        manager.get(collection).update_documents(
+            {"doc.md": f"# {collection}\nsection"}, "text-embedding-3-small"
+        )
+    # The sizes differ slightly (their section IDs are random): any two collections
+    # fit in the budget, all three do not
+    sizes = {
+        name: service.get_memory_usage() for name, service in manager.services.items()
+    }
+    manager.memory_budget = max(
+        sizes["a"] + sizes["b"], sizes["b"] + sizes["c"], sizes["a"] + sizes["c"]
+    )
+    services = dict(manager.services)
+    manager.get("b")
+    manager.get("a")
+    assert list(manager.services) == ["b", "a"]
+
+    # The unloaded collections are closed in the background, and reloaded by the
+    # requests still holding them
+    for name in ("a", "c"):
+        deadline = time.monotonic() + 5
+        while not services[name].closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert services[name].query_pipeline.embedder.document_store is None
+    with services["c"].reader("text-embedding-3-small") as view:
+        assert view.find_similar_documents("section", 1) == ["# c\nsection"]
+
+    # Reloaded from its files on next use
+    with manager.get("c").reader("text-embedding-3-small") as view:
+        assert view.find_similar_documents("section", 1) == ["# c\nsection"]
+    assert list(manager.services) == ["a", "c"]
+
+
+def test_loading_a_collection_does_not_block_the_others(make_pipeline, tmpdir):
+    loading = threading.Event()
+    release = threading.Event()
+
+    def create_pipeline():
+        query_pipeline = make_pipeline()
+        load_and_merge_databases = query_pipeline.load_and_merge_databases
+
+        def slow_load(directory_path, *args):
+            if directory_path.endswith("slow"):
+                loading.set()
+                release.wait(5)
+            return load_and_merge_databases(directory_path, *args)
+
+        query_pipeline.load_and_merge_databases = slow_load
+        return query_pipeline
+
+    manager = CollectionManager(create_pipeline, tmpdir.strpath)
+    manager.create("slow")
+    manager.create("fast")
+    loader = threading.Thread(target=manager.get, args=("slow",))
+    loader.start()
+    assert loading.wait(5)
+
+    with manager.get("fast").reader() as view:
+        assert list(view.embedder.texts) == []
+    assert loader.is_alive()
+    release.set()
+    loader.join()
+    assert list(manager.services) == ["fast", "slow"]
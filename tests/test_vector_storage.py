@@ -0,0 +1,141 @@
+from benchmarks.openai_stand_in import OpenAIStandIn
+from src.models.index_factory import build_faiss_index
+from src.models.openai_client import OpenAIClient
+from src.pipelines.query_pipeline import read_database, write_database
+import numpy as np
+import pytest
+import faiss
+import os
+
+
+def make_vectors(num_vectors=500, dimension=32):
+    vectors = np.random.default_rng(0).standard_normal((num_vectors, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype("float32")
+
+
+@pytest.mark.parametrize(
+    "precision, tolerance", [("float32", 1e-6), ("float16", 1e-3), ("int8", 0.05)]
+)
+def test_reduced_precision_indexes(precision, tolerance):
+    vectors = make_vectors()
+    ids = np.arange(100, 100 + len(vectors))
+    faiss_index = build_faiss_index(
+        vectors.shape[1], [(ids, vectors)], {"precision": precision}
+    )
+
+    if precision != "float32":
+        assert isinstance(
+            faiss.downcast_index(faiss_index.index), faiss.IndexScalarQuantizer
+        )
+    stored = faiss_index.index.reconstruct_n(0, faiss_index.ntotal)
+    assert np.abs(stored - vectors).max() < tolerance
+    _, labels = faiss_index.search(vectors[:10], 1)
+    assert list(labels[:, 0]) == list(ids[:10])
+
+
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        build_faiss_index(4, [], {"precision": "int4"})
+
+
+def test_quantized_database_round_trip(tmpdir):
+    vectors = make_vectors(num_vectors=20)
+    faiss_index = build_faiss_index(
+        vectors.shape[1], [(np.arange(20), vectors)], {"precision": "int8"}
+    )
+    index_path = os.path.join(tmpdir.strpath, "database.bin")
+    texts_path = os.path.join(tmpdir.strpath, "database.json")
+    texts = [f"section {i}" for i in range(20)]
+    embedding = {
+        "model": "text-embedding-3-small",
+        "dimensions": 32,
+        "precision": "int8",
+    }
+    write_database(
+        index_path,
+        texts_path,
+        list(range(20)),
+        texts,
+        [None] * 20,
+        faiss_index,
+        embedding,
+    )
+
+    ids, read_texts, _, read_embedding, read_vectors = read_database(
+        index_path, texts_path
+    )
+    assert ids == list(range(20)) and read_texts == texts
+    assert read_embedding == embedding
+    np.testing.assert_allclose(read_vectors, vectors, atol=0.05)
+
+
+def test_shortened_embeddings_follow_the_loaded_index(make_vectorizer):
+    vectorizer = make_vectorizer()
+    assert "dimensions" not in vectorizer.make_embeddings_payload(["a"])
+    cache_key = vectorizer.get_model_key()
+
+    # The configured size applies until an index is loaded
+    vectorizer.embedding_dimensions = 512
+    assert vectorizer.make_embeddings_payload(["a"])["dimensions"] == 512
+
+    # Queries are then encoded as recorded with the loaded index
+    embedding = vectorizer.get_embedding_settings()
+    vectorizer.set_sections(
+        [1],
+        ["a"],
+        build_faiss_index(256, [(np.arange(1), make_vectors(1, 256))]),
+        dict(embedding, dimensions=256),
+    )
+    assert vectorizer.make_embeddings_payload(["a"])["dimensions"] == 256
+    assert vectorizer.get_model_key() != cache_key
+
+    # Other models would embed the queries in another vector space
+    for model in ("text-embedding-3-large", "text-embedding-ada-002"):
+        vectorizer.set_model(model)
+        with pytest.raises(ValueError):
+            vectorizer.make_embeddings_payload(["a"])
+
+
+def test_configured_size_only_applies_to_models_that_support_it(make_vectorizer):
+    vectorizer = make_vectorizer()
+    vectorizer.embedding_dimensions = 512
+    vectorizer.set_model("text-embedding-ada-002")
+    assert "dimensions" not in vectorizer.make_embeddings_payload(["a"])
+
+
+def test_stand_in_serves_shortened_embeddings(make_vectorizer):
+    with OpenAIStandIn(dimension=16) as stand_in:
+        vectorizer = make_vectorizer(
+            client=OpenAIClient("sk-test", base_url=stand_in.base_url)
+        )
+        vectorizer.embedding_dimensions = 8
+        embeddings, _ = vectorizer.query_openai_embeddings(["a", "b"])
+
+    assert embeddings.shape == (2, 8)
+
+
+def test_databases_record_their_embedding_settings(make_pipeline, monkeypatch, tmpdir):
+    query_pipeline = make_pipeline()
+    query_pipeline.add_documents(
+        {"a.md": "# A\nfirst"}, "text-embedding-3-small", tmpdir.strpath
+    )
+    embedding = {
+        "model": "text-embedding-3-small",
+        "dimensions": None,
+        "precision": "float32",
+    }
+
+    # From the databases, then from the merged index they were cached in
+    for cached in (False, True):
+        fresh_pipeline = make_pipeline()
+        if cached:
+            monkeypatch.setattr(
+                fresh_pipeline, "read_databases", lambda *args: pytest.fail("miss")
+            )
+        fresh_pipeline.load_and_merge_databases(tmpdir.strpath)
+        assert fresh_pipeline.embedder.index_embedding == embedding
+
+    fresh_pipeline.set_model("text-embedding-3-large")
+    with pytest.raises(ValueError):
+        fresh_pipeline.find_similar_documents("first", 1)